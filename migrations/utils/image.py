@@ -9,6 +9,8 @@ Lengths = namedtuple('lengths', ['x', 'y'])
 Canvas = Lengths
 DEFAULT_CANVAS = Canvas(39, 26)
 
+#A frozen copy of how art was drawn when these migrations were written, so that
+#upgrading an old database gives the same images whatever the app renders now
 def decode_art_to_image(pixel_art_color_encoding, color_mapping
     , canvas_size=DEFAULT_CANVAS, scale=200):
     ratio = (3, 2)
@@ -0,0 +1,34 @@
+"""slug counters
+
+Revision ID: 2f6d8b4e0c93
+Revises: 9e4b2d7c1a68
+Create Date: 2026-10-18 17:48:02.611370
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f6d8b4e0c93'
+down_revision = '9e4b2d7c1a68'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('slug_counters',
+    sa.Column('slug', sa.String(length=60), nullable=False),
+    sa.Column('last_number', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('slug')
+    )
+    #start each counter from the highest number among the existing slugs
+    op.execute("""INSERT INTO slug_counters (slug, last_number)
+                  SELECT substring(slug from '^(.*)#[0-9]+$'), max(substring(slug from '#([0-9]+)$')::integer)
+                  FROM artpieces
+                  WHERE slug ~ '#[0-9]+$'
+                  GROUP BY 1""")
+
+
+def downgrade():
+    op.drop_table('slug_counters')
@@ -0,0 +1,74 @@
+"""packed color block pixels
+
+Revision ID: 3d8f2a6b1e07
+Revises: 7b3e1d9c4a52
+Create Date: 2026-10-18 15:02:11.540196
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.utils.pixel_packing import pack_pixels, unpack_pixels
+
+
+# revision identifiers, used by Alembic.
+revision = '3d8f2a6b1e07'
+down_revision = '7b3e1d9c4a52'
+branch_labels = None
+depends_on = None
+
+color_blocks = sa.table('color_blocks',
+    sa.column('id', sa.Integer),
+    sa.column('artpiece_id', sa.Integer),
+    sa.column('color_id', sa.Integer),
+    sa.column('coordinates', sa.JSON),
+    sa.column('pixels', sa.LargeBinary),
+)
+
+PAGE_SIZE = 500 #color blocks read at a time, so the whole table is never held in memory
+
+def color_block_pages(connection, column):
+    # Pages of color blocks with the given column, in order of id
+    last_id = None
+    while True:
+        query = sa.select([color_blocks.c.id, color_blocks.c.artpiece_id, color_blocks.c.color_id, column])
+        if last_id is not None:
+            query = query.where(color_blocks.c.id > last_id)
+        rows = connection.execute(query.order_by(color_blocks.c.id).limit(PAGE_SIZE)).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+def color_block_key(row):
+    return ((color_blocks.c.id == row.id)
+            & (color_blocks.c.artpiece_id == row.artpiece_id)
+            & (color_blocks.c.color_id == row.color_id))
+
+
+def upgrade():
+    op.add_column('color_blocks', sa.Column('pixels', sa.LargeBinary(), nullable=True))
+
+    connection = op.get_bind()
+    for rows in color_block_pages(connection, color_blocks.c.coordinates):
+        for row in rows:
+            connection.execute(color_blocks.update()
+                               .where(color_block_key(row))
+                               .values(pixels=pack_pixels(row.coordinates)))
+
+    op.alter_column('color_blocks', 'pixels', nullable=False)
+    op.drop_column('color_blocks', 'coordinates')
+
+
+def downgrade():
+    op.add_column('color_blocks', sa.Column('coordinates', sa.JSON(), nullable=True))
+
+    connection = op.get_bind()
+    for rows in color_block_pages(connection, color_blocks.c.pixels):
+        for row in rows:
+            connection.execute(color_blocks.update()
+                               .where(color_block_key(row))
+                               .values(coordinates=unpack_pixels(row.pixels).tolist()))
+
+    op.alter_column('color_blocks', 'coordinates', nullable=False)
+    op.drop_column('color_blocks', 'pixels')
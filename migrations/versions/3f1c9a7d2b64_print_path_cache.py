@@ -0,0 +1,38 @@
+"""print path cache
+
+Revision ID: 3f1c9a7d2b64
+Revises: 89e56a30bc94
+Create Date: 2026-10-18 10:12:41.220817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7d2b64'
+down_revision = '89e56a30bc94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('print_path_cache',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('cache_key', sa.String(length=64), nullable=False),
+    sa.Column('artpiece_id', sa.Integer(), nullable=False),
+    sa.Column('order', sa.JSON(), nullable=False),
+    sa.Column('travel_before_mm', sa.Float(), nullable=False),
+    sa.Column('travel_after_mm', sa.Float(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['artpiece_id'], ['artpieces.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_print_path_cache_cache_key'), 'print_path_cache', ['cache_key'], unique=True)
+    op.create_index(op.f('ix_print_path_cache_artpiece_id'), 'print_path_cache', ['artpiece_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_print_path_cache_artpiece_id'), table_name='print_path_cache')
+    op.drop_index(op.f('ix_print_path_cache_cache_key'), table_name='print_path_cache')
+    op.drop_table('print_path_cache')
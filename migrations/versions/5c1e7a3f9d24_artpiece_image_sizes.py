@@ -0,0 +1,24 @@
+"""artpiece image sizes
+
+Revision ID: 5c1e7a3f9d24
+Revises: 3d8f2a6b1e07
+Create Date: 2026-10-18 16:21:37.904512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e7a3f9d24'
+down_revision = '3d8f2a6b1e07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('artpieces', sa.Column('image_sizes', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('artpieces', 'image_sizes')
@@ -0,0 +1,32 @@
+"""monthly submission counts
+
+Revision ID: 6a0c3e9b5d71
+Revises: 2f6d8b4e0c93
+Create Date: 2026-10-18 18:20:55.173046
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a0c3e9b5d71'
+down_revision = '2f6d8b4e0c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('monthly_submission_counts',
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('month')
+    )
+    op.execute("""INSERT INTO monthly_submission_counts (month, count)
+                  SELECT date_trunc('month', submit_date)::date, count(*)
+                  FROM artpieces
+                  GROUP BY 1""")
+
+
+def downgrade():
+    op.drop_table('monthly_submission_counts')
@@ -0,0 +1,42 @@
+"""job status
+
+Revision ID: 7b3e1d9c4a52
+Revises: c5e2a90f4d17
+Create Date: 2026-10-18 14:12:40.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3e1d9c4a52'
+down_revision = 'c5e2a90f4d17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    job_status_enum = sa.Enum('Generating', 'Ready', 'Failed', name='jobstatus')
+    job_status_enum.create(op.get_bind())
+
+    op.add_column('jobs', sa.Column('status', job_status_enum, nullable=True))
+    op.add_column('jobs', sa.Column('progress', sa.JSON(), nullable=True))
+
+    op.execute("""UPDATE jobs SET status = 'Ready'""")
+
+    op.alter_column('jobs', 'status', nullable=False)
+    op.alter_column('jobs', 'file_name', existing_type=sa.String(length=50), nullable=True)
+
+
+def downgrade():
+    op.execute("""DELETE FROM job_artpiece_association
+                  WHERE job_id IN (SELECT id FROM jobs WHERE file_name IS NULL)""")
+    op.execute("""DELETE FROM jobs WHERE file_name IS NULL""")
+    op.alter_column('jobs', 'file_name', existing_type=sa.String(length=50), nullable=False)
+
+    op.drop_column('jobs', 'progress')
+    op.drop_column('jobs', 'status')
+
+    job_status_enum = sa.Enum('Generating', 'Ready', 'Failed', name='jobstatus')
+    job_status_enum.drop(op.get_bind())
@@ -0,0 +1,34 @@
+"""artpiece image status
+
+Revision ID: 9e4b2d7c1a68
+Revises: 5c1e7a3f9d24
+Create Date: 2026-10-18 17:05:48.226913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b2d7c1a68'
+down_revision = '5c1e7a3f9d24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    image_status_enum = sa.Enum('Pending', 'Stored', 'Failed', name='imagestatus')
+    image_status_enum.create(op.get_bind())
+
+    op.add_column('artpieces', sa.Column('image_status', image_status_enum, nullable=True))
+
+    op.execute("""UPDATE artpieces SET image_status = 'Stored'""")
+
+    op.alter_column('artpieces', 'image_status', nullable=False)
+
+
+def downgrade():
+    op.drop_column('artpieces', 'image_status')
+
+    image_status_enum = sa.Enum('Pending', 'Stored', 'Failed', name='imagestatus')
+    image_status_enum.drop(op.get_bind())
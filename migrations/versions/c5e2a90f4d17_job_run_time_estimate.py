@@ -0,0 +1,24 @@
+"""job run time estimate
+
+Revision ID: c5e2a90f4d17
+Revises: 3f1c9a7d2b64
+Create Date: 2026-10-18 11:02:17.504933
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e2a90f4d17'
+down_revision = '3f1c9a7d2b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('jobs', sa.Column('run_time_estimate', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('jobs', 'run_time_estimate')
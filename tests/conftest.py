@@ -50,12 +50,31 @@ properties3 = [
 VALID_PLATE['ccl_artbot_canvas_60mm_round'] = ('ccl_artbot_canvas_60mm_round','labware', properties3)
 
 
-### Register PyTest marks ###
+### Register PyTest options and marks ###
+
+def pytest_addoption(parser):
+    parser.addoption('--benchmark', action='store_true',
+        help='run the procedure generation benchmarks and compare them to the saved baseline')
+    parser.addoption('--benchmark-save', action='store_true',
+        help='save the benchmark results as the new baseline')
+    parser.addoption('--benchmark-tolerance', type=float, default=0.25,
+        help='fraction by which a benchmark may be slower than its baseline before it fails')
 
 def pytest_configure(config):
     config.addinivalue_line(
         "markers", "fill_canvas: mark test to run using a completely-filled artpiece"
     )
+    config.addinivalue_line(
+        "markers", "benchmark: slow performance benchmark, only run with --benchmark"
+    )
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--benchmark') or config.getoption('--benchmark-save'):
+        return
+    skip_benchmark = pytest.mark.skip(reason='benchmarks only run with --benchmark')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip_benchmark)
 
 
 ### Context Management Fixtures ###
@@ -1,7 +1,13 @@
+import math
 import pytest
+import numpy as np
 from web.api.user.colors import get_all_colors
+from web.api.art_image import render_art
+from web.database.models import ColorBlockModel
+from web.database.pixel_packing import pack_pixels, unpack_pixels, RUN_LENGTH, BITMAP
+from migrations.utils import pixel_packing as migration_pixel_packing
 from migrations.utils.image import (migrate_colors, extend_color_names_to_ids
-        , replace_color_names)
+        , replace_color_names, decode_art_to_image, Canvas)
 
 def get_color_names_to_ids():
     return {bc.name: str(bc.id) for bc in get_all_colors()}
@@ -48,3 +54,47 @@ def test_migration_from_color_ids_to_deprecated_names(deprecated_color, color):
     art = {color_id: [[0, 0]]}
     migrated_art = migrate_colors(art, color_ids_to_names)
     assert art[color_id] == migrated_art[deprecated_color]
+
+
+@pytest.mark.parametrize('coordinates,encoding', [
+    ([], RUN_LENGTH),
+    ([[3, 4], [3, 5], [3, 6], [20, 30]], RUN_LENGTH),
+    ([[y, x] for y in range(40) for x in range(40) if (x + y) % 2], BITMAP),
+    ([[0, 0], [32767, 32767]], RUN_LENGTH),
+])
+def test_packed_pixels_round_trip(coordinates, encoding):
+    packed = pack_pixels(coordinates)
+    assert packed[:1] == encoding
+    expected = sorted(coordinates)
+    assert unpack_pixels(memoryview(packed)).tolist() == expected
+
+#The app must read the pixels that the migration to packed pixels wrote
+@pytest.mark.parametrize('coordinates', [[], [[3, 4], [3, 5], [20, 30]], [[y, x] for y in range(40) for x in range(40) if (x + y) % 2]])
+def test_migration_packed_pixels_unpack(coordinates):
+    assert unpack_pixels(migration_pixel_packing.pack_pixels(coordinates)).tolist() == sorted(coordinates)
+    assert migration_pixel_packing.unpack_pixels(pack_pixels(coordinates)).tolist() == sorted(coordinates)
+
+def test_packed_pixels_out_of_range():
+    with pytest.raises(ValueError):
+        pack_pixels([[-1, 0]])
+
+def test_color_block_coordinates_accessor():
+    color_block = ColorBlockModel(color_id=1, coordinates=[[2, 1], [0, 0], [2, 0]])
+    assert color_block.coordinates == [[0, 0], [2, 0], [2, 1]]
+    assert color_block.pixel_array is color_block.pixel_array
+    assert not color_block.pixel_array.flags.writeable
+    color_block.coordinates = [[5, 5]]
+    assert np.array_equal(color_block.pixel_array, [[5, 5]])
+
+#render_art must draw art exactly as the migrations' frozen copy of the old rectangle drawing does
+@pytest.mark.parametrize('canvas_size,scale', [(Canvas(39, 26), 200), (Canvas(7, 5), 50), (Canvas(300, 200), 120)])
+def test_render_art_matches_migration_drawing(canvas_size, scale):
+    rng = np.random.default_rng(0)
+    color_mapping = {'pink': (255,192,203,1), 'blue': (0,0,255,1), 'teal': (0,128,128,1)}
+    art = {color: rng.integers(0, (canvas_size.y + 1, canvas_size.x + 1), size=(60, 2)).tolist()
+           for color in color_mapping}
+    art['blue'] += art['pink'][:10] #drawn over
+    pixel_size = (3 * scale / canvas_size.x, 2 * scale / canvas_size.y)
+    image_size = (math.ceil(3 * scale + pixel_size[0]), math.ceil(2 * scale + pixel_size[1]))
+    assert (render_art(art, color_mapping, pixel_size, image_size, mode='RGBA').tobytes()
+            == decode_art_to_image(art, color_mapping, canvas_size, scale))
@@ -0,0 +1,188 @@
+"""
+Benchmarks for procedure generation, the slow path behind every print request.
+
+Synthetic artpieces are built from 26x26 up to 400x400 pixels with sparse,
+dense and striped fills. Each case times get_spacing, optimize_print_order,
+pixel_lines and the whole make_procedure, and records the travel distance of
+the resulting paths and the estimated robot run time.
+
+These only run when asked for:
+    pytest tests/test_procedure_benchmarks.py --benchmark
+Results are written to BENCHMARK_RESULTS and compared to BENCHMARK_BASELINE.
+A case fails when it is more than --benchmark-tolerance slower than the
+baseline, or when its paths are longer. Save a new baseline with
+--benchmark-save after an intended change, on the machine you compare on.
+"""
+import pytest
+import os
+import json
+import time
+import random
+from web.robot.art_processor import make_procedure
+from web.robot.procedure_line_injector import ProcedureLineInjector
+from web.robot.path_refinement import path_length
+from web.api.lab_objects.lab_objects import LabObject
+from web.api.user.artpiece.core import create_artpiece
+from web.database.models import JobModel
+from .conftest import VALID_EMAIL, VALID_TITLE, VALID_PLATE
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(__file__), 'benchmarks')
+BENCHMARK_BASELINE = os.path.join(BENCHMARK_DIR, 'procedure_generation_baseline.json')
+BENCHMARK_RESULTS = os.path.join(BENCHMARK_DIR, 'procedure_generation_latest.json')
+
+SIZES = [26, 100, 400]
+FILLS = ['sparse', 'dense', 'striped']
+ARTPIECE_COUNTS = [1, 9]
+NUM_COLORS = 5
+SPARSE_FILL = 0.1 #fraction of pixels painted in sparse art
+BENCHMARK_CANVAS = 'ccl_artbot_canvas_90mm_round'
+
+MIN_SLOWDOWN_S = 0.01 #differences below this are timer noise, whatever the tolerance
+QUALITY_TOLERANCE = 1e-6 #paths are deterministic, so any growth is a regression
+
+
+def synthetic_art(size, fill, seed):
+    # Art as the web app sends it: {color: [[y, x], ...]}
+    rand = random.Random(seed)
+    art = dict()
+    for x in range(size):
+        for y in range(size):
+            if fill == 'sparse':
+                if rand.random() >= SPARSE_FILL:
+                    continue
+                color = rand.randint(1, NUM_COLORS)
+            elif fill == 'dense':
+                color = rand.randint(1, NUM_COLORS)
+            elif fill == 'striped': #one-pixel rows of each color, with a blank row between stripes
+                if y % 2:
+                    continue
+                color = (y // 2) % NUM_COLORS + 1
+            else:
+                raise ValueError(f'Unknown fill: {fill}')
+            art.setdefault(str(color), []).append([y, x])
+    return art
+
+
+def timed(function, *args, repeat=1):
+    # Best of repeat runs, in seconds, and the result of the last run
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+def regressions(result, baseline, tolerance):
+    # Descriptions of every way result is worse than baseline
+    found = []
+    for stage, seconds in result['seconds'].items():
+        base = baseline['seconds'].get(stage)
+        if base is not None and seconds > base * (1 + tolerance) and seconds - base > MIN_SLOWDOWN_S:
+            found.append(f'{stage} took {seconds:.3f} s, baseline {base:.3f} s')
+    quality = dict(result['travel_mm'], estimated_run_s=result['estimated_run_s'])
+    base_quality = dict(baseline['travel_mm'], estimated_run_s=baseline['estimated_run_s'])
+    for metric, value in quality.items():
+        base = base_quality.get(metric)
+        if base is not None and value is not None and value > base * (1 + QUALITY_TOLERANCE):
+            found.append(f'{metric} is {value:.1f}, baseline {base:.1f}')
+    return found
+
+
+@pytest.fixture(scope='session')
+def benchmark_results(request):
+    results = dict()
+    yield results
+    if not results:
+        return
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    with open(BENCHMARK_RESULTS, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+    if request.config.getoption('--benchmark-save'):
+        baseline = dict()
+        if os.path.exists(BENCHMARK_BASELINE):
+            with open(BENCHMARK_BASELINE) as baseline_file:
+                baseline = json.load(baseline_file)
+        baseline.update(results) #cases that were not run keep their old baseline
+        with open(BENCHMARK_BASELINE, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+
+
+@pytest.fixture(scope='session')
+def benchmark_baseline(request):
+    if request.config.getoption('--benchmark-save') or not os.path.exists(BENCHMARK_BASELINE):
+        return dict()
+    with open(BENCHMARK_BASELINE) as baseline_file:
+        return json.load(baseline_file)
+
+
+@pytest.fixture(scope='function')
+def benchmark_canvas():
+    canvas = LabObject.create_new(*VALID_PLATE[BENCHMARK_CANVAS])
+    canvas.save()
+    return canvas
+
+
+@pytest.mark.benchmark
+@pytest.mark.usefixtures('test_app', 'clear_database')
+@pytest.mark.parametrize('num_artpieces', ARTPIECE_COUNTS)
+@pytest.mark.parametrize('fill', FILLS)
+@pytest.mark.parametrize('size', SIZES)
+def test_procedure_generation_benchmark(size, fill, num_artpieces, benchmark_canvas, test_database,
+                                        benchmark_results, benchmark_baseline, request):
+    case = f'{size}x{size}-{fill}-{num_artpieces}'
+    canvas_size = {'x': size, 'y': size}
+    artpieces = []
+    for i in range(num_artpieces):
+        art = synthetic_art(size, fill, seed=i)
+        artpiece = create_artpiece(VALID_EMAIL + str(i), f'{VALID_TITLE} {i}', art, canvas_size)
+        artpiece.confirm()
+        artpieces.append(artpiece._model)
+    test_database.session.commit()
+    artpiece_ids = [artpiece.id for artpiece in artpieces]
+
+    injector = ProcedureLineInjector()
+    spacing_s, (well_radius, wellspacing, x_max_mm, y_max_mm) = timed(
+            injector.get_spacing, benchmark_canvas, canvas_size, repeat=1000)
+
+    blocks = [injector.plate_location_map_batch(color_block.pixel_array, benchmark_canvas,
+                                                well_radius, wellspacing, x_max_mm, y_max_mm)
+              for artpiece in artpieces for color_block in artpiece.color_blocks]
+    order_s, order_mm = 0.0, 0.0
+    for plate_positions in blocks:
+        seconds, ordered = timed(injector.optimize_print_order, plate_positions, 1 / well_radius)
+        order_s += seconds
+        order_mm += path_length(ordered) * well_radius
+
+    def write_pixel_lines():
+        pixel_injector = ProcedureLineInjector()
+        lines = pixel_injector.pixel_lines(artpieces, benchmark_canvas)
+        for _ in lines['%%PIXELS GO HERE%%']:
+            pass
+        return pixel_injector
+    pixel_lines_s, pixel_injector = timed(write_pixel_lines)
+    pixel_lines_mm = sum(block['after_mm'] for block in pixel_injector.travel_report)
+
+    procedure_s, (status, procedure_path) = timed(
+            make_procedure, artpiece_ids, None, test_database.engine.url, None, 9,
+            {'notebook': False, 'palette': 'corning_96_wellplate_360ul_flat',
+             'pipette': 'p300_single', 'canvas': benchmark_canvas.name})
+    assert procedure_path is not None, status
+    test_database.session.expire_all()
+    job = test_database.session.query(JobModel).filter(JobModel.file_name == procedure_path[1]).one()
+    os.remove(os.path.join(*procedure_path))
+
+    result = {'pixels': sum(len(block) for block in blocks),
+              'seconds': {'get_spacing': spacing_s,
+                          'optimize_print_order': order_s,
+                          'pixel_lines': pixel_lines_s,
+                          'make_procedure': procedure_s},
+              'travel_mm': {'optimize_print_order': order_mm,
+                            'pixel_lines': pixel_lines_mm},
+              'estimated_run_s': job.run_time_estimate['total_s'] if job.run_time_estimate else None}
+    benchmark_results[case] = result
+
+    if case in benchmark_baseline:
+        found = regressions(result, benchmark_baseline[case], request.config.getoption('--benchmark-tolerance'))
+        assert not found, f'{case}: ' + '; '.join(found)
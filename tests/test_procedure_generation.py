@@ -2,10 +2,34 @@ from flask.globals import request
 import pytest
 import os
 import math
+import random
+import itertools
+import numpy as np
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone
 from difflib import ndiff
 from flask import current_app
-from web.robot.art_processor import make_procedure
+from web.robot import art_processor
+from web.robot.art_processor import make_procedure, make_procedures
+from web.robot import procedure_line_injector
 from web.robot.procedure_line_injector import ProcedureLineInjector
+from web.robot import path_refinement
+from web.robot.path_refinement import path_length, refine_print_order, move_budget, DRYING_WINDOW
+from web.robot.curve_ordering import hilbert_index, serpentine_index
+from web.robot.drying import DryingModel
+from web.robot.run_time_estimator import RunTimeEstimator
+from web.robot.liquid_schedule import LiquidScheduler, fixed_schedule, aspiration_capacity
+from web.robot.batch_packer import BatchPacker, batch_colors, palette_reloads
+from web.robot.procedure_template import ProcedureTemplate
+from web.robot.procedure_store import ProcedureStore, LocalProcedureBackend
+from web.robot.procedure_progress import ProcedureProgress
+from web.api.lab_objects.lab_objects import LabObject
+from web.api.user.artpiece import Artpiece
+from web.api.user.artpiece.precompute import precompute_print_paths, precompute_print_paths_async, canvas_types
+from web.api.user.artpiece.procedure_jobs import (generate_procedure_async, generate_procedure_runs_async,
+                                                  job_procedure_uri, job_procedure_uris)
+from web.database.models import PrintPathCacheModel, JobModel, JobStatus, SuperUserModel
+from .conftest import VALID_PLATE
 
 procedureLineInjector = ProcedureLineInjector()
 
@@ -86,6 +110,404 @@ def test_optimize_print_order_weak(art_params, generate_random_art):
         ordered_path = optimize_print_order(unordered_path, units_per_mm=1/100) #assume a very big plate
         assert calc_path_distance(ordered_path) <= unordered_distance
 
+#The spatial index must walk exactly the same path as the linear scan
+@pytest.mark.parametrize('art_params', [(5,39,26), (1,50,50), (10,25,25)])
+@pytest.mark.parametrize('units_per_mm', [1/100, 1/25, 1])
+def test_optimize_print_order_grid_matches_linear(art_params, units_per_mm, generate_random_art):
+    linear_injector = ProcedureLineInjector(nn_engine='linear')
+    grid_injector = ProcedureLineInjector(nn_engine='grid')
+
+    unordered_art = generate_random_art(*art_params)
+    for color in unordered_art:
+        unordered_path = unordered_art[color]
+        linear_path = linear_injector.optimize_print_order(list(unordered_path), units_per_mm)
+        grid_path = grid_injector.optimize_print_order(list(unordered_path), units_per_mm)
+        assert grid_path == linear_path
+
+#Refinement may only shorten the path, and must not place more points too close to recently printed ones
+@pytest.mark.parametrize('art_params', [(5,39,26), (1,50,50)])
+def test_refine_print_order(art_params, generate_random_art):
+    units_per_mm = 1/25
+    required_gap = 2 * units_per_mm
+
+    def drying_violations(points, order):
+        path = [points[i] for i in order]
+        return sum(1 for p, point in enumerate(path)
+                     for previous in path[max(p - DRYING_WINDOW, 0):p]
+                     if round(euclidean_distance(previous, point), 5) < required_gap)
+
+    art = generate_random_art(*art_params)
+    for color in art:
+        points = np.array(art[color]) / 25
+        greedy_order = procedureLineInjector.print_order(points, units_per_mm)
+        order, before, after = refine_print_order(points, greedy_order, required_gap, passes=1)
+
+        assert sorted(order.tolist()) == list(range(len(points)))
+        assert round(before, 5) == round(path_length(points, greedy_order), 5)
+        assert round(after, 5) == round(path_length(points, order), 5)
+        assert after <= before + 1e-9
+        assert drying_violations(points, order) <= drying_violations(points, greedy_order)
+
+#However many sweeps are allowed, a large block stops after its move budget
+def test_refine_print_order_move_budget(monkeypatch):
+    evaluated = []
+    for name in ('try_two_opt', 'try_or_opt'):
+        move = getattr(path_refinement._Path, name)
+        monkeypatch.setattr(path_refinement._Path, name, lambda path, *args, move=move: evaluated.append(1) or move(path, *args))
+
+    points = np.random.default_rng(0).integers(0, 200, size=(5000, 2)) / 25
+    greedy_order = procedureLineInjector.print_order(points, 1/25)
+    order, before, after = refine_print_order(points, greedy_order, 2/25, passes=100)
+    assert len(evaluated) == move_budget(len(points)) < len(points)
+    assert sorted(order.tolist()) == list(range(len(points)))
+    assert after <= before
+
+    evaluated.clear()
+    assert refine_print_order(points, greedy_order, 2/25, passes=100)[0].tolist() == order.tolist()
+    assert len(evaluated) == move_budget(len(points))
+
+#The deck plan must be the shortest way to visit every plate, checked against brute force
+@pytest.mark.parametrize('num_plates', [1, 2, 4, 5])
+def test_plan_deck_order(num_plates):
+    random.seed(num_plates)
+    slots = random.sample(range(1, 10), num_plates)
+    paths = dict()
+    for slot in slots:
+        center = procedureLineInjector.slot_center(slot)
+        paths[f'art-{slot}'] = (center + np.random.uniform(-40, 40, 2), center + np.random.uniform(-40, 40, 2))
+    start = procedureLineInjector.slot_center(procedureLineInjector.PALETTE_SLOT)
+
+    def travel(plan):
+        position, total = start, 0
+        for slug, reverse in plan:
+            first, last = paths[slug][::-1] if reverse else paths[slug]
+            total += euclidean_distance(position, first)
+            position = last
+        return total
+
+    plan, planned, unplanned = procedureLineInjector.plan_deck_order(paths, start)
+    assert sorted(slug for slug, reverse in plan) == sorted(paths)
+    assert round(planned, 5) == round(travel(plan), 5)
+    assert round(unplanned, 5) == round(travel([(slug, False) for slug in paths]), 5)
+
+    shortest = min(travel(list(zip(slugs, reverses)))
+                   for slugs in itertools.permutations(paths)
+                   for reverses in itertools.product((False, True), repeat=num_plates))
+    assert round(planned, 5) == round(shortest, 5)
+
+def test_curve_indices_visit_neighbours():
+    x, y = np.meshgrid(np.arange(8), np.arange(8))
+    x, y = x.ravel(), y.ravel()
+    for curve_index in (hilbert_index, serpentine_index):
+        along = curve_index(x, y)
+        assert sorted(along.tolist()) == list(range(64))
+        order = np.argsort(along)
+        assert (np.abs(np.diff(x[order])) + np.abs(np.diff(y[order])) == 1).all()
+
+#Curve orders must print every point once, and keep the drying gap at least as well as the greedy walk
+@pytest.mark.parametrize('ordering', ['hilbert', 'serpentine'])
+@pytest.mark.parametrize('art_params', [(5,39,26), (1,50,50)])
+def test_curve_print_order(ordering, art_params, generate_random_art):
+    units_per_mm = 1/25
+    required_gap = 2 * units_per_mm
+
+    def drying_violations(points, order):
+        path = [points[i] for i in order]
+        return sum(1 for p, point in enumerate(path)
+                     for previous in path[max(p - DRYING_WINDOW, 0):p]
+                     if round(euclidean_distance(previous, point), 5) < required_gap)
+
+    curve_injector = ProcedureLineInjector(ordering=ordering)
+    art = generate_random_art(*art_params)
+    for color in art:
+        points = np.array(art[color]) / 25
+        order = curve_injector.print_order(points, units_per_mm)
+        assert sorted(order.tolist()) == list(range(len(points)))
+        assert drying_violations(points, order) <= drying_violations(points, procedureLineInjector.print_order(points, units_per_mm))
+
+    with pytest.raises(ValueError):
+        ProcedureLineInjector(ordering='random')
+
+def test_drying_model_early_revisits():
+    drying_model = DryingModel(drying_time_s=2, radius_mm=2, gantry_speed=math.inf, well_time_s=0.5)
+    points = np.array([[0, 0], [1, 0], [10, 0], [20, 0], [30, 0]])
+    assert drying_model.dispense_times(points, np.arange(5), 1).tolist() == [0, 0.5, 1, 1.5, 2]
+    #[1, 0] is dispensed 0.5 s after its neighbour [0, 0], or 2 s after it when it goes last
+    assert drying_model.early_revisits(points, np.arange(5), 1) == 1
+    assert drying_model.early_revisits(points, [0, 2, 3, 4, 1], 1) == 0
+    assert DryingModel(drying_time_s=2.5, radius_mm=2, gantry_speed=math.inf).early_revisits(points, [0, 2, 3, 4, 1], 1) == 1
+
+#Timed orders must print every point once, and leave fewer wells next to wet ones than the distance rule
+@pytest.mark.parametrize('art_params', [(5,39,26), (1,50,50)])
+def test_timed_print_order(art_params, generate_random_art):
+    units_per_mm = 1/25
+    timed_injector = ProcedureLineInjector(ordering='timed')
+    art = generate_random_art(*art_params)
+    timed_revisits = greedy_revisits = 0
+    for color in art:
+        points = np.array(art[color]) / 25
+        order = timed_injector.print_order(points, units_per_mm)
+        assert sorted(order.tolist()) == list(range(len(points)))
+        timed_revisits += timed_injector.drying_model.early_revisits(points, order, units_per_mm)
+        greedy_revisits += timed_injector.drying_model.early_revisits(points, procedureLineInjector.print_order(points, units_per_mm), units_per_mm)
+    assert timed_revisits <= greedy_revisits
+
+#Blocks missing from the path cache are optimized, cached, and counted in the report like cached ones
+def test_optimize_color_blocks_without_cached_paths(generate_random_art):
+    art = generate_random_art(3, 39, 26)
+    artpiece = SimpleNamespace(id=1, slug='art#1', canvas_size={'x': 39, 'y': 26},
+                               color_blocks=[SimpleNamespace(color_id=color, pixel_array=np.array(pixels)) for color, pixels in art.items()])
+    canvas = SimpleNamespace(name='canvas', shape='rectangle', x_radius_mm=40, y_radius_mm=25, z_touch_position_frac=0.5, properties={})
+    cached = []
+    path_cache = SimpleNamespace(get=lambda keys: dict(), put=lambda *entry: cached.append(entry))
+
+    injector = ProcedureLineInjector(path_cache=path_cache)
+    blocks = injector.optimize_color_blocks([artpiece], canvas)
+    assert len(blocks) == len(cached) == len(art)
+    assert injector.ordering_report['cached'] == 0
+    assert injector.ordering_report['early_revisits'] == sum(
+            injector.drying_model.early_revisits(plate_positions, order, 1 / well_radius)
+            for _, _, plate_positions, well_radius, (order, *_) in blocks)
+
+#Farming color blocks out to worker processes must not change the result, refinement included
+@pytest.mark.parametrize('art_params', [(5,39,26), (10,25,25)])
+def test_optimize_blocks_parallel_matches_serial(art_params, generate_random_art):
+    art = generate_random_art(*art_params)
+    blocks = [(np.array(art[color]) / 25, 1/25) for color in art]
+
+    serial = ProcedureLineInjector(refine_passes=1, workers=0).optimize_blocks(blocks)
+    parallel = ProcedureLineInjector(refine_passes=1, workers=2).optimize_blocks(blocks)
+    assert len(parallel) == len(serial) == len(blocks)
+    for (serial_order, serial_before, serial_after), (parallel_order, parallel_before, parallel_after) in zip(serial, parallel):
+        assert serial_order.tolist() == parallel_order.tolist()
+        assert (serial_before, serial_after) == (parallel_before, parallel_after)
+
+#Injectors asking for the same number of workers share a pool, and others get a pool of their own size
+def test_process_pools_by_worker_count():
+    assert procedure_line_injector._get_pool(2) is procedure_line_injector._get_pool(2)
+    assert procedure_line_injector._get_pool(3)._max_workers == 3
+    assert procedure_line_injector._get_pool(2)._max_workers == 2
+
+#Only the touch_tip after each aspiration costs time here, so the estimate counts aspirations
+def test_run_time_estimator_counts_aspirations():
+    estimator = RunTimeEstimator('p20_single_gen2', vol=0.5, disposal_vol=2, gantry_speed=math.inf,
+                                 well_overhead_s=0, touch_tip_s=100, pick_up_tip_s=0, drop_tip_s=0)
+    wells = np.zeros((100, 2))
+    run_time = estimator.estimate({'1': [('art-1', wells[:60]), ('art-2', wells[60:])]},
+                                  palette=(0, 0), tiprack=(0, 0), trash=(0, 0))
+
+    #aspirations before wells 0, 36 and 72: 20uL, then 18uL to top up to 20uL, then the last 14uL
+    expected = 3 * 100 + (20 + 18 + 14) / 7.56 + 100 * 0.5 / 7.56
+    assert round(run_time['total_s'], 5) == round(expected, 5)
+    assert round(run_time['by_color']['1'], 5) == round(expected, 5)
+    assert round(sum(run_time['by_plate'].values()), 5) == round(expected, 5)
+    assert run_time['by_plate']['art-1'] > run_time['by_plate']['art-2']
+
+def test_run_time_estimator_travel():
+    path = np.array([[0, 0], [100, 0], [100, 100]])
+    slow = RunTimeEstimator('p300_single', 0.4, 2, gantry_speed=100).estimate({'1': [('art', path)]}, (0, 0), (0, 0), (0, 0))
+    fast = RunTimeEstimator('p300_single', 0.4, 2, gantry_speed=200).estimate({'1': [('art', path)]}, (0, 0), (0, 0), (0, 0))
+    #palette and tips are at the first well. The gantry travels 100mm to each other well and 100 * sqrt(2) mm to the trash
+    assert round(slow['total_s'] - fast['total_s'], 5) == round((200 + 100 * math.sqrt(2)) / 200, 5)
+
+    with pytest.raises(ValueError):
+        RunTimeEstimator('unknown_pipette', 0.4, 2)
+
+#The fallback schedule must be the aspirations distribute_to_agar makes
+def test_fixed_schedule_matches_distribute_to_agar():
+    assert fixed_schedule(100, 20, 0.5, 2) == [(36, 20.0, True), (36, 18.0, False), (28, 14.0, False)]
+
+#Runs must fit in the tip and cover every well, and split where the palette is closest
+@pytest.mark.parametrize('art_params', [(5,39,26), (1,50,50)])
+def test_liquid_schedule(art_params, generate_random_art):
+    scheduler = LiquidScheduler(20, 0.4, 2, aspiration_overhead_s=0)
+    capacity = aspiration_capacity(20, 0.4, 2)
+    for color, pixels in generate_random_art(*art_params).items():
+        path = np.array(pixels, dtype=float)
+        schedule = scheduler.schedule(path, (0, 0))
+        assert sum(wells for wells, _, _ in schedule) == len(path)
+        assert all(0 < wells <= capacity for wells, _, _ in schedule)
+        assert schedule[0][2]
+        for wells, asp_vol, new_tip in schedule:
+            assert round(asp_vol, 4) == round(wells * 0.4 + (2 if new_tip else 0), 4)
+
+    #a line of 60 wells is split where it passes closest to the palette
+    path = np.array([[i, 10] for i in range(60)], dtype=float)
+    assert [wells for wells, _, _ in scheduler.schedule(path, (29.5, 0))] == [30, 30]
+
+#A schedule with fewer aspirations must be estimated to take less time
+def test_run_time_estimator_follows_schedule():
+    estimator = RunTimeEstimator('p20_single_gen2', vol=0.5, disposal_vol=2, gantry_speed=math.inf,
+                                 well_overhead_s=0, touch_tip_s=100, pick_up_tip_s=0, drop_tip_s=0)
+    wells = np.zeros((100, 2))
+    unscheduled = estimator.estimate({'1': [('art', wells)]}, (0, 0), (0, 0), (0, 0))
+    scheduled = estimator.estimate({'1': [('art', wells)]}, (0, 0), (0, 0), (0, 0),
+                                   schedules={'1': [(36, 20.0, True), (64, 32.0, True)]})
+    #the same 52uL is aspirated either way, in three aspirations or two
+    assert round(unscheduled['total_s'] - scheduled['total_s'], 5) == 100
+
+def queued_art(days_ago, colors, pixels=12):
+    #pixels are shared out between the colors
+    color_blocks = [SimpleNamespace(color_id=color, pixel_array=np.zeros((pixels // len(colors), 2), dtype=int)) for color in colors]
+    return SimpleNamespace(submit_date=datetime(2026, 1, 31) - timedelta(days=days_ago), color_blocks=color_blocks)
+
+#Batches must share colors, but always take the oldest and overdue artpieces
+def test_batch_packer():
+    oldest = queued_art(10, [1, 2])
+    shares_colors = queued_art(1, [1, 2])
+    own_colors = [queued_art(days_ago, [3 + days_ago]) for days_ago in range(5, 9)]
+    overdue = queued_art(20, [1])
+    packer = BatchPacker(3, max_wait=timedelta(days=14), now=datetime(2026, 1, 31))
+
+    #the third piece brings one new color, and is the oldest of those that do
+    batch = packer.pack([shares_colors, oldest] + own_colors)
+    assert batch == [oldest, own_colors[-1], shares_colors]
+    assert len(batch_colors(batch)) == 3
+
+    batch = packer.pack([shares_colors, oldest, overdue] + own_colors)
+    assert batch == [overdue, oldest, shares_colors]
+
+    assert BatchPacker(1, now=datetime(2026, 1, 31)).pack([shares_colors, oldest]) == [oldest]
+    assert packer.pack([]) == []
+
+#Every artpiece must be in exactly one run, and artpieces that share colors should be printed together
+def test_batch_packer_plan_runs():
+    queue = [queued_art(days_ago, [2 * (days_ago % 3), 2 * (days_ago % 3) + 1]) for days_ago in range(12)]
+    runs = BatchPacker(4, max_wait=timedelta(days=365), now=datetime(2026, 1, 31)).plan_runs(queue)
+    assert len(runs) == 3
+    assert all(len(run) == 4 for run in runs)
+    assert sorted(id(artpiece) for run in runs for artpiece in run) == sorted(id(artpiece) for artpiece in queue)
+    assert queue[-1] in runs[0]
+
+    by_age = [queue[i:i+4] for i in range(0, 12, 4)]
+    assert sum(len(batch_colors(run)) for run in runs) == 6
+    assert sum(len(batch_colors(run)) for run in by_age) == 18
+    assert palette_reloads(runs) <= palette_reloads(by_age)
+
+#Filling a template in one pass must give the same procedure as replacing each placeholder in turn
+@pytest.mark.parametrize('template_name', ['ART_TEMPLATE.py', 'ART_TEMPLATE_8_TO_1.py', 'ART_TEMPLATE.ipynb'])
+def test_procedure_template_fill(template_name, tmp_path):
+    template_path = os.path.join(os.path.dirname(__file__), '..', 'web', 'robot', template_name)
+    with open(template_path) as template_file:
+        template_string = template_file.read()
+    template = ProcedureTemplate.load(template_path)
+    assert ProcedureTemplate.load(template_path) is template
+    assert template.fill(dict()) == template_string
+
+    values = {placeholder: f'value {number}' for number, placeholder in enumerate(template.placeholders)}
+    values['%%PIXELS GO HERE%%'] = (chunk for chunk in ['{', "'1': ", '{}', '}'])
+    expected = template_string
+    for placeholder, value in values.items():
+        expected = expected.replace(placeholder, value if isinstance(value, str) else "{'1': {}}")
+    assert '%%' not in expected
+
+    with open(tmp_path / 'procedure', 'w') as output_file:
+        template.render(output_file, values)
+    assert (tmp_path / 'procedure').read_text() == expected
+
+#Procedures must be stored once per content, under a name that gives their ETag
+def test_procedure_store(tmp_path):
+    store = ProcedureStore(LocalProcedureBackend(str(tmp_path)))
+    name = store.save(['first ', 'procedure'], 'py')
+    assert store.save(['first procedure'], 'py') == name
+    assert store.save(['second procedure'], 'py') != name
+    assert store.load(name) == b'first procedure'
+    assert store.load('ARTISTIC_PROCEDURE_missing.py') is None
+    assert b''.join(store.chunks(name)) == b'first procedure'
+    assert store.chunks('ARTISTIC_PROCEDURE_missing.py') is None
+    assert len(list(tmp_path.iterdir())) == 2 #no staged files are left behind
+
+    assert store.etag(name) == name[len('ARTISTIC_PROCEDURE_'):-len('.py')]
+    assert store.etag('ARTISTIC_PROCEDURE_20200101-120000.py') is None
+    assert store.etag('ARTISTIC_PROCEDURE_20200101-120000.py', b'old procedure') is not None
+    assert (store.etag('ARTISTIC_PROCEDURE_20200101-120000.py', [b'old ', b'procedure'])
+            == store.etag('ARTISTIC_PROCEDURE_20200101-120000.py', b'old procedure'))
+
+    #only procedures older than the cutoff, and not kept, are deleted
+    os.utime(tmp_path / name, (0, 0))
+    cutoff = datetime.now(timezone.utc) - timedelta(days=1)
+    assert store.prune([name], cutoff) == []
+    assert store.prune([], cutoff) == [name]
+    assert store.load(name) is None
+    assert len(list(tmp_path.iterdir())) == 1
+
+#Progress is reported at once on each new stage, and throttled as color blocks are done
+def test_procedure_progress():
+    reports = []
+    progress = ProcedureProgress(report=reports.append, interval_s=3600)
+    artpiece = SimpleNamespace(id=7, color_blocks=[SimpleNamespace(color_id=1), SimpleNamespace(color_id=2)])
+
+    progress.start('optimizing', [artpiece])
+    assert reports[-1] == {'stage': 'optimizing', 'artpieces': {'7': {'1': 'pending', '2': 'pending'}}}
+    progress(artpiece, '2')
+    assert len(reports) == 1 #throttled within a stage
+    progress.start('writing')
+    assert reports[-1] == {'stage': 'writing', 'artpieces': {'7': {'1': 'pending', '2': 'done'}}}
+    with pytest.raises(ValueError):
+        progress.start('printing')
+
+
+#The literal pixel format must stay exactly what str() gives for the same pixels
+def test_pixels_literal_matches_str():
+    pixel_array = np.array([[0.1, -0.25, 0.273], [1/3, 2/3, 0.273]])
+    pixels_by_color = {'1': {'art-1': pixel_array, 'art-2': pixel_array[:1]}, '2': {'art-1': pixel_array[::-1]}}
+    as_tuples = {color: {slug: [tuple(pixel) for pixel in pixels.tolist()] for slug, pixels in pixels_by_artpiece.items()}
+                 for color, pixels_by_artpiece in pixels_by_color.items()}
+    assert procedureLineInjector.pixels_literal(pixels_by_color) == str(as_tuples)
+
+def load_template_decoder(template_name):
+    #decode_pixels from a template, without the opentrons imports the rest of the template needs
+    template_path = os.path.join(os.path.dirname(__file__), '..', 'web', 'robot', template_name)
+    with open(template_path) as template_file:
+        template = template_file.read()
+    decoder_start = template.index('def decode_pixels(')
+    decoder_end = template.index('\n\n\n', decoder_start)
+    namespace = dict()
+    exec('import array, base64, itertools, sys, zlib', namespace)
+    exec(template[decoder_start:decoder_end], namespace)
+    return namespace['decode_pixels']
+
+#Packed pixels must decode in the templates to within the packing resolution of the literal pixels
+@pytest.mark.parametrize('template_name', ['ART_TEMPLATE.py', 'ART_TEMPLATE_8_TO_1.py'])
+@pytest.mark.parametrize('art_params', [(5,39,26), (1,50,50)])
+def test_pixels_packed_round_trip(template_name, art_params, generate_random_art):
+    decode_pixels = load_template_decoder(template_name)
+    art = generate_random_art(*art_params)
+    pixels_by_color = dict()
+    for color in art:
+        pixel_array = np.ones((len(art[color]), 3)) * 0.273
+        pixel_array[:, :2] = np.array(art[color]) / 26 - 1
+        pixels_by_color[color] = {'art-1': pixel_array, 'art-2': pixel_array[::-1]}
+
+    literal = eval(procedureLineInjector.pixels_literal(pixels_by_color))
+    packed = eval(procedureLineInjector.pixels_packed(pixels_by_color))
+    assert decode_pixels(literal) is literal
+    decoded = decode_pixels(packed)
+    assert list(decoded) == list(literal)
+    for color in literal:
+        assert list(decoded[color]) == list(literal[color])
+        for slug in literal[color]:
+            assert len(decoded[color][slug]) == len(literal[color][slug])
+            for decoded_pixel, pixel in zip(decoded[color][slug], literal[color][slug]):
+                assert abs(decoded_pixel[0] - pixel[0]) <= 0.5 / ProcedureLineInjector.PIXEL_SCALE + 1e-12
+                assert abs(decoded_pixel[1] - pixel[1]) <= 0.5 / ProcedureLineInjector.PIXEL_SCALE + 1e-12
+                assert decoded_pixel[2] == pixel[2]
+
+#The batch transform must place every pixel exactly where the per-pixel transform does
+@pytest.mark.parametrize('plate_name', ['ccl_artbot_canvas', 'ccl_artbot_canvas_90mm_round'])
+@pytest.mark.parametrize('art_params', [(5,39,26), (5,26,39)])
+def test_plate_location_map_batch(plate_name, art_params, generate_random_art):
+    canvas = LabObject.create_new(*VALID_PLATE[plate_name])
+    grid_size = {'x':art_params[1], 'y':art_params[2]}
+    spacing = get_spacing(canvas, grid_size)
+
+    art = generate_random_art(*art_params)
+    for color in art:
+        plate_positions = procedureLineInjector.plate_location_map_batch(art[color], canvas, *spacing)
+        assert plate_positions.shape == (len(art[color]), 3)
+        for pixel, plate_position in zip(art[color], plate_positions.tolist()):
+            assert tuple(plate_position) == plate_location_map(pixel, canvas, *spacing)
+
 #From a known artpiece, ensure that it works in high-resolution mode
 @pytest.mark.parametrize('unordered_path', [[[0, 0], [1, 0], [0, 1/25], [1, 1/25], [0, 2/25], [1, 2/25],
                                              [0, 3/25], [1, 3/25], [0, 4/25], [1, 4/25], [0, 5/25], [1, 5/25],
@@ -128,6 +550,198 @@ def test_generate_procedure(random_test_art_ids, num_artpieces, canvas_object_in
             assert '%%' in diff
 
 
+@pytest.mark.usefixtures('test_app', 'clear_database')
+def test_generate_procedures_in_runs(random_test_art_ids, canvas_object_in_db, test_database):
+    """Tests that a set of art too big for one run is split into runs, with a procedure and a job for each"""
+    artpiece_ids, art_params = random_test_art_ids
+    status, procedure_paths = make_procedures(artpiece_ids,
+                                              requestor = None,
+                                              SQLALCHEMY_DATABASE_URI = test_database.engine.url,
+                                              run_size = 4,
+                                              option_args={'notebook':False
+                                                          ,'palette':'corning_96_wellplate_360ul_flat'
+                                                          ,'pipette':'p300_single'
+                                                          ,'canvas': canvas_object_in_db.name
+                                                          }
+    )
+    assert len(procedure_paths) == 3
+    assert len(set(procedure_path[1] for procedure_path in procedure_paths)) == 3
+    for procedure_path in procedure_paths:
+        assert os.path.exists(os.path.join(*procedure_path))
+
+    test_database.session.expire_all()
+    jobs = JobModel.query.filter(JobModel.file_name.in_([procedure_path[1] for procedure_path in procedure_paths])).all()
+    assert len(jobs) == 3
+    assert sorted(artpiece.id for job in jobs for artpiece in job.artpieces) == sorted(artpiece_ids)
+
+
+@pytest.mark.usefixtures('test_app', 'clear_database')
+def test_generate_procedure_reuses_connections(random_test_art_ids, canvas_object_in_db, test_database, monkeypatch):
+    """Tests that procedures share one pooled engine per database, and that the app's own session makes none"""
+    artpiece_ids, art_params = random_test_art_ids
+    engines = []
+    create_engine = art_processor.sa.create_engine
+    monkeypatch.setattr(art_processor, '_sessionmakers', dict())
+    monkeypatch.setattr(art_processor.sa, 'create_engine', lambda *args, **kwargs: engines.append(args) or create_engine(*args, **kwargs))
+    option_args = {'notebook':False
+                  ,'palette':'corning_96_wellplate_360ul_flat'
+                  ,'pipette':'p300_single'
+                  ,'canvas': canvas_object_in_db.name
+                  }
+
+    for artpiece_id in artpiece_ids[:2]:
+        status, procedure_path = make_procedure([artpiece_id], SQLALCHEMY_DATABASE_URI = test_database.engine.url,
+                                                option_args=dict(option_args))
+        assert procedure_path is not None
+    assert len(engines) == 1
+
+    status, procedure_path = make_procedure([artpiece_ids[2]], option_args=dict(option_args), session=test_database.session)
+    assert procedure_path is not None
+    assert len(engines) == 1
+    assert JobModel.query.filter(JobModel.artpieces.any(id=artpiece_ids[2])).count() == 1
+
+
+@pytest.mark.usefixtures('test_app', 'clear_database')
+def test_generate_procedure_in_background(random_test_art_ids, canvas_object_in_db, test_database):
+    """Tests that a print request's job is filled in by the background pool, with its progress by artpiece and color"""
+    artpiece_ids, art_params = random_test_art_ids
+    artpiece_ids = artpiece_ids[:2]
+    option_args = {'notebook':False
+                  ,'palette':'corning_96_wellplate_360ul_flat'
+                  ,'pipette':'p300_single'
+                  ,'canvas': canvas_object_in_db.name
+                  ,'workers': 0
+                  }
+    requestor = SuperUserModel(email='printer@test.com', created_at=datetime.now())
+    jobs = [JobModel(request_date=datetime.now(), requestor=requestor, status=JobStatus.generating) for _ in range(2)]
+    test_database.session.add_all(jobs)
+    test_database.session.commit() #the background thread only sees committed rows
+    job_ids = [job.id for job in jobs]
+    store = art_processor.default_store(os.path.dirname(art_processor.__file__))
+
+    generate_procedure_async(jobs[0], artpiece_ids, 9, dict(option_args), store).result()
+    generate_procedure_async(jobs[1], [-1], 9, dict(option_args), store).result()
+
+    test_database.session.expire_all()
+    job = JobModel.query.get(job_ids[0])
+    assert job.status == JobStatus.ready
+    assert store.load(job.file_name) is not None
+    assert job_procedure_uri(job) == f"/procedures/{job.file_name.split('_')[-1]}"
+    assert sorted(artpiece.id for artpiece in job.artpieces) == sorted(artpiece_ids)
+    assert job.progress['stage'] == 'done'
+    assert job.progress['msg']
+    for artpiece in job.artpieces:
+        assert job.progress['artpieces'][str(artpiece.id)] == {str(color_block.color_id): 'done' for color_block in artpiece.color_blocks}
+
+    failed_job = JobModel.query.get(job_ids[1])
+    assert failed_job.status == JobStatus.failed
+    assert failed_job.file_name is None
+    assert job_procedure_uri(failed_job) is None
+    assert failed_job.progress['msg'] == ['No new art found. All done.']
+
+
+@pytest.mark.usefixtures('test_app', 'clear_database')
+def test_generate_procedure_runs_in_background(random_test_art_ids, canvas_object_in_db, test_database):
+    """Tests that a runs request's job is filled in by its first run, and lists the procedure of every run"""
+    artpiece_ids, art_params = random_test_art_ids
+    option_args = {'notebook':False
+                  ,'palette':'corning_96_wellplate_360ul_flat'
+                  ,'pipette':'p300_single'
+                  ,'canvas': canvas_object_in_db.name
+                  ,'workers': 0
+                  }
+    requestor = SuperUserModel(email='printer@test.com', created_at=datetime.now())
+    job = JobModel(request_date=datetime.now(), requestor=requestor, status=JobStatus.generating)
+    test_database.session.add(job)
+    test_database.session.commit() #the background thread only sees committed rows
+    job_id = job.id
+    store = art_processor.default_store(os.path.dirname(art_processor.__file__))
+
+    generate_procedure_runs_async(job, artpiece_ids, 4, None, dict(option_args), store).result()
+
+    test_database.session.expire_all()
+    job = JobModel.query.get(job_id)
+    assert job.status == JobStatus.ready
+    assert job.progress['stage'] == 'done'
+    assert len(job.progress['runs']) == 3
+    assert job.progress['runs'][0] == job.file_name
+    assert job_procedure_uris(job) == [f"/procedures/{file_name.split('_')[-1]}" for file_name in job.progress['runs']]
+    run_jobs = JobModel.query.filter(JobModel.file_name.in_(job.progress['runs'])).all()
+    assert len(run_jobs) == 3
+    assert sorted(artpiece.id for run_job in run_jobs for artpiece in run_job.artpieces) == sorted(artpiece_ids)
+
+
+@pytest.mark.usefixtures('test_app', 'clear_database')
+def test_generate_procedure_uses_path_cache(random_test_art_ids, canvas_object_in_db, test_database):
+    """Tests that a reprint reuses the cached print orders, and that they are evicted with the artpiece"""
+    artpiece_ids, art_params = random_test_art_ids
+    artpiece_ids = artpiece_ids[:2]
+
+    def generate():
+        status, procedure_path = make_procedure(artpiece_ids,
+                                                requestor = None,
+                                                SQLALCHEMY_DATABASE_URI = test_database.engine.url,
+                                                option_args={'notebook':False
+                                                            ,'palette':'corning_96_wellplate_360ul_flat'
+                                                            ,'pipette':'p300_single'
+                                                            ,'canvas': canvas_object_in_db.name
+                                                            }
+        )
+        with open(os.path.join(*procedure_path)) as output_file:
+            return output_file.read()
+
+    first_procedure = generate()
+    cached_entries = PrintPathCacheModel.query.count()
+    assert cached_entries > 0
+    assert generate() == first_procedure
+    assert PrintPathCacheModel.query.count() == cached_entries
+
+    Artpiece.get_by_id(artpiece_ids[0]).delete()
+    assert PrintPathCacheModel.query.filter(PrintPathCacheModel.artpiece_id == artpiece_ids[0]).count() == 0
+    assert PrintPathCacheModel.query.count() > 0
+
+
+@pytest.mark.usefixtures('test_app', 'clear_database')
+def test_precompute_print_paths_fills_cache(random_test_art_ids, canvas_object_in_db):
+    """Tests that precomputing an artpiece with nothing cached writes an order for each color block and canvas"""
+    artpiece_ids, art_params = random_test_art_ids
+    artpiece = Artpiece.get_by_id(artpiece_ids[0])
+    assert PrintPathCacheModel.query.filter(PrintPathCacheModel.artpiece_id == artpiece.id).count() == 0
+
+    precompute_print_paths(artpiece.id, {'refine_passes': 0, 'workers': 0})
+    cached_entries = PrintPathCacheModel.query.filter(PrintPathCacheModel.artpiece_id == artpiece.id).count()
+    assert cached_entries == len(artpiece._model.color_blocks) * len(canvas_types())
+
+
+@pytest.mark.usefixtures('test_app', 'clear_database')
+def test_precomputed_paths_are_used(random_test_art_ids, canvas_object_in_db, test_database, monkeypatch):
+    """Tests that confirming art fills the path cache for each canvas, so a procedure request needs no new paths"""
+    artpiece_ids, art_params = random_test_art_ids
+    artpiece = Artpiece.get_by_id(artpiece_ids[0])
+    monkeypatch.setitem(current_app.config, 'PATH_REFINEMENT_PASSES', 0)
+    monkeypatch.setitem(current_app.config, 'PROCEDURE_WORKERS', 0)
+    test_database.session.commit() #the background thread only sees committed labware
+
+    precompute_print_paths_async(artpiece).result()
+    cached_entries = PrintPathCacheModel.query.filter(PrintPathCacheModel.artpiece_id == artpiece.id).count()
+    assert canvas_object_in_db.name in [canvas.name for canvas in canvas_types()]
+    assert cached_entries == len(artpiece._model.color_blocks) * len(canvas_types())
+
+    status, procedure_path = make_procedure([artpiece.id],
+                                            requestor = None,
+                                            SQLALCHEMY_DATABASE_URI = test_database.engine.url,
+                                            option_args={'notebook':False
+                                                        ,'palette':'corning_96_wellplate_360ul_flat'
+                                                        ,'pipette':'p300_single'
+                                                        ,'canvas': canvas_object_in_db.name
+                                                        ,'refine_passes': 0
+                                                        ,'workers': 0
+                                                        }
+    )
+    assert procedure_path is not None
+    assert PrintPathCacheModel.query.count() == cached_entries
+
+
 @pytest.mark.usefixtures('setup_app', 'random_test_art_ids')
 @pytest.mark.fill_canvas(True)
 def test_all_points_in_bounds(art_dimensions):
@@ -1,12 +1,16 @@
 import pytest
+import io
 import json
 import math
+from PIL import Image
 from flask import current_app
 from web.api.user import exceptions as user_exceptions, core as user_core
 from web.api.user.user import User, SuperUser
-from web.api.user.artpiece import (core, exceptions as art_exceptions)
+from web.api.user.artpiece import (core, exceptions as art_exceptions, image_uploads)
+from web.api.user.artpiece.artpiece import Artpiece, IMAGE_SIZES, stored_image_key
 from web.api.user.exceptions import InvalidUsage
-from web.database.models import ArtpieceModel, SuperUserRole
+from web.api.user.colors import get_available_color_mapping
+from web.database.models import ArtpieceModel, SuperUserRole, ImageStatus
 
 from .conftest import (VALID_EMAIL, VALID_TITLE, VALID_ART, VALID_PASSWORD,
                        INITIAL_ROLE, INITIAL_SUPERUSER_ROLE,
@@ -46,6 +50,40 @@ def test_user_password_length_requirement(password):
     with pytest.raises(user_exceptions.InvalidPasswordException):
         user_core.update_superuser_password(VALID_EMAIL, '', password, requesting_user)
 
+@pytest.mark.usefixtures("setup_app")
+def test_artpiece_stored_at_each_image_size():
+    artpiece = create_artpiece()
+    model = artpiece._model
+    assert model.image_status == ImageStatus.pending
+    artpiece.store_images(VALID_ART, get_available_color_mapping())
+    assert model.image_status == ImageStatus.stored
+    assert model.image_sizes == list(IMAGE_SIZES)
+    assert stored_image_key(model) == model.image_uri.split('/')[-1]
+    image, image_format = artpiece.get_image('thumbnail')
+    assert image_format == 'PNG'
+    assert Image.open(io.BytesIO(image)).mode == 'P'
+    model.image_sizes = None #submitted before there were other sizes
+    assert stored_image_key(model, 'thumbnail') == stored_image_key(model, 'full')
+
+@pytest.mark.usefixtures("setup_app")
+def test_artpiece_image_upload_retries(monkeypatch):
+    attempts = []
+    def failing_store_file(file, key):
+        attempts.append(key)
+        return False
+    monkeypatch.setattr(image_uploads._fm, 'store_file', failing_store_file)
+    artpiece = create_artpiece()
+    image_uploads.store_images(artpiece.id, VALID_ART, get_available_color_mapping(),
+                               image_uploads.retrying_store_file(retries=2, retry_delay_s=0))
+    assert len(attempts) == 3 * len(IMAGE_SIZES)
+    assert artpiece._model.image_status == ImageStatus.failed
+    assert artpiece._model.image_sizes == []
+
+@pytest.mark.usefixtures("setup_app")
+def test_artpieces_with_same_title_get_unique_slugs():
+    slugs = [create_artpiece(email=f'artist{i}@mail.com')._model.slug for i in range(12)]
+    assert slugs == [f'{slugs[0].split("#")[0]}#{number}' for number in range(1, 13)]
+
 @pytest.mark.usefixtures("setup_app")
 def test_monthly_submission_limit_exceeded():
     limit = 0
@@ -55,6 +93,15 @@ def test_monthly_submission_limit_exceeded():
     with pytest.raises(art_exceptions.MonthlySubmissionLimitException):
         core.guarantee_monthly_submission_limit_not_reached(limit)
 
+@pytest.mark.usefixtures("setup_app")
+def test_monthly_submission_count_follows_submissions():
+    assert core.get_monthly_submission_count() == 0
+    artpieces = [create_artpiece(email=f'artist{i}@mail.com') for i in range(3)]
+    assert core.get_monthly_submission_count() == 3
+    assert Artpiece.total_submission_count_since(core.first_of_month()) == 3
+    artpieces[0].delete()
+    assert core.get_monthly_submission_count() == 2
+
 @pytest.mark.usefixtures("setup_app")
 def test_create_artpieces_with_same_email():
     with pytest.raises(art_exceptions.UserSubmissionLimitException):
@@ -77,7 +124,9 @@ def test_create_artpiece_non_alphanumeric_title(invalid_title):
 
 @pytest.mark.usefixtures("setup_app")
 @pytest.mark.parametrize('invalid_art', [{'art':{'1': [[100, 0]]},'size':{'x':26,'y':26}},
-                                         {'art':{'2': [[5, 101]]},'size':{'x':26,'y':99}}
+                                         {'art':{'2': [[5, 101]]},'size':{'x':26,'y':99}},
+                                         {'art':{'1': [[-1, 5]]},'size':{'x':26,'y':26}},
+                                         {'art':{'2': [[5, -3]]},'size':{'x':26,'y':26}}
                                         ])
 def test_create_artpiece_pixel_outofbounds(invalid_art):
     in_data = create_artpiece_data(art=invalid_art['art'], canvas_size=invalid_art['size'])
@@ -0,0 +1,99 @@
+"""
+Rendering of submitted art to an image.
+
+Art is a dict of color keys to [y, x] pixels on a small canvas. It used to
+be drawn as one filled rectangle per pixel, each pixel_size wide, with its
+corners truncated to whole image pixels. Neighbouring rectangles share a
+row or column at their edges, which goes to whichever was drawn last.
+
+render_art gives the same image in one pass over numpy arrays. The art is
+laid out on a canvas-sized grid holding the draw order of each pixel, and
+each row and column of the image is mapped back to the grid cells whose
+rectangles cover it, taking the one drawn last. This is a nearest-neighbour
+upscale of the grid, with the shared edges resolved as the drawing did.
+Since every pixel is looked up in a palette of the art's colors, the image
+can also be given as palette indices, which store losslessly as a small PNG.
+"""
+import numpy as np
+from PIL import Image
+
+BACKGROUND = (255, 255, 255, 1)
+
+
+def render_art(pixel_art_color_encoding, color_mapping, pixel_size, image_size,
+               mode='RGBX', background=BACKGROUND):
+    """
+    Returns a PIL image of image_size (width, height) in mode, a four band
+    mode such as 'RGBX' or 'RGBA', with each pixel of the art drawn
+    pixel_size (width, height) wide in its color from color_mapping.
+    In mode 'P' the image is indexed into a palette of the background
+    followed by the art's colors.
+    """
+    colors = list(pixel_art_color_encoding)
+    pixels = [np.asarray(pixel_art_color_encoding[color], dtype=np.int64).reshape(-1, 2) for color in colors]
+    counts = [len(p) for p in pixels]
+    pixels = np.concatenate(pixels) if pixels else np.empty((0, 2), dtype=np.int64)
+
+    #palette index 0 is the background
+    palette = np.ascontiguousarray(np.array([background] + [color_mapping[color] for color in colors]).astype(np.uint8))
+    if len(palette) > 256:
+        raise ValueError('Art can have at most 255 colors')
+    color_of_pixel = np.repeat(np.arange(1, len(colors) + 1), counts)
+    width, height = image_size
+    indices = _palette_indices(pixels, color_of_pixel, pixel_size, width, height)
+
+    if mode == 'P':
+        im = Image.frombytes('P', (width, height), indices.tobytes())
+        im.putpalette(palette[:, :3].tobytes())
+        return im
+    #each color is viewed as one uint32, so that it is looked up in one step
+    return Image.frombytes(mode, (width, height), palette.view(np.uint32).take(indices).tobytes())
+
+
+def _palette_indices(pixels, color_of_pixel, pixel_size, width, height):
+    # The (height, width) uint8 palette index of each image pixel
+    if not len(pixels):
+        return np.zeros((height, width), dtype=np.uint8)
+    origin = np.minimum(pixels.min(axis=0), 0)
+    #one cell of padding past the grid, so that index -1 is a cell nothing is drawn in
+    ranks = np.zeros(pixels.max(axis=0) - origin + 2, dtype=np.int64)
+    np.maximum.at(ranks, tuple((pixels - origin).T), np.arange(1, len(pixels) + 1))
+    color_of_rank = np.concatenate(([0], color_of_pixel)).astype(np.uint8)
+    rows = _covering(ranks.shape[0] - 1, origin[0], pixel_size[1], height)
+    columns = _covering(ranks.shape[1] - 1, origin[1], pixel_size[0], width)
+
+    #most rows and columns are covered by one cell, the last drawn of those covering it
+    indices = color_of_rank[ranks].take(rows[0], axis=0).take(columns[0], axis=1)
+    #rows and columns on the edge between two cells go to the one drawn last
+    shared_rows = np.flatnonzero(rows[1] >= 0) if len(rows) > 1 else []
+    if len(shared_rows):
+        indices[shared_rows] = color_of_rank[_drawn_last(ranks, [r[shared_rows] for r in rows], columns)]
+    shared_columns = np.flatnonzero(columns[1] >= 0) if len(columns) > 1 else []
+    if len(shared_columns):
+        indices[:, shared_columns] = color_of_rank[_drawn_last(ranks, rows, [c[shared_columns] for c in columns])]
+    return indices
+
+
+def _covering(cells, origin, size, length):
+    """
+    The cells whose rectangles cover each of length image rows (or columns),
+    as a list of arrays: the last cell covering each row, then the one before
+    it, and so on, with -1 where there are no more.
+    """
+    position = np.arange(cells) + origin
+    starts = np.trunc(position * size).astype(np.int64)
+    ends = np.trunc(position * size + size).astype(np.int64)
+    lines = np.arange(length)
+    first = np.searchsorted(ends, lines, side='left')
+    last = np.searchsorted(starts, lines, side='right') - 1
+    span = max(int((last - first).max(initial=0)) + 1, 1)
+    return [np.where(last - k >= first, last - k, -1) for k in range(span)]
+
+
+def _drawn_last(ranks, row_cells, column_cells):
+    # Draw order of the last cell drawn over each row and column, from the cells covering them
+    order = 0
+    for rows in row_cells:
+        for columns in column_cells:
+            order = np.maximum(order, ranks.take(rows, axis=0).take(columns, axis=1))
+    return order
@@ -22,12 +22,15 @@ class file_manager():
             return 'Malformed URI'
         return (bucket, key)
 
+    def uri(self, key):
+        return 's3://' + '/'.join([self.bucket, key])
+
     def store_file(self, file, key):
         try:
             response = self.s3.upload_fileobj(file, self.bucket, key)
         except ClientError as e:
             return False
-        return 's3://' + '/'.join([self.bucket, key])
+        return self.uri(key)
 
     def del_file(self, key):
         try:
@@ -43,6 +46,31 @@ class file_manager():
             return False
         return file
 
+    def stream_file(self, key, chunk_size=64 * 1024):
+        #the file as an iterator of bytes, downloaded as it is read, or None if it cannot be read
+        try:
+            body = self.s3.get_object(Bucket=self.bucket, Key=key)['Body']
+        except ClientError as e:
+            return None
+        return body.iter_chunks(chunk_size)
+
+    def file_exists(self, key):
+        try:
+            self.s3.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            return False
+        return True
+
+    def list_files(self, prefix=''):
+        #{key: last modified datetime} of the files whose keys start with prefix
+        files = dict()
+        try:
+            for page in self.s3.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+                files.update((item['Key'], item['LastModified']) for item in page.get('Contents', []))
+        except ClientError as e:
+            return dict()
+        return files
+
     def get_file_url(self, key, expiration=3600):
         try:
             response = self.s3.generate_presigned_url('get_object',
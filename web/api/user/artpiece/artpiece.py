@@ -4,53 +4,82 @@ import io
 import json
 import datetime as dt
 import math
-import re
 import os
 from sqlalchemy import func
-from PIL import Image, ImageDraw
+from sqlalchemy.dialects.postgresql import insert
 from slugify import slugify
 from flask import current_app
 from flask_jwt_extended import create_access_token, decode_token
+from web.extensions import db
 from web.api.file_manager import file_manager
+from web.api.art_image import render_art
 from web.database.models import (ArtpieceModel, ColorBlockModel,
                                  BacterialColorModel, StrainModel,
-                                 LocationModel, SubmissionStatus
+                                 LocationModel, SubmissionStatus,
+                                 PrintPathCacheModel, ImageStatus, SlugCounterModel,
+                                 MonthlySubmissionCountModel
                                 )
-from web.api.user.colors import get_available_color_mapping
+
+#image width in pixels and format of each size an artpiece is stored at. Pixel art compresses
+#far better as a palette PNG than as a JPEG, so only the full size, kept for older clients, is a JPEG
+IMAGE_SIZES = {
+    'thumbnail': (150, 'PNG'),
+    'preview': (300, 'PNG'),
+    'full': (600, 'JPEG'),
+    'lossless': (600, 'PNG'),
+}
+_IMAGE_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png'}
+
+def image_key(slug, submit_date, size='full'):
+    # Storage key of an artpiece's image at size. The full size keeps the key it has always had
+    suffix = '' if size == 'full' else f'_{size}'
+    return f'{slug}_{int(submit_date.timestamp()*1000)}{suffix}.{_IMAGE_EXTENSIONS[IMAGE_SIZES[size][1]]}'
+
+def stored_image_key(model, size='full'):
+    # Key of an artpiece model's image at size, or of its full image if it was not stored at size
+    if size not in (model.image_sizes or ()):
+        size = 'full'
+    return image_key(model.slug, model.submit_date, size)
 
 def _decode_to_image(pixel_art_color_encoding, color_mapping
-    , canvas_size, scale=600):
+    , canvas_size, scale=600, format='JPEG'):
     ratio = (1, canvas_size['y']/canvas_size['x'])
     pixel_size = (ratio[0] * scale / canvas_size['x']
                  , ratio[1] * scale / canvas_size['y'])
     total_size = (math.ceil(ratio[0] * scale + pixel_size[0])
                  , math.ceil(ratio[1] * scale + pixel_size[1]))
-    im = Image.new('RGBX',total_size,(255,255,255,1))
-    draw = ImageDraw.Draw(im)
-    for color in pixel_art_color_encoding:
-        # pixels are given as [y,x]
-        for pixel_y, pixel_x in pixel_art_color_encoding[color]:
-            origin = (pixel_size[0] * pixel_x, pixel_size[1] * pixel_y)
-            far_corner = (pixel_size[0] + origin[0], pixel_size[1] + origin[1])
-            draw.rectangle([origin, far_corner], fill=color_mapping[color])
+    #JPEGs have no palette, so those are drawn in full color
+    mode = 'P' if format == 'PNG' else 'RGBX'
+    im = render_art(pixel_art_color_encoding, color_mapping, pixel_size, total_size, mode=mode)
     with io.BytesIO() as output:
-        im.save(output, format='JPEG')
+        im.save(output, format=format)
         image_file = output.getvalue()
     return (image_file)
 
 def _create_unique_slug(title):
     slug = slugify(title)
-    search = f'{slug}#%'
-    artpiece_with_slug = (ArtpieceModel.query.filter(
-            ArtpieceModel.slug.like(search))
-            .order_by(ArtpieceModel.submit_date.desc())
-            .first())
-    postfix = 1
-    if artpiece_with_slug is not None:
-        m = re.search(r'\d$', artpiece_with_slug.slug)
-        postfix = int(m.group(0)) + 1
+    #one upsert takes the next number, however many artpieces share the slug. It commits on
+    #its own connection, so the counter is not locked while the artpiece's transaction is open
+    next_number = (insert(SlugCounterModel.__table__)
+                   .values(slug=slug, last_number=1)
+                   .on_conflict_do_update(index_elements=[SlugCounterModel.slug],
+                                          set_={'last_number': SlugCounterModel.last_number + 1})
+                   .returning(SlugCounterModel.last_number))
+    with db.engine.begin() as connection:
+        postfix = connection.execute(next_number).scalar()
     return f'{slug}#{postfix}'
 
+def _month_of(date):
+    return dt.date(date.year, date.month, 1)
+
+def _count_submission(submit_date):
+    #in the submitting transaction, so the count only changes if the artpiece is saved
+    db.session.execute(
+            insert(MonthlySubmissionCountModel.__table__)
+            .values(month=_month_of(submit_date), count=1)
+            .on_conflict_do_update(index_elements=[MonthlySubmissionCountModel.month],
+                                   set_={'count': MonthlySubmissionCountModel.count + 1}))
+
 def _make_color_blocks(art_json):
     """
     Breaks art in JSON format into individual ColorBlock objects,
@@ -79,18 +108,37 @@ class Artpiece():
 
     @classmethod
     def create(cls, user_id, title, art, canvas_size):
+        """
+        Adds an artpiece whose images are still to be stored, by store_images,
+        usually from the background uploader in image_uploads
+        """
         submit_date = dt.datetime.now()
         slug = _create_unique_slug(title)
-        image_as_bytes = _decode_to_image(art, get_available_color_mapping(), canvas_size)
-        image_uri = _fm.store_file(io.BytesIO(image_as_bytes), f'{slug}_{int(submit_date.timestamp()*1000)}.jpg')
 
         color_blocks = _make_color_blocks(art)
+        _count_submission(submit_date)
         
         return cls(
                 _Model(slug=slug, title=title, submit_date=submit_date, color_blocks=color_blocks
                     , canvas_size=canvas_size, status=SubmissionStatus.submitted
-                    , image_uri=image_uri, user_id=user_id, confirmed=False)
+                    , image_uri=_fm.uri(image_key(slug, submit_date)), user_id=user_id, confirmed=False
+                    , image_sizes=[], image_status=ImageStatus.pending)
                 .save())
+
+    def store_images(self, art, color_mapping, store_file=None):
+        """
+        Renders art at each of IMAGE_SIZES and stores it with store_file(file, key),
+        by default the file manager's. Then records the sizes stored, and commits.
+        The image is stored if its full size is.
+        """
+        model = self._model
+        stored = []
+        for size, (scale, format) in IMAGE_SIZES.items():
+            image = _decode_to_image(art, color_mapping, model.canvas_size, scale, format)
+            if (store_file or _fm.store_file)(io.BytesIO(image), image_key(model.slug, model.submit_date, size)):
+                stored.append(size)
+        status = ImageStatus.stored if 'full' in stored else ImageStatus.failed
+        return model.update(image_sizes=stored, image_status=status, commit=True)
     
     @classmethod
     def get_by_id(cls, id):
@@ -139,16 +187,19 @@ class Artpiece():
         from ..user import User
         return User.get_by_id(self._model.user_id)
 
-    def get_image_as_jpg(self):
+    def get_image(self, size='full'):
+        """
+        Returns the artpiece's image at size, one of IMAGE_SIZES, and its
+        format. Falls back to the full JPEG where size was not stored.
+        """
+        key = stored_image_key(self._model, size)
         with io.BytesIO() as output:
-            key = _fm.parse_uri(self._model.image_uri)[-1]
             _fm.get_file(output, key)
             image_file = output.getvalue()
-        return image_file
+        return image_file, 'PNG' if key.endswith('.png') else 'JPEG'
 
-    def get_image_url(self):
-        key = _fm.parse_uri(self._model.image_uri)[-1]
-        loc = _fm.get_file_url(key)
+    def get_image_url(self, size='full'):
+        loc = _fm.get_file_url(stored_image_key(self._model, size))
         return loc
 
     def get_confirmation_token(self, expires_in=60*60*72):
@@ -173,6 +224,11 @@ class Artpiece():
         return self._model.update(status=status_enum, commit=True)
 
     def delete(self):
+        #cached print orders are only useful while the artpiece exists
+        PrintPathCacheModel.query.filter(PrintPathCacheModel.artpiece_id == self._model_id).delete()
+        (MonthlySubmissionCountModel.query
+            .filter(MonthlySubmissionCountModel.month == _month_of(self._model.submit_date))
+            .update({'count': MonthlySubmissionCountModel.count - 1}, synchronize_session=False))
         self._model.delete(commit=True)
         return True
 
@@ -188,6 +244,12 @@ class Artpiece():
     def total_submission_count_since(date):
         return _Model.query.filter(_Model.submit_date >= date).count()
 
+    @staticmethod
+    def submission_count_in_month(date):
+        # Number of artpieces submitted in date's month, from the kept count
+        counted = MonthlySubmissionCountModel.query.get(_month_of(date))
+        return 0 if counted is None else counted.count
+
 class TokenIDMismatchError(Exception):
     """ Artpiece id from token does not match """
     pass
@@ -16,7 +16,7 @@ def first_of_month():
     return datetime.date.today().replace(day=1)
 
 def get_monthly_submission_count():
-    return Artpiece.total_submission_count_since(first_of_month())
+    return Artpiece.submission_count_in_month(first_of_month())
 
 def has_reached_monthly_submission_limit(limit):
     return get_monthly_submission_count() >= limit
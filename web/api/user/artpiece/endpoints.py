@@ -11,14 +11,21 @@ from ..colors import (get_available_color_mapping, get_available_colors,
                       get_available_colors_as_dicts, get_color_id_by_name, set_color_strain,
                       delete_colors, BacterialColor)
 from ..utilities import access_level_required
-from .artpiece import Artpiece
+from .artpiece import Artpiece, IMAGE_SIZES
+from .image_uploads import store_images_async
+from .precompute import precompute_print_paths_async
+from .procedure_jobs import (create_procedure_job, generate_procedure_async, generate_procedure_runs_async,
+                             job_procedure_uri, job_procedure_uris)
 from .serializers import ArtpieceSchema, PrintableSchema, StatusSchema, ColorSchema
 from ...biofoundry.core import (extract_update_info, update_objects_in_db) #should probably move this generic function to a parent module
 from web.extensions import db
-from web.database.models import SuperUserRole
-from web.robot.art_processor import make_procedure
+from web.database.models import SuperUserRole, JobModel
+from web.robot.batch_packer import BATCH_MODES
+from web.robot.procedure_line_injector import ProcedureLineInjector
+from web.robot.procedure_store import procedure_store_from_config
 
 import base64
+import zlib
 
 from web.database.models import ArtpieceModel
 
@@ -52,7 +59,8 @@ def receive_art():
     artpiece = create_artpiece(email, title, art, canvas_size)
     db.session.commit()
 
-    send_confirmation_email_async(artpiece)
+    images_stored = store_images_async(artpiece, art, get_available_color_mapping())
+    send_confirmation_email_async(artpiece, after=images_stored)
 
     return jsonify({'data': None}), 201
 
@@ -63,6 +71,7 @@ def confirm_artpiece(id, token):
     confirmation_status = core_confirm_artpiece(artpiece, token)
     if confirmation_status == 'confirmed':
         db.session.commit()
+        precompute_print_paths_async(artpiece)
 
     return jsonify({'data': {'confirmation': {'status': confirmation_status}}}), 200
 
@@ -118,6 +127,7 @@ def get_print_jobs():
     Parameters:
         unprinted_only (bool): If true, will only return artpieces that have not been printed.
         confirmed_only (bool): If true, will only return artpieces that have been confirmed.
+        image_size (str): Size of the images linked in img_uri, one of IMAGE_SIZES. Defaults to full.
 
     Return: JSON object containing all artpiece information.
     """
@@ -125,58 +135,212 @@ def get_print_jobs():
     unprinted_only = args.get('unprinted_only', 'False').lower() == 'true'
     confirmed_only = args.get('confirmed_only', 'True').lower() == 'true'
     location = args.get('location', None)
+    image_size = args.get('image_size', 'full')
+    if image_size not in IMAGE_SIZES:
+        raise InvalidUsage.invalid_image_size()
 
     print_jobs = Artpiece.get_printable(unprinted_only=unprinted_only, confirmed_only=confirmed_only, location=location)
-    schema = PrintableSchema(many=True)
+    schema = PrintableSchema(many=True, context={'image_size': image_size})
     serialized = schema.dumps(print_jobs)
 
     return jsonify({'data': serialized})
 
 
+def procedure_store():
+    # The app's procedure store, made on first use
+    if 'procedure_store' not in current_app.extensions:
+        current_app.extensions['procedure_store'] = procedure_store_from_config(current_app.config)
+    return current_app.extensions['procedure_store']
+
+
 @artpiece_blueprint.route('/procedures/<string:id>', methods=('GET', ))
 @jwt_required()
 @access_level_required(SuperUserRole.printer)
 def get_procedure_file(id):
-    
-    procedure_file = f'{os.getcwd()}/web/robot/procedures/ARTISTIC_PROCEDURE_{id}'
-
-    return send_file(procedure_file, mimetype='text/plain', as_attachment=True)
-
+    """
+    Downloads a procedure. Stored procedures never change, so their ETag
+    comes from the file name and a matching If-None-Match gets a 304
+    without the file being read. Procedures are streamed, and gzipped as
+    they are streamed when the client accepts it. The gzipped body has an
+    ETag of its own, as it is a different representation.
 
-@artpiece_blueprint.route('/procedure_request', methods=('POST', ))
-@jwt_required()
-@access_level_required(SuperUserRole.printer)
-def receive_print_request():
+    Parameters:
+        id <str>: The end of the procedure's file name, as in its procedure_uri
 
-    artpiece_ids = request.get_json()['ids']
-    labware = request.get_json()['labware']
-    pipette = request.get_json()['pipette']
+    Return: The procedure file
+    """
+    store = procedure_store()
+    file_name = f'ARTISTIC_PROCEDURE_{id}'
+    gzipped = 'gzip' in request.accept_encodings
+    etag = store.etag(file_name)
+    if etag and request.if_none_match.contains(representation_etag(etag, gzipped)):
+        response = current_app.response_class(status=304)
+        response.set_etag(representation_etag(etag, gzipped))
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    content = store.chunks(file_name)
+    if content is None:
+        raise InvalidUsage.resource_not_found()
+    if etag is None: #older procedures are hashed, then read again to be sent
+        etag = store.etag(file_name, content)
+        content = store.chunks(file_name)
+
+    response = current_app.response_class(gzip_chunks(content) if gzipped else content, mimetype='text/plain')
+    response.headers['Content-Disposition'] = f'attachment; filename={file_name}'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(representation_etag(etag, gzipped))
+    response.cache_control.private = True
+    return response.make_conditional(request)
+
+
+def representation_etag(etag, gzipped):
+    return f'{etag}-gzip' if gzipped else etag
+
+
+def gzip_chunks(chunks):
+    # Gzips an iterator of bytes as it is read
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) #16 adds the gzip header and trailer
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def procedure_option_args(json_data, batch='oldest'):
+    # make_procedure options for a print request: the requested labware, and the app's optimizer settings
+    labware = json_data['labware']
+    pipette = json_data['pipette']
+    ordering = json_data.get('ordering', current_app.config['PATH_ORDERING'])
+    if ordering not in ProcedureLineInjector.ORDERING_STRATEGIES:
+        raise InvalidUsage.invalid_ordering()
 
     option_args = {'notebook':False
                     ,'palette': 'cryo_35_tuberack_2000ul'
                     ,'pipette': pipette
                     ,'canvas': labware['canvas']
+                    ,'refine_passes': current_app.config['PATH_REFINEMENT_PASSES']
+                    ,'workers': current_app.config['PROCEDURE_WORKERS']
+                    ,'gantry_speed': current_app.config['ROBOT_GANTRY_SPEED']
+                    ,'batch': batch
+                    ,'max_wait_days': current_app.config['BATCH_MAX_WAIT_DAYS']
+                    ,'retention_days': current_app.config['PROCEDURE_RETENTION_DAYS']
+                    ,'ordering': ordering
+                    ,'drying_time_s': current_app.config['DRYING_TIME_S']
                     }
     
     try:
-        option_args['location'] = request.get_json()['location']
+        option_args['location'] = json_data['location']
     except KeyError:
         pass
+    return option_args
+
 
-    if option_args['pipette'][-5:] == 'multi' and len(artpiece_ids) > 1:
-        raise InvalidUsage.invalid_pipette()
+@artpiece_blueprint.route('/procedure_request', methods=('POST', ))
+@jwt_required()
+@access_level_required(SuperUserRole.printer)
+def receive_print_request():
+    """
+    Starts generating a procedure for the requested artpieces. The procedure
+    is made in the background, so this returns at once with a job to poll
+    at /jobs/<job_id>.
+
+    Parameters:
+        ids <list>: The ids of the artpieces to print. May be left out when batch is 'best'
+        batch <str>: Optional. 'best' lets the server pick the queued artpieces
+            that share the most colors, instead of printing explicit ids
+        ordering <str>: Optional. The print order strategy: 'greedy', 'timed', which
+            keeps neighbouring wells apart by drying time instead of distance, or
+            'hilbert' or 'serpentine', which are quicker for very large art but travel further
+        labware <dict>: The labware to use, including the canvas
+        pipette <str>: The pipette to use
+
+    Return: The id of the job and the uri to poll for its status
+    """
+    batch = request.get_json().get('batch', 'oldest')
+    if batch not in BATCH_MODES:
+        raise InvalidUsage.invalid_batch()
+    artpiece_ids = request.get_json().get('ids') if batch != 'best' else None
+    option_args = procedure_option_args(request.get_json(), batch)
+
+    num_pieces = 9
+    if option_args['pipette'][-5:] == 'multi':
+        if artpiece_ids and len(artpiece_ids) > 1:
+            raise InvalidUsage.invalid_pipette()
+        num_pieces = 1
     
-    requestor = get_current_user()
-    msg, procedure_loc = make_procedure(artpiece_ids, requestor=requestor, option_args=option_args)
+    job = create_procedure_job(get_current_user())
+    generate_procedure_async(job, artpiece_ids, num_pieces, option_args, procedure_store())
 
-    if procedure_loc:
-        unique_id = procedure_loc[1].split('_')[-1]
-        procedure_uri = f'/procedures/{unique_id}'
-    else:
-        procedure_uri = None
+    return jsonify({'job_id': job.id, 'status_uri': f'/jobs/{job.id}'}), 202
+
+
+@artpiece_blueprint.route('/jobs/<int:job_id>', methods=('GET', ))
+@jwt_required()
+@access_level_required(SuperUserRole.printer)
+def get_job_status(job_id):
+    """
+    Reports on a job made by a print request.
+
+    Parameters:
+        job_id <int>: The id of the job, in the url
+
+    Return: The job's status, 'Generating', 'Ready' or 'Failed', its progress
+        by artpiece and color, the procedure generation messages, and the uri
+        of the procedure once it is ready. Jobs for /procedure_runs_request
+        also list the uri of every run's procedure
+    """
+    job = JobModel.get_by_id(job_id)
+    if not job: raise InvalidUsage.resource_not_found()
+    progress = job.progress or {}
+
+    return jsonify({'job_id': job.id
+                    , 'status': str(job.status)
+                    , 'progress': {'stage': progress.get('stage'), 'artpieces': progress.get('artpieces', {})}
+                    , 'msg': progress.get('msg', [])
+                    , 'procedure_uri': job_procedure_uri(job)
+                    , 'procedure_uris': job_procedure_uris(job)
+                    }), 200
+
+
+@artpiece_blueprint.route('/procedure_runs_request', methods=('POST', ))
+@jwt_required()
+@access_level_required(SuperUserRole.printer)
+def receive_print_runs_request():
+    """
+    Starts generating procedures for more art than fits on the deck at once.
+    The artpieces are split into runs that share colors, with one procedure
+    and one job for each run. The procedures are made in the background, so
+    this returns at once with a job to poll at /jobs/<job_id>, which lists
+    every run's procedure when they are done.
+
+    Parameters:
+        ids <list>: Optional. The ids of the artpieces to print. By default,
+            all unprinted artpieces that can be printed at the location
+        labware <dict>: The labware to use, including the canvas
+        pipette <str>: The pipette to use
+        location <str>: Optional. The location the art will be printed at
+        ordering <str>: Optional. The print order strategy, as for /procedure_request
+
+    Return: The id of the job and the uri to poll for its status
+    """
+    artpiece_ids = request.get_json().get('ids')
+    option_args = procedure_option_args(request.get_json())
+    if not artpiece_ids:
+        printable = Artpiece.get_printable(unprinted_only=True, location=option_args.get('location'))
+        artpiece_ids = [artpiece.id for artpiece in printable]
+    if not artpiece_ids:
         raise InvalidUsage.resource_not_found()
-    
-    return jsonify({'msg':msg, 'procedure_uri':procedure_uri}), 201
+
+    run_size = 1 if option_args['pipette'][-5:] == 'multi' else 9
+    requestor = get_current_user()
+    job = create_procedure_job(requestor)
+    generate_procedure_runs_async(job, artpiece_ids, run_size, requestor, option_args, procedure_store())
+
+    return jsonify({'job_id': job.id, 'status_uri': f'/jobs/{job.id}'}), 202
 
 
 @artpiece_blueprint.route('/colors/get_all', methods=('GET', ))
@@ -0,0 +1,90 @@
+"""
+Background upload of artpiece images.
+
+Rendering an artpiece at each image size and uploading them to object
+storage used to hold up every submission, and a failed upload went
+unnoticed. A submitted artpiece is now saved with its images pending,
+and they are rendered and uploaded on a small thread pool, with a few
+retries, before the artpiece's image status is set.
+
+At most IMAGE_UPLOAD_QUEUE_SIZE uploads wait for the pool at a time.
+Past that, and when IMAGE_UPLOAD_WORKERS is 0, they run in the request.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from time import sleep
+from flask import current_app
+
+from web.extensions import db
+from web.api.file_manager import file_manager
+from web.database.models import ArtpieceModel, ImageStatus
+from .artpiece import Artpiece
+from ..email import with_context
+
+_fm = file_manager()
+_executor = None
+_queue_slots = None
+_executor_lock = Lock()
+
+
+def _get_executor(max_workers, queue_size):
+    global _executor, _queue_slots
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-upload')
+            _queue_slots = BoundedSemaphore(max(queue_size, 1))
+    return _executor, _queue_slots
+
+
+def retrying_store_file(retries, retry_delay_s):
+    # A store_file for Artpiece.store_images that tries again after each failure, waiting twice as long each time
+    def store_file(file, key):
+        for attempt in range(retries + 1):
+            if attempt:
+                sleep(retry_delay_s * 2 ** (attempt - 1))
+            file.seek(0)
+            try:
+                uri = _fm.store_file(file, key)
+            except Exception as e: #connection errors are not ClientErrors, so store_file lets them through
+                current_app.logger.warning(f'Could not upload {key}: {e!r}')
+                uri = False
+            if uri:
+                return uri
+        return False
+    return store_file
+
+
+def store_images(artpiece_id, art, color_mapping, store_file):
+    artpiece = Artpiece.get_by_id(artpiece_id)
+    if artpiece is None: #deleted before its turn came
+        return
+    try:
+        artpiece.store_images(art, color_mapping, store_file)
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception(f'Could not store the images of artpiece {artpiece_id}')
+        ArtpieceModel.get_by_id(artpiece_id).update(image_status=ImageStatus.failed, commit=True)
+
+
+def store_images_async(artpiece, art, color_mapping):
+    """
+    Queues store_images for artpiece on the image upload thread pool and
+    returns a Future that is done once its images are stored, or have failed.
+    The artpiece must be committed, so that the pool can load it.
+    """
+    app = current_app._get_current_object()
+    store_file = retrying_store_file(app.config['IMAGE_UPLOAD_RETRIES'], app.config['IMAGE_UPLOAD_RETRY_S'])
+    max_workers = app.config['IMAGE_UPLOAD_WORKERS']
+    if max_workers:
+        executor, queue_slots = _get_executor(max_workers, app.config['IMAGE_UPLOAD_QUEUE_SIZE'])
+        if queue_slots.acquire(blocking=False):
+            future = executor.submit(with_context(app, cleanup=db.session.remove),
+                                     store_images, artpiece.id, art, color_mapping, store_file)
+            future.add_done_callback(lambda _: queue_slots.release())
+            return future
+
+    #the pool is off or has too many uploads waiting, so this one holds up the request instead
+    store_images(artpiece.id, art, color_mapping, store_file)
+    future = Future()
+    future.set_result(None)
+    return future
@@ -0,0 +1,76 @@
+"""
+Background precomputation of print paths.
+
+Once an artpiece is confirmed, its print orders are worked out for every
+canvas type in the lab objects table and saved to the path cache. When a
+printer operator later requests a procedure, make_procedure mostly reads
+those cached orders instead of optimizing while they wait.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from flask import current_app
+
+from web.extensions import db
+from web.api.lab_objects.lab_objects import LabObject
+from web.database.models import ArtpieceModel
+from web.robot.art_processor import injector_options
+from web.robot.path_cache import PathCache
+from web.robot.procedure_line_injector import ProcedureLineInjector
+from ..email import with_context
+
+CANVAS_PROPERTIES = ('x_radius_mm', 'y_radius_mm', 'z_touch_position_frac', 'shape')
+
+_executor = None
+_executor_lock = Lock()
+
+
+def _get_executor(max_workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='path-precompute')
+    return _executor
+
+
+def canvas_types():
+    # Labware that print paths can be laid out on. Palettes and tip racks lack the canvas geometry
+    canvases = []
+    for labware in LabObject.stored_object_types('labware') or []:
+        canvas = LabObject.load_from_name(labware.name)
+        if canvas and all(prop in canvas.properties for prop in CANVAS_PROPERTIES):
+            canvases.append(canvas)
+    return canvases
+
+
+def precompute_print_paths(artpiece_id, optimizer):
+    artpiece = ArtpieceModel.get_by_id(artpiece_id)
+    if artpiece is None: #deleted before its turn came
+        return
+    try:
+        path_cache = PathCache(db.session)
+        injector = ProcedureLineInjector(**injector_options(optimizer), path_cache=path_cache)
+        for canvas in canvas_types():
+            injector.optimize_color_blocks([artpiece], canvas)
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception(f'Could not precompute print paths for artpiece {artpiece_id}')
+
+
+def precompute_print_paths_async(artpiece):
+    """
+    Queues precompute_print_paths on a small thread pool and returns at once.
+    The pool size comes from PATH_PRECOMPUTE_WORKERS. 0 turns precomputation off.
+    """
+    app = current_app._get_current_object()
+    max_workers = app.config['PATH_PRECOMPUTE_WORKERS']
+    if not max_workers:
+        return None
+    #use the same settings as procedure requests, or the cache keys will not match
+    optimizer = {'refine_passes': app.config['PATH_REFINEMENT_PASSES'],
+                 'workers': app.config['PROCEDURE_WORKERS'],
+                 'ordering': app.config['PATH_ORDERING'],
+                 'gantry_speed': app.config['ROBOT_GANTRY_SPEED'],
+                 'drying_time_s': app.config['DRYING_TIME_S']}
+    return _get_executor(max_workers).submit(
+            with_context(app, cleanup=db.session.remove), precompute_print_paths, artpiece.id, optimizer)
@@ -0,0 +1,120 @@
+"""
+Background generation of print procedures.
+
+Optimizing print paths can take longer than a request should be held open,
+so a print request only records a job in the 'Generating' state and hands
+the work to a small thread pool. The printer page then polls /jobs/<id>,
+which reports the job's progress, and its procedure once it is ready.
+A request for several runs works the same way. Its job is filled in by the
+first run, and lists the procedures of all of them when they are done.
+
+Progress is written from a session of its own, so that it can be committed
+while the procedure's own transaction is still open.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.orm import sessionmaker
+
+from web.extensions import db
+from web.database.models import JobModel, JobStatus
+from web.robot.art_processor import make_procedure, make_procedures
+from web.robot.procedure_progress import ProcedureProgress
+from ..email import with_context
+
+_executor = None
+_executor_lock = Lock()
+
+
+def _get_executor(max_workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='procedure-job')
+    return _executor
+
+
+def update_job(job_id, **values):
+    # Commits values to the job straight away, outside of the session generating its procedure
+    session = sessionmaker(bind=db.engine)()
+    try:
+        session.query(JobModel).filter(JobModel.id == job_id).update(values, synchronize_session=False)
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def create_procedure_job(requestor):
+    # A job for a print request, to be filled in once its procedure is generated
+    job = JobModel(request_date=datetime.now(),
+                   requestor=db.session.merge(requestor._model),
+                   status=JobStatus.generating,
+                   progress=ProcedureProgress().as_dict())
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def generate_procedure(job_id, artpiece_ids, num_pieces, option_args, store):
+    progress = ProcedureProgress(report=lambda state: update_job(job_id, progress=state))
+    try:
+        msg, procedure_loc = make_procedure(artpiece_ids, num_pieces=num_pieces, option_args=option_args,
+                                            session=db.session, store=store, job_id=job_id, progress=progress)
+    except Exception as e:
+        current_app.logger.exception(f'Could not generate the procedure for job {job_id}')
+        msg, procedure_loc = [f'Could not generate the procedure: {e}'], None
+    if procedure_loc is None:
+        update_job(job_id, status=JobStatus.failed, progress=dict(progress.as_dict(), msg=msg))
+
+
+def generate_procedure_async(job, artpiece_ids, num_pieces, option_args, store):
+    """
+    Queues generate_procedure for job on the procedure thread pool and
+    returns at once. The pool size comes from PROCEDURE_JOB_WORKERS.
+    """
+    app = current_app._get_current_object()
+    return _get_executor(app.config['PROCEDURE_JOB_WORKERS']).submit(
+            with_context(app, cleanup=db.session.remove),
+            generate_procedure, job.id, artpiece_ids, num_pieces, option_args, store)
+
+
+def generate_procedure_runs(job_id, artpiece_ids, run_size, requestor, option_args, store):
+    progress = ProcedureProgress(report=lambda state: update_job(job_id, progress=state))
+    try:
+        msg, procedure_locs = make_procedures(artpiece_ids, requestor=requestor, run_size=run_size, option_args=option_args,
+                                              session=db.session, store=store, job_id=job_id, progress=progress)
+    except Exception as e:
+        current_app.logger.exception(f'Could not generate the procedures for job {job_id}')
+        msg, procedure_locs = [f'Could not generate the procedures: {e}'], []
+    if not procedure_locs:
+        update_job(job_id, status=JobStatus.failed, progress=dict(progress.as_dict(), msg=msg))
+
+
+def generate_procedure_runs_async(job, artpiece_ids, run_size, requestor, option_args, store):
+    # As generate_procedure_async, for a request split into runs of at most run_size artpieces
+    app = current_app._get_current_object()
+    return _get_executor(app.config['PROCEDURE_JOB_WORKERS']).submit(
+            with_context(app, cleanup=db.session.remove),
+            generate_procedure_runs, job.id, artpiece_ids, run_size, requestor, option_args, store)
+
+
+def procedure_uri(file_name):
+    return f"/procedures/{file_name.split('_')[-1]}"
+
+
+def job_procedure_uri(job):
+    if job.status != JobStatus.ready or not job.file_name:
+        return None
+    return procedure_uri(job.file_name)
+
+
+def job_procedure_uris(job):
+    # The procedure of every run made for job's request, or just job's own
+    runs = (job.progress or {}).get('runs')
+    if job.status != JobStatus.ready or not runs:
+        return [uri for uri in [job_procedure_uri(job)] if uri]
+    return [procedure_uri(file_name) for file_name in runs]
@@ -6,6 +6,7 @@ from .validators import (validate_art_content_length, validate_color_keys, valid
 from .exceptions import InvalidUsage
 from ...biofoundry.strain import Strain
 from ...file_manager import file_manager
+from .artpiece import stored_image_key
 
 _fm = file_manager()
 
@@ -61,7 +62,9 @@ class PrintableSchema(Schema):
             , keys=fields.Str()
             , values=fields.List(fields.Tuple((fields.Int(), fields.Int())))
             )
-    img_uri = fields.Function(lambda obj: _fm.get_file_url(f'{obj.slug}_{int(obj.submit_date.timestamp()*1000)}.jpg'))
+    #the image size is given in the context, as image_size
+    img_uri = fields.Function(lambda obj, context: _fm.get_file_url(
+            stored_image_key(obj, context.get('image_size', 'full'))))
 
     @pre_dump
     def make_art_dict(self, obj, **kwargs):
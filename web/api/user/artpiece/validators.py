@@ -29,7 +29,7 @@ def validate_pixels(art, canvas_size):
     def has_pixels_within_canvas(pixels, canvas_size):
         # pixels are given as [y,x]
         for y, x in pixels:
-            if x > canvas_size['x'] or y > canvas_size['y']: #check for negative values?
+            if x < 0 or y < 0 or x > canvas_size['x'] or y > canvas_size['y']:
                 return False
         return True
 
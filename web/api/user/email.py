@@ -34,7 +34,8 @@ def safe_send_email(email, error_handler):
 
 def send_confirmation_email(artpiece, confirmation_url):
     def build_confirmation_email(artpiece, confirmation_url):
-        image_file = artpiece.get_image_as_jpg()
+        image_file, image_format = artpiece.get_image('preview')
+        extension = 'png' if image_format == 'PNG' else 'jpg'
         email = build_email(f'Submission: "{artpiece.title}"'
                 , sender=('ArtBot Confirmation', current_app.config['MAIL_DEFAULT_SENDER'])
                 , recipients=[artpiece.creator.email]
@@ -45,7 +46,8 @@ def send_confirmation_email(artpiece, confirmation_url):
                     , submission=artpiece
                     , confirmation_url=confirmation_url
                     )
-                , attachments=[('pixel-art.jpg', 'image/jpg', image_file)])
+                , attachments=[(f'pixel-art.{extension}', f'image/{image_format.lower()}', image_file)]
+                    if image_file else None)
         return email
 
     def log_confirmation_email_failure(artpiece):
@@ -67,12 +69,20 @@ def with_context(app, prepare=lambda : None, cleanup=lambda : None):
     return wrapper
 
 
-def send_confirmation_email_async(artpiece):
+def send_confirmation_email_async(artpiece, after=None):
+    """
+    Sends the confirmation email from a thread of its own, once the future
+    after is done if one is given, as when the artpiece's images are uploading
+    """
     confirmation_url = url_for(
             'main.art_confirmation'
             , token=artpiece.get_confirmation_token()
             , id=artpiece.id
             , _external=True)
-    Thread(target=with_context(
+    send = Thread(target=with_context(
         current_app._get_current_object(), artpiece.refresh, db.session.remove)
-        , args=(send_confirmation_email, artpiece, confirmation_url)).start()
+        , args=(send_confirmation_email, artpiece, confirmation_url)).start
+    if after is None:
+        send()
+    else:
+        after.add_done_callback(lambda _: send())
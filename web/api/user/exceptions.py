@@ -14,6 +14,9 @@ _BAD_REFERENCE = error_template('bad_reference', 'Referenced item doesn\'t exist
 _NOT_IMPLEMENTED = error_template('not_implemented', 'This endpoint has not been implemented')
 _CANNOT_CHANGE_OWN_ROLE = error_template('cannot_change_own_role', 'You cannot change your own role')
 _INVALID_PIPETTE = error_template('pipette_invalid', 'cannot print multiple artpieces with that pipette')
+_INVALID_BATCH = error_template('batch_invalid', 'batch must be "oldest" or "best"')
+_INVALID_ORDERING = error_template('ordering_invalid', 'ordering must be "greedy", "timed", "hilbert" or "serpentine"')
+_INVALID_IMAGE_SIZE = error_template('image_size_invalid', 'image size must be "thumbnail", "preview", "full" or "lossless"')
 
 class InvalidUsage(Exception):
     status_code = 400
@@ -79,6 +82,18 @@ class InvalidUsage(Exception):
     def invalid_pipette(cls):
         return cls(_INVALID_PIPETTE, status_code=400)
 
+    @classmethod
+    def invalid_batch(cls):
+        return cls(_INVALID_BATCH, status_code=400)
+
+    @classmethod
+    def invalid_ordering(cls):
+        return cls(_INVALID_ORDERING, status_code=400)
+
+    @classmethod
+    def invalid_image_size(cls):
+        return cls(_INVALID_IMAGE_SIZE, status_code=400)
+
 class InvalidPasswordException(InvalidUsage):
     def __init__(self):
         super().__init__(_INVALID_PASSWORD, status_code=422)
\ No newline at end of file
@@ -3,10 +3,11 @@ import datetime as dt
 from collections import namedtuple
 from enum import Enum
 
-from sqlalchemy.orm import relation
+from sqlalchemy.orm import relation, backref
 from .database import (Model, SurrogatePK, db, Column, Table, Base,
                               reference_col, relationship, deferred, composite,
                               OrderedEnum)
+from .pixel_packing import pack_pixels, unpack_pixels
 
 class SubmissionStatus(Enum):
     submitted = 'Submitted'
@@ -17,6 +18,22 @@ class SubmissionStatus(Enum):
     def __str__(self):
         return self.value
 
+class JobStatus(Enum):
+    generating = 'Generating'
+    ready = 'Ready'
+    failed = 'Failed'
+
+    def __str__(self):
+        return self.value
+
+class ImageStatus(Enum):
+    pending = 'Pending'
+    stored = 'Stored'
+    failed = 'Failed'
+
+    def __str__(self):
+        return self.value
+
 job_artpiece_association = Table('job_artpiece_association', Model.metadata,
     Column('job_id', db.ForeignKey('jobs.id'), primary_key=True),
     Column('artpiece_id', db.ForeignKey('artpieces.id'), primary_key=True)
@@ -36,22 +53,92 @@ class ArtpieceModel(SurrogatePK, Model):
             , nullable=False, name='submission_status')
     confirmed = Column(db.Boolean, nullable=False)
     image_uri = Column(db.String(128), nullable=False)
+    image_sizes = Column(db.JSON(), nullable=True) #sizes the image was stored at. None for artpieces with only the full image
+    image_status = Column(
+            db.Enum(ImageStatus, values_callable=lambda x: [e.value for e in x])
+            , nullable=False, default=ImageStatus.stored) #pending until the image is uploaded
 
     def __repr__(self):
         return '<%r: %r>' % (self.id, self.title)
 
+class SlugCounterModel(Model):
+    """
+    Last number given to artpieces whose titles make the same slug.
+    Artpiece slugs are the slug and that number, as in 'my-art#3'.
+    """
+    __tablename__ = 'slug_counters'
+
+    slug = Column(db.String(60), primary_key=True)
+    last_number = Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return '<%r: %r>' % (self.slug, self.last_number)
+
+class MonthlySubmissionCountModel(Model):
+    """
+    Number of artpieces submitted in each month, kept up to date as they are
+    submitted and deleted, so the monthly limit is checked without counting them
+    """
+    __tablename__ = 'monthly_submission_counts'
+
+    month = Column(db.Date(), primary_key=True) #first day of the month
+    count = Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return '<%r: %r>' % (self.month, self.count)
+
 class ColorBlockModel(SurrogatePK, Model):
     __tablename__ = 'color_blocks'
 
-    artpiece = relationship('ArtpieceModel', backref='color_blocks', lazy="joined")
+    artpiece = relationship('ArtpieceModel', backref=backref('color_blocks', cascade='all, delete-orphan'), lazy="joined")
     artpiece_id = Column('artpiece_id', db.ForeignKey('artpieces.id'), primary_key=True, autoincrement='ignore_fk')
     color = relationship('BacterialColorModel')
     color_id = Column('color_id', db.ForeignKey('bacterial_colors.id'), primary_key=True, autoincrement='ignore_fk')
-    coordinates = Column(db.JSON(), nullable=False)
+    pixels = Column(db.LargeBinary(), nullable=False) #[y, x] pixel coordinates, packed by pixel_packing
+
+    @property
+    def pixel_array(self):
+        """
+        The block's pixels as a read-only (N,2) array of [y, x], sorted by
+        row and then column. Decoded on first use, and again only when pixels changes.
+        """
+        decoded = getattr(self, '_decoded_pixels', None)
+        if decoded is None or decoded[0] is not self.pixels:
+            pixel_array = unpack_pixels(self.pixels)
+            pixel_array.flags.writeable = False
+            decoded = self._decoded_pixels = (self.pixels, pixel_array)
+        return decoded[1]
+
+    @property
+    def coordinates(self):
+        # The pixels as a list of [y, x] lists, as they were stored before being packed
+        return self.pixel_array.tolist()
+
+    @coordinates.setter
+    def coordinates(self, coordinates):
+        self.pixels = pack_pixels(coordinates)
 
     def __repr__(self):
         return '<%r: %r>' % (self.artpiece, self.color)
     
+class PrintPathCacheModel(SurrogatePK, Model):
+    """
+    Print order of one color block, as found by the path optimizer.
+    cache_key is a hash of everything the optimizer's result depends on,
+    so a reprint with the same art, canvas and settings can skip optimization.
+    """
+    __tablename__ = 'print_path_cache'
+
+    cache_key = Column(db.String(64), nullable=False, unique=True, index=True)
+    artpiece_id = Column(db.Integer, db.ForeignKey('artpieces.id', ondelete="CASCADE"), nullable=False, index=True)
+    order = Column(db.JSON(), nullable=False)
+    travel_before_mm = Column(db.Float, nullable=False)
+    travel_after_mm = Column(db.Float, nullable=False)
+    created_at = Column(db.DateTime(), nullable=False)
+
+    def __repr__(self):
+        return '<%r: %r>' % (self.artpiece_id, self.cache_key)
+
 class UserRole(OrderedEnum):
     artist = 'Artist'
 
@@ -95,8 +182,13 @@ class JobModel(SurrogatePK, Model):
     __tablename__ = 'jobs'
 
     request_date = Column(db.DateTime(), nullable=False)
-    file_name = Column(db.String(50), nullable=False)
+    file_name = Column(db.String(50)) #empty until the procedure is generated
     options = Column(db.JSON())
+    run_time_estimate = Column(db.JSON()) #seconds, in total and by color and plate
+    status = Column(
+            db.Enum(JobStatus, values_callable=lambda x: [e.value for e in x])
+            , nullable=False, default=JobStatus.ready)
+    progress = Column(db.JSON()) #stage, color blocks done by artpiece, and messages while generating
     super_user_id = Column(db.Integer, db.ForeignKey('super_users.id'), nullable=False)
 
     artpieces = relationship('ArtpieceModel', 
@@ -0,0 +1,76 @@
+"""
+Compact storage for the pixels of a color block.
+
+A color block's pixels were stored as a JSON list of [y, x] pairs, which
+Postgres stores and psycopg2 parses one small list at a time. They are
+now packed into bytes, in one of two encodings. Each starts with a one
+byte tag, followed by little-endian uint16s:
+
+    b'R' run-length: (y, x, length) of each run of neighbouring pixels along a row
+    b'B' bitmap: (y, x, height, width) of the bounding box, then a bit for
+         each of its pixels, row by row, as packed by np.packbits
+
+pack_pixels uses whichever is shorter. Art drawn in strokes and fills
+packs well as runs, scattered pixels as a bitmap. Pixels are unpacked
+sorted by row and then column, without duplicates.
+"""
+import numpy as np
+
+RUN_LENGTH = b'R'
+BITMAP = b'B'
+MAX_COORDINATE = 32767 #keeps run lengths within a uint16 as well
+_UINT16 = np.dtype('<u2')
+_BITMAP_HEADER = 1 + 4 * _UINT16.itemsize
+
+
+def pack_pixels(coordinates):
+    # Packs [y, x] pixel coordinates, in any order, into bytes
+    pixels = np.asarray(coordinates, dtype=np.int64).reshape(-1, 2)
+    if len(pixels) and (pixels.min() < 0 or pixels.max() > MAX_COORDINATE):
+        raise ValueError(f'Pixel coordinates must be between 0 and {MAX_COORDINATE}')
+    pixels = np.unique(pixels, axis=0) #sorted by row, then column
+
+    runs = _runs(pixels)
+    run_length_size = 1 + runs.size * _UINT16.itemsize
+    if len(pixels):
+        height, width = pixels.max(axis=0) - pixels.min(axis=0) + 1
+        if _BITMAP_HEADER + (height * width + 7) // 8 < run_length_size:
+            return _bitmap(pixels, height, width)
+    return RUN_LENGTH + runs.astype(_UINT16).tobytes()
+
+
+def unpack_pixels(data):
+    # The (N,2) array of [y, x] pixels packed by pack_pixels
+    data = bytes(data) #psycopg2 returns bytea columns as memoryviews
+    tag = data[:1]
+    if tag == RUN_LENGTH:
+        runs = np.frombuffer(data, _UINT16, offset=1).reshape(-1, 3).astype(np.int64)
+        lengths = runs[:, 2]
+        run_starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        y = np.repeat(runs[:, 0], lengths)
+        x = np.repeat(runs[:, 1], lengths) + np.arange(lengths.sum()) - run_starts
+        return np.column_stack((y, x))
+    if tag == BITMAP:
+        y, x, height, width = np.frombuffer(data, _UINT16, count=4, offset=1).astype(np.int64)
+        bits = np.unpackbits(np.frombuffer(data, np.uint8, offset=_BITMAP_HEADER), count=height * width)
+        return np.argwhere(bits.reshape(height, width)) + (y, x)
+    raise ValueError(f'Unknown pixel encoding: {tag!r}')
+
+
+def _runs(pixels):
+    # (y, x, length) of each run of neighbouring pixels in a row, from pixels sorted by row and column
+    if not len(pixels):
+        return np.empty((0, 3), dtype=np.int64)
+    run_start = np.ones(len(pixels), dtype=bool)
+    run_start[1:] = (pixels[1:, 0] != pixels[:-1, 0]) | (pixels[1:, 1] != pixels[:-1, 1] + 1)
+    starts = np.flatnonzero(run_start)
+    lengths = np.diff(np.append(starts, len(pixels)))
+    return np.column_stack((pixels[starts], lengths))
+
+
+def _bitmap(pixels, height, width):
+    origin = pixels.min(axis=0)
+    grid = np.zeros((height, width), dtype=bool)
+    grid[pixels[:, 0] - origin[0], pixels[:, 1] - origin[1]] = True
+    header = np.array([origin[0], origin[1], height, width]).astype(_UINT16)
+    return BITMAP + header.tobytes() + np.packbits(grid).tobytes()
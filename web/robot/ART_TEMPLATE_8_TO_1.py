@@ -3,6 +3,11 @@ from typing import List, Optional, Union
 from opentrons import protocol_api
 from opentrons.types import Location
 import math
+import array
+import base64
+import itertools
+import sys
+import zlib
 from opentrons.protocol_api.instrument_context import InstrumentContext
 from opentrons.protocol_api.labware import Labware
 from opentrons.protocol_api import labware
@@ -90,6 +95,25 @@ metadata = {
     }
 
 
+def decode_pixels(pixels):
+    # Pixels come either as a literal {color: {art_title: [(x, y, z), ...]}}, or packed
+    # by the procedure builder as int16 steps in x and y, zlib-compressed and base64-encoded
+    if pixels.get('encoding') != 'int16-steps-zlib-base64':
+        return pixels
+    scale = pixels['scale']
+    decoded = dict()
+    for color, pixels_by_artpiece in pixels['pixels'].items():
+        decoded[color] = dict()
+        for art_title, (z, packed) in pixels_by_artpiece.items():
+            steps = array.array('h', zlib.decompress(base64.b64decode(packed)))
+            if sys.byteorder == 'big':
+                steps.byteswap()
+            x = itertools.accumulate(steps[0::2])
+            y = itertools.accumulate(steps[1::2])
+            decoded[color][art_title] = [(pixel_x / scale, pixel_y / scale, z) for pixel_x, pixel_y in zip(x, y)]
+    return decoded
+
+
 def distribute_to_agar(pipette, vol, source, destination, disposal_vol):
     max_volume = pipette.max_volume
     needs_new_tip = True
@@ -124,6 +148,25 @@ def distribute_to_agar(pipette, vol, source, destination, disposal_vol):
     pipette.drop_tip()
 
 
+def replay_schedule(pipette, vol, source, destination, aspirations):
+    # Follows the liquid-handling schedule planned by the procedure builder.
+    # Each aspiration is (wells, aspirate volume, new tip) and covers the next wells in destination
+    dest = iter(destination)
+    for wells, asp_vol, new_tip in aspirations:
+        if new_tip:
+            if pipette.has_tip: pipette.drop_tip()
+            pipette.pick_up_tip()
+
+        pipette.aspirate(asp_vol, source)
+        pipette.touch_tip(source)
+
+        for well in itertools.islice(dest, wells):
+            pipette.move_to(well)
+            pipette.dispense(vol)
+
+    pipette.drop_tip()
+
+
 def run(protocol: protocol_api.ProtocolContext):  
     # a tip rack for our pipette
     tiprack = protocol.load_labware('%%TIPRACK GOES HERE%%', 10)
@@ -135,8 +178,9 @@ def run(protocol: protocol_api.ProtocolContext):
     pipette = get_pipette(protocol, '%%PIPETTE GOES HERE%%', 'right', tip_racks=[tiprack])
 
     # load all of the 
-    pixels_by_color_by_artpiece = %%PIXELS GO HERE%%
+    pixels_by_color_by_artpiece = decode_pixels(%%PIXELS GO HERE%%)
     canvas_locations = %%CANVAS LOCATIONS GO HERE%%
+    liquid_schedule = %%SCHEDULE GOES HERE%%
     color_map = %%COLORS GO HERE%%
 
     # a function that gets us the next available well in a plate
@@ -157,6 +201,7 @@ def run(protocol: protocol_api.ProtocolContext):
         canvas_labware[art_title] = protocol.load_labware('%%CANVAS GOES HERE%%', canvas_locations[art_title])
 
     # wells to dispense each color material to
+    # plates are listed in the order the pipette should visit them, so keep that order
     pixels_by_color = dict()
     for color in pixels_by_color_by_artpiece:
         pixels_by_color[color] = list()
@@ -179,4 +224,8 @@ def run(protocol: protocol_api.ProtocolContext):
                 ]
 
     for color in pixels_by_color:
-        distribute_to_agar(pipette, 0.4, palette_colors[color], pixels_by_color[color], disposal_vol=2)
\ No newline at end of file
+        if liquid_schedule:
+            replay_schedule(pipette, liquid_schedule['vol'], palette_colors[color], pixels_by_color[color],
+                            liquid_schedule['aspirations'][color])
+        else:
+            distribute_to_agar(pipette, 0.4, palette_colors[color], pixels_by_color[color], disposal_vol=2)
\ No newline at end of file
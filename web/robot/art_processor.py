@@ -1,15 +1,27 @@
 import sqlalchemy as sa
 from sqlalchemy.orm import sessionmaker
 import string
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 import sys
 import math
 from contextlib import contextmanager
+from threading import Lock
 
 from web.api.lab_objects.lab_objects import LabObject, LabObjectPropertyCollection #Uncomfortable with this dependency
-from web.database.models import (ArtpieceModel, JobModel, SuperUserModel, SuperUserRole, SubmissionStatus, BacterialColorModel, LabObjectsModel)
+from web.settings import Config
+from web.database.models import (ArtpieceModel, JobModel, JobStatus, SuperUserModel, SuperUserRole, SubmissionStatus, BacterialColorModel, LabObjectsModel)
 from web.robot.procedure_line_injector import ProcedureLineInjector, ProcedureLineInjector8To1Pipette
+from web.robot.path_cache import PathCache
+from web.robot.procedure_template import ProcedureTemplate
+from web.robot.procedure_store import ProcedureStore, LocalProcedureBackend, prune_procedures
+from web.robot.liquid_schedule import LiquidScheduler
+from web.robot.batch_packer import BatchPacker, BATCH_MODES, batch_colors, palette_reloads
+from web.robot.run_time_estimator import (RunTimeEstimator, TEMPLATE_VOLUMES, PIPETTES,
+                                          pipette_model, format_duration)
+
+# Arguments that tune how the procedure is built rather than name labware
+OPTIMIZER_ARGS = ('refine_passes', 'workers', 'gantry_speed', 'pixel_encoding', 'batch', 'max_wait_days', 'retention_days', 'ordering', 'drying_time_s')
 
 def read_args(args):
     if not args: args = {'notebook':False
@@ -18,8 +30,85 @@ def read_args(args):
                         ,'canvas': 'bioartbot_petriplate_90mm_round'
                         }
     NOTEBOOK = args.pop('notebook')
+    OPTIMIZER = {arg: args.pop(arg) for arg in OPTIMIZER_ARGS if arg in args}
+    if NOTEBOOK: OPTIMIZER['pixel_encoding'] = 'literal' #the notebook template has no decoder
     LABWARE = args #assume unused args are all labware
-    return NOTEBOOK, LABWARE
+    return NOTEBOOK, LABWARE, OPTIMIZER
+
+def injector_options(OPTIMIZER):
+    return {'refine_passes': OPTIMIZER.get('refine_passes') or 0,
+            'workers': OPTIMIZER.get('workers') or 0,
+            'pixel_encoding': OPTIMIZER.get('pixel_encoding') or 'packed',
+            'ordering': OPTIMIZER.get('ordering') or 'greedy',
+            **{arg: OPTIMIZER[arg] for arg in ('drying_time_s', 'gantry_speed') if OPTIMIZER.get(arg)}}
+
+def select_artpieces(session, artpiece_ids, num_pieces, OPTIMIZER):
+    """
+    The artpieces to print. Explicit ids, or the oldest confirmed artpieces,
+    are taken in submission order. With batch='best' and no ids, a BatchPacker
+    picks the queued artpieces that print best together.
+    """
+    batch = OPTIMIZER.get('batch') or 'oldest'
+    if batch not in BATCH_MODES:
+        raise ValueError(f'Unknown batch mode: {batch}')
+
+    query_filter = (ArtpieceModel.confirmed == True,
+                   )
+    if artpiece_ids: query_filter += (ArtpieceModel.id.in_(artpiece_ids),)
+    query = (session.query(ArtpieceModel)
+            .filter(*query_filter)
+            .order_by(ArtpieceModel.submit_date.asc()))
+
+    if artpiece_ids or batch == 'oldest':
+        return query.limit(num_pieces).all()
+    packer_options = {'max_wait': timedelta(days=OPTIMIZER['max_wait_days'])} if OPTIMIZER.get('max_wait_days') else {}
+    queue = query.filter(ArtpieceModel.status == SubmissionStatus.submitted).all()
+    return BatchPacker(num_pieces, **packer_options).pack(queue)
+
+def travel_summary(travel_report):
+    before = sum(block['before_mm'] for block in travel_report)
+    after = sum(block['after_mm'] for block in travel_report)
+    if after < before:
+        return f'Pipette travel: {before:.0f} mm before optimization, {after:.0f} mm after'
+    return f'Pipette travel: {after:.0f} mm'
+
+def ordering_summary(ordering_report):
+    cached = f", {ordering_report['cached']} of them cached" if ordering_report['cached'] else ''
+    return (f"Print order: {ordering_report['ordering']}, found in {ordering_report['seconds']:.1f} s"
+            f" for {ordering_report['blocks']} color blocks{cached}."
+            f" {ordering_report['early_revisits']} wells dispensed next to one that may still be wet")
+
+def liquid_schedules(procedure_line_injector, pipette, file_extension, OPTIMIZER):
+    # Only the .py templates replay a schedule. The notebook keeps distribute_to_agar
+    if file_extension != 'py' or pipette_model(pipette) not in PIPETTES:
+        return None
+    scheduler_options = {'gantry_speed': OPTIMIZER['gantry_speed']} if OPTIMIZER.get('gantry_speed') else {}
+    max_volume = PIPETTES[pipette_model(pipette)][0]
+    scheduler = LiquidScheduler(max_volume, *TEMPLATE_VOLUMES[file_extension], **scheduler_options)
+    injector = procedure_line_injector
+    palette = injector.slot_center(injector.PALETTE_SLOT)
+    return {color: scheduler.schedule(path, palette) for color, path in injector.color_paths().items()}
+
+def estimate_run_time(procedure_line_injector, pipette, file_extension, OPTIMIZER, schedules=None):
+    if pipette_model(pipette) not in PIPETTES:
+        return None
+    estimator_options = {'gantry_speed': OPTIMIZER['gantry_speed']} if OPTIMIZER.get('gantry_speed') else {}
+    estimator = RunTimeEstimator(pipette, *TEMPLATE_VOLUMES[file_extension], **estimator_options)
+    injector = procedure_line_injector
+    return estimator.estimate(injector.deck_paths(),
+                              palette=injector.slot_center(injector.PALETTE_SLOT),
+                              tiprack=injector.slot_center(injector.TIPRACK_SLOT),
+                              trash=injector.slot_center(injector.TRASH_SLOT),
+                              schedules=schedules)
+
+def run_time_summary(run_time, color_names):
+    if run_time is None:
+        return ['Estimated run time: unknown for this pipette']
+    by_color = ', '.join(f'{color_names.get(color, color)} {format_duration(seconds)}' for color, seconds in run_time['by_color'].items())
+    by_plate = ', '.join(f'{slug} {format_duration(seconds)}' for slug, seconds in run_time['by_plate'].items())
+    return [f"Estimated run time: {format_duration(run_time['total_s'])}",
+            f'By color: {by_color}',
+            f'By plate: {by_plate}']
 
 def initiate_environment(SQLALCHEMY_DATABASE_URI = None, APP_DIR = None):
     if not APP_DIR:
@@ -30,10 +119,21 @@ def initiate_environment(SQLALCHEMY_DATABASE_URI = None, APP_DIR = None):
             raise Exception('Database URI expected in env vars or passed explcitly')
     return APP_DIR, SQLALCHEMY_DATABASE_URI
 
+_sessionmakers = dict()
+_sessionmakers_lock = Lock()
+
 def initiate_sql(SQLALCHEMY_DATABASE_URI):
-    SQL_ENGINE = sa.create_engine(SQLALCHEMY_DATABASE_URI)
-    Session = sessionmaker(bind=SQL_ENGINE)
-    return Session
+    """
+    Session factory for a database. The engine, and so its connection pool,
+    is made once per database and kept for the life of the process.
+    Pool settings come from Config.PROCEDURE_ENGINE_OPTIONS.
+    """
+    key = str(SQLALCHEMY_DATABASE_URI)
+    with _sessionmakers_lock:
+        if key not in _sessionmakers:
+            SQL_ENGINE = sa.create_engine(SQLALCHEMY_DATABASE_URI, **Config.PROCEDURE_ENGINE_OPTIONS)
+            _sessionmakers[key] = sessionmaker(bind=SQL_ENGINE)
+        return _sessionmakers[key]
 
 @contextmanager
 def session_scope(Session):
@@ -48,73 +148,180 @@ def session_scope(Session):
     finally:
         session.close()
 
-def make_procedure(artpiece_ids, requestor = None, SQLALCHEMY_DATABASE_URI = None, APP_DIR = None, num_pieces = 9, option_args = None): 
-    NOTEBOOK, LABWARE = read_args(option_args)
+@contextmanager
+def procedure_session(SQLALCHEMY_DATABASE_URI = None, APP_DIR = None, session = None):
+    """
+    The app directory and a transactional session for making procedures.
+    The web app passes in its own session, which is committed or rolled
+    back here but left open for the app to clean up. Otherwise a session
+    is made from the pooled engine for the database.
+    """
+    if session is not None:
+        APP_DIR = APP_DIR or os.path.abspath(os.path.dirname(__file__))
+        try:
+            yield APP_DIR, session
+            session.commit()
+        except:
+            session.rollback()
+            raise
+        return
     APP_DIR, SQLALCHEMY_DATABASE_URI = initiate_environment(SQLALCHEMY_DATABASE_URI, APP_DIR)
-    Session = initiate_sql(SQLALCHEMY_DATABASE_URI)
+    with session_scope(initiate_sql(SQLALCHEMY_DATABASE_URI)) as session:
+        yield APP_DIR, session
+
+def default_store(APP_DIR):
+    return ProcedureStore(LocalProcedureBackend(os.path.join(APP_DIR,'procedures')))
+
+def apply_retention(session, store, OPTIMIZER):
+    if OPTIMIZER.get('retention_days'):
+        prune_procedures(session, store, OPTIMIZER['retention_days'])
 
-    with session_scope(Session) as session:
+def make_procedure(artpiece_ids, requestor = None, SQLALCHEMY_DATABASE_URI = None, APP_DIR = None, num_pieces = 9, option_args = None, session = None, store = None,
+                   job_id = None, progress = None):
+    """
+    Generates the procedure for one run of artpieces and records its job.
+    job_id names a job already made for the request, in the 'Generating'
+    state, which is filled in instead of adding a new one. progress is an
+    optional ProcedureProgress, told of each stage and optimized color block.
+    Returns the messages and the location of the procedure.
+    """
+    NOTEBOOK, LABWARE, OPTIMIZER = read_args(option_args)
+
+    with procedure_session(SQLALCHEMY_DATABASE_URI, APP_DIR, session) as (APP_DIR, session):
+        store = store or default_store(APP_DIR)
+        job = session.query(JobModel).get(job_id) if job_id is not None else None
 
         output_msg = []
         
-        query_filter = (ArtpieceModel.confirmed == True,
-                       )
-        if artpiece_ids: query_filter += (ArtpieceModel.id.in_(artpiece_ids),)
-
-        artpieces = (session.query(ArtpieceModel)
-                .filter(*query_filter)
-                .order_by(ArtpieceModel.submit_date.asc())
-                .limit(num_pieces)
-                .all())
+        if progress: progress.start('selecting')
+        artpieces = select_artpieces(session, artpiece_ids, num_pieces, OPTIMIZER)
 
         if not artpieces:
             output_msg.append('No new art found. All done.')
             return output_msg, None
 
         output_msg.append(f'Loaded {len(artpieces)} pieces of art')
-        for artpiece in artpieces:
-            output_msg.append(f"{artpiece.id}: {artpiece.title}, {artpiece.submit_date}")
+        if OPTIMIZER.get('batch') == 'best' and not artpiece_ids:
+            output_msg.append(f'Packed for shared colors: {len(batch_colors(artpieces))} palette wells')
+        run_msg, unique_file_name = write_procedure(session, store, artpieces, requestor, APP_DIR, NOTEBOOK, LABWARE, OPTIMIZER,
+                                                    job=job, progress=progress)
+        output_msg.extend(run_msg)
+        if job is not None and unique_file_name is not None:
+            job.progress = dict(progress.as_dict() if progress else {}, stage='done', msg=output_msg)
+        apply_retention(session, store, OPTIMIZER)
 
-        # Get all colors
-        colors = session.query(BacterialColorModel).all()
+    if unique_file_name is None:
+        return output_msg, None
+    return output_msg, [store.location,unique_file_name]
 
-        # Get canvas plate dimensions
-        try:
-            canvas = LabObject.load_from_name(LABWARE['canvas'])
-        except: #kludgy fix to handle when CLI is used instead of web interface
-            canvas_model = session.query(LabObjectsModel).filter(LabObjectsModel.name==LABWARE['canvas']).one_or_none()
-            property_model = canvas_model.properties.all()
-            canvas = LabObject(canvas_model.name, canvas_model.obj_class, LabObjectPropertyCollection._from_model(property_model))
-        
-        procedure_line_injector = ProcedureLineInjector()
-
-        if LABWARE["pipette"] == "p10_multi":
-            with open(os.path.join(APP_DIR,f'ART_TEMPLATE_8_TO_1.py')) as template_file:
-                template_string = template_file.read()
-            
-            file_extension = "py"
-            procedure_line_injector = ProcedureLineInjector8To1Pipette()
-            if len(artpieces) != 1:
-                output_msg.append("ERROR: 8 to 1 pipette cannot accommodate more than 1 artpiece.")
-                return output_msg, None, 
+def make_procedures(artpiece_ids, requestor = None, SQLALCHEMY_DATABASE_URI = None, APP_DIR = None, run_size = 9, option_args = None, session = None, store = None,
+                    job_id = None, progress = None):
+    """
+    Prints more art than fits on the deck at once. The artpieces, or every
+    queued artpiece when no ids are given, are split into runs of at most
+    run_size by BatchPacker.plan_runs, and a procedure and job are made for
+    each run. job_id names a job already made for the request, which is
+    filled in by the first run and lists the procedure of every run once
+    they are all written. progress is as for make_procedure.
+    Returns the messages and the location of each procedure.
+    """
+    NOTEBOOK, LABWARE, OPTIMIZER = read_args(option_args)
+
+    with procedure_session(SQLALCHEMY_DATABASE_URI, APP_DIR, session) as (APP_DIR, session):
+        store = store or default_store(APP_DIR)
+        job = session.query(JobModel).get(job_id) if job_id is not None else None
+        if progress: progress.start('selecting')
+
+        query_filter = (ArtpieceModel.confirmed == True,
+                       )
+        if artpiece_ids:
+            query_filter += (ArtpieceModel.id.in_(artpiece_ids),)
         else:
-            #Get Python art procedure template
-            file_extension = 'ipynb' if NOTEBOOK == True else 'py' #Use Jupyter notbook template or .py template
-            with open(os.path.join(APP_DIR,f'ART_TEMPLATE.{file_extension}')) as template_file:
-                template_string = template_file.read()
+            query_filter += (ArtpieceModel.status == SubmissionStatus.submitted,)
+        queue = session.query(ArtpieceModel).filter(*query_filter).all()
+
+        if not queue:
+            return ['No new art found. All done.'], []
+
+        packer_options = {'max_wait': timedelta(days=OPTIMIZER['max_wait_days'])} if OPTIMIZER.get('max_wait_days') else {}
+        runs = BatchPacker(run_size, **packer_options).plan_runs(queue)
+        output_msg = [f'Loaded {len(queue)} pieces of art in {len(runs)} runs, with {palette_reloads(runs)} palette wells to fill']
+
+        file_names = []
+        for run_number, artpieces in enumerate(runs, start=1):
+            output_msg.append(f'Run {run_number}: {len(artpieces)} pieces of art')
+            run_msg, unique_file_name = write_procedure(session, store, artpieces, requestor, APP_DIR, NOTEBOOK, LABWARE, OPTIMIZER,
+                                                        job=job if not file_names else None, progress=progress)
+            output_msg.extend(run_msg)
+            if unique_file_name is None: #the runs made so far are still kept
+                break
+            file_names.append(unique_file_name)
+        if job is not None and file_names:
+            job.progress = dict(progress.as_dict() if progress else {}, stage='done', msg=output_msg, runs=file_names)
+        apply_retention(session, store, OPTIMIZER)
+
+    return output_msg, [[store.location, unique_file_name] for unique_file_name in file_names]
+
+def write_procedure(session, store, artpieces, requestor, APP_DIR, NOTEBOOK, LABWARE, OPTIMIZER, job = None, progress = None):
+    """
+    Writes the procedure for one run of artpieces to the store and adds its job to the session,
+    or fills in job when one is given. Returns the messages and the procedure
+    file name, which is None when the run cannot be printed.
+    """
+    output_msg = []
+    for artpiece in artpieces:
+        output_msg.append(f"{artpiece.id}: {artpiece.title}, {artpiece.submit_date}")
+
+    # Get all colors
+    colors = session.query(BacterialColorModel).all()
+
+    # Get canvas plate dimensions
+    try:
+        canvas = LabObject.load_from_name(LABWARE['canvas'])
+    except: #kludgy fix to handle when CLI is used instead of web interface
+        canvas_model = session.query(LabObjectsModel).filter(LabObjectsModel.name==LABWARE['canvas']).one_or_none()
+        property_model = canvas_model.properties.all()
+        canvas = LabObject(canvas_model.name, canvas_model.obj_class, LabObjectPropertyCollection._from_model(property_model))
+    
+    path_cache = PathCache(session)
+    procedure_line_injector = ProcedureLineInjector(**injector_options(OPTIMIZER), path_cache=path_cache, progress=progress)
 
-        procedure, canvas_locations = procedure_line_injector.add_all_lines(template_string, LABWARE, artpieces, canvas, colors)
+    if LABWARE["pipette"] == "p10_multi":
+        template = ProcedureTemplate.load(os.path.join(APP_DIR,f'ART_TEMPLATE_8_TO_1.py'))
+        
+        file_extension = "py"
+        procedure_line_injector = ProcedureLineInjector8To1Pipette(**injector_options(OPTIMIZER), path_cache=path_cache, progress=progress)
+        if len(artpieces) != 1:
+            output_msg.append("ERROR: 8 to 1 pipette cannot accommodate more than 1 artpiece.")
+            return output_msg, None
+    else:
+        #Get Python art procedure template
+        file_extension = 'ipynb' if NOTEBOOK == True else 'py' #Use Jupyter notbook template or .py template
+        template = ProcedureTemplate.load(os.path.join(APP_DIR,f'ART_TEMPLATE.{file_extension}'))
+
+    if progress: progress.start('optimizing', artpieces)
+    procedure_lines, canvas_locations = procedure_line_injector.all_lines(LABWARE, artpieces, canvas, colors)
+    if progress: progress.start('writing')
+    schedules = liquid_schedules(procedure_line_injector, LABWARE['pipette'], file_extension, OPTIMIZER)
+    procedure_lines.update(procedure_line_injector.schedule_lines(schedules, *TEMPLATE_VOLUMES[file_extension]))
+    run_time = estimate_run_time(procedure_line_injector, LABWARE['pipette'], file_extension, OPTIMIZER, schedules)
+    color_names = {str(color.id): color.name for color in colors}
 
-        now = datetime.now().strftime("%Y%m%d-%H%M%S")
-        unique_file_name = f'ARTISTIC_PROCEDURE_{now}.{file_extension}'
-        with open(os.path.join(APP_DIR,'procedures',unique_file_name),'w') as output_file:
-            output_file.write(procedure)
+    unique_file_name = store.save(template.stream(procedure_lines), file_extension)
 
-        for artpiece in artpieces:
-            artpiece.status = SubmissionStatus.processed
+    for artpiece in artpieces:
+        artpiece.status = SubmissionStatus.processed
 
-        #Job creation should probably be the responsibility of a different function
-        #This is too messy
+    output_msg.append('Successfully generated artistic procedure')
+    output_msg.append(ordering_summary(procedure_line_injector.ordering_report))
+    output_msg.append(travel_summary(procedure_line_injector.travel_report))
+    output_msg.extend(run_time_summary(run_time, color_names))
+    output_msg.append('The following slots will be used:')
+    output_msg.append('\n'.join([f'Slot {str(canvas_locations[key])}: "{key}"' for key in canvas_locations]))
+
+    #Job creation should probably be the responsibility of a different function
+    #This is too messy
+    if job is None:
         if requestor is None:
             requestor = session.query(SuperUserModel).filter(SuperUserModel.email=='null').one_or_none()
             if requestor is None:
@@ -122,15 +329,13 @@ def make_procedure(artpiece_ids, requestor = None, SQLALCHEMY_DATABASE_URI = Non
         else:
             requestor = requestor._model
         job = JobModel(request_date=datetime.now(),
-                        file_name=unique_file_name,
                         requestor=session.merge(requestor),
-                        options = LABWARE,
-                        artpieces = artpieces
                         )
         session.add(job)
-
-    output_msg.append('Successfully generated artistic procedure')
-    output_msg.append('The following slots will be used:')
-    output_msg.append('\n'.join([f'Slot {str(canvas_locations[key])}: "{key}"' for key in canvas_locations]))
+    job.file_name = unique_file_name
+    job.options = LABWARE
+    job.run_time_estimate = run_time
+    job.artpieces = artpieces
+    job.status = JobStatus.ready
     
-    return output_msg, [os.path.join(APP_DIR,'procedures'),unique_file_name]
+    return output_msg, unique_file_name
@@ -0,0 +1,104 @@
+"""
+Chooses which queued artpieces to print together.
+
+Taking the oldest artpieces in the queue can put many colors in one run
+that only a single plate uses. Each of those colors needs its own palette
+well, tips and trips to the palette. A BatchPacker instead fills the run
+with artpieces that share colors, weighing the cost of each new color
+against the wells each artpiece adds.
+
+Nothing starves: the oldest queued artpiece is always printed, and so is
+every artpiece that has waited longer than max_wait. When the queue needs
+more than one run, plan_runs splits all of it between runs.
+"""
+from datetime import datetime, timedelta
+
+BATCH_MODES = ('oldest', 'best')
+
+
+def batch_colors(batch):
+    # The colors, and so the palette wells, a batch of artpieces uses
+    return {color_block.color_id for artpiece in batch for color_block in artpiece.color_blocks}
+
+
+def palette_reloads(runs):
+    # Palette wells to fill over a sequence of runs. A color the previous run used is already in the palette
+    reloads = 0
+    previous = set()
+    for run in runs:
+        colors = batch_colors(run)
+        reloads += len(colors - previous)
+        previous = colors
+    return reloads
+
+
+class BatchPacker:
+    def __init__(self, num_pieces, max_wait=timedelta(days=14), color_cost_s=120, well_cost_s=0.6, now=None):
+        """
+        num_pieces: most artpieces in a batch
+        max_wait: artpieces submitted longer ago than this are always in the batch
+        color_cost_s: estimated time a color adds to a run. Filling its palette
+            well, and its tips, palette trips and trash run
+        well_cost_s: estimated time each pixel adds to a run
+        """
+        self.num_pieces = num_pieces
+        self.max_wait = max_wait
+        self.color_cost_s = color_cost_s
+        self.well_cost_s = well_cost_s
+        self.now = now or datetime.now()
+
+    def added_cost(self, artpiece, colors):
+        # Estimated seconds artpiece adds to a run that already uses colors
+        new_colors = {color_block.color_id for color_block in artpiece.color_blocks} - colors
+        pixels = sum(len(color_block.pixel_array) for color_block in artpiece.color_blocks)
+        return len(new_colors) * self.color_cost_s + pixels * self.well_cost_s
+
+    def pack(self, queue):
+        """
+        Picks up to num_pieces artpieces from queue. The oldest artpiece and
+        any that are overdue go in first, then the rest are added greedily by
+        the time they add to the run, older artpieces first on a tie.
+        Returns the batch in submission order.
+        """
+        queue = sorted(queue, key=lambda artpiece: artpiece.submit_date)
+        if not queue or self.num_pieces < 1:
+            return []
+        overdue = [artpiece for artpiece in queue if self.now - artpiece.submit_date > self.max_wait]
+        batch = [queue[0]] + [artpiece for artpiece in overdue if artpiece is not queue[0]]
+        batch = batch[:self.num_pieces]
+        colors = batch_colors(batch)
+
+        remaining = [artpiece for artpiece in queue if artpiece not in batch]
+        while remaining and len(batch) < self.num_pieces:
+            best = min(remaining, key=lambda artpiece: self.added_cost(artpiece, colors)) #min keeps the oldest on a tie
+            batch.append(best)
+            remaining.remove(best)
+            colors.update(color_block.color_id for color_block in best.color_blocks)
+
+        return sorted(batch, key=lambda artpiece: artpiece.submit_date)
+
+    def plan_runs(self, queue):
+        """
+        Splits the whole queue into runs of up to num_pieces artpieces, each
+        packed as by pack from what the earlier runs left. The runs are then
+        ordered so that each shares as many colors as it can with the one
+        before it, which saves refilling palette wells between runs.
+        """
+        if self.num_pieces < 1:
+            raise ValueError('Runs must have room for at least one artpiece')
+        remaining = list(queue)
+        runs = []
+        while remaining:
+            run = self.pack(remaining)
+            runs.append(run)
+            remaining = [artpiece for artpiece in remaining if artpiece not in run]
+
+        if not runs:
+            return runs
+        ordered = [runs.pop(0)] #the run with the oldest artpiece goes first
+        while runs:
+            colors = batch_colors(ordered[-1])
+            following = max(runs, key=lambda run: len(batch_colors(run) & colors)) #max keeps the earliest packed on a tie
+            ordered.append(following)
+            runs.remove(following)
+        return ordered
@@ -0,0 +1,118 @@
+"""
+Print orders that follow a fixed curve over the plate.
+
+The greedy walk in ProcedureLineInjector finds a short path, but each
+step is a nearest-neighbour search. On very large canvases a fixed curve
+is quicker, at the cost of some extra travel. Sorting the points along
+the curve is O(n log n).
+
+Followed point by point, a curve places each point next to the one
+before it, too close for the drying rule. So the plate is first cut into
+cells required_gap wide, and the points are split into passes. Each pass
+holds at most one point from each cell, and only uses every other cell
+in each direction. Any two points in a pass are then at least required_gap
+apart, and each pass is printed along the curve. Passes alternate in
+direction, so each one starts near where the last one ended.
+
+Where two passes meet, a point may still be too close to one of the last
+DRYING_WINDOW points placed. Those are fixed by a short reorder window:
+the first point of the next REORDER_WINDOW along the curve that is clear
+of them goes next. If no point is clear, the next point is taken anyway,
+as the greedy walk does.
+"""
+import math
+from collections import deque
+import numpy as np
+from .path_refinement import DRYING_WINDOW
+
+CURVES = ('hilbert', 'serpentine')
+REORDER_WINDOW = 32 #points looked ahead along the curve for one that is clear of the last few placed
+
+
+def hilbert_index(x, y):
+    # Position of each integer (x, y) cell along a Hilbert curve covering all of them
+    x = np.array(x, dtype=np.int64)
+    y = np.array(y, dtype=np.int64)
+    side = 1 << max(1, int(max(x.max(initial=0), y.max(initial=0))).bit_length())
+    d = np.zeros(len(x), dtype=np.int64)
+    s = side >> 1
+    while s:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        #rotate the quadrant so that the curve inside it starts and ends in the right corners
+        flip = ~ry & rx
+        x = np.where(flip, side - 1 - x, x)
+        y = np.where(flip, side - 1 - y, y)
+        x, y = np.where(ry, x, y), np.where(ry, y, x)
+        s >>= 1
+    return d
+
+
+def serpentine_index(x, y):
+    # Position of each integer (x, y) cell along rows of cells, with every other row run backwards
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    width = int(x.max(initial=0)) + 1
+    return y * width + np.where(y % 2, width - 1 - x, x)
+
+
+CURVE_INDEX = {'hilbert': hilbert_index, 'serpentine': serpentine_index}
+
+
+def curve_order(points, required_gap, curve='hilbert'):
+    """
+    Returns the indices of an (N,2+) array of points in print order along
+    curve, one of CURVES, keeping points required_gap apart where it can.
+    """
+    if curve not in CURVE_INDEX:
+        raise ValueError(f'Unknown curve: {curve}')
+    points = np.asarray(points, dtype=float)
+    if not len(points):
+        return np.array([], dtype=int)
+    xy = points[:, :2]
+    cell_size = required_gap if required_gap > 0 else 1.0
+    cells = np.floor((xy - xy.min(axis=0)) / cell_size).astype(np.int64)
+
+    #rank of each point among the points in its cell
+    cell_ids = cells[:, 0] * (int(cells[:, 1].max()) + 1) + cells[:, 1]
+    by_cell = np.argsort(cell_ids, kind='stable')
+    sorted_ids = cell_ids[by_cell]
+    first_in_cell = np.concatenate(([0], np.flatnonzero(sorted_ids[1:] != sorted_ids[:-1]) + 1))
+    counts = np.diff(np.append(first_in_cell, len(points)))
+    rank = np.empty(len(points), dtype=np.int64)
+    rank[by_cell] = np.arange(len(points)) - np.repeat(first_in_cell, counts)
+
+    passes = rank * 4 + (cells[:, 0] % 2) * 2 + (cells[:, 1] % 2)
+    along = CURVE_INDEX[curve](cells[:, 0], cells[:, 1])
+    along = np.where(passes % 2, -along, along) #alternate passes run backwards
+    order = np.lexsort((along, passes))
+    return reorder_window(xy, order, required_gap)
+
+
+def reorder_window(xy, order, required_gap, window=REORDER_WINDOW):
+    """
+    Walks order, and wherever its next point is closer than required_gap to
+    one of the last DRYING_WINDOW points placed, brings forward the first of
+    the next window points that is not.
+    """
+    xy = xy.tolist()
+    pending = deque(int(i) for i in order)
+    recent = deque(maxlen=DRYING_WINDOW)
+    placed = []
+
+    def clear(i):
+        point = xy[i]
+        return all(round(math.dist(point, xy[j]), 5) >= required_gap for j in recent)
+
+    while pending:
+        chosen = 0
+        for k in range(min(window, len(pending))):
+            if clear(pending[k]):
+                chosen = k
+                break
+        i = pending[chosen]
+        del pending[chosen]
+        placed.append(i)
+        recent.append(i)
+    return np.array(placed, dtype=int)
@@ -0,0 +1,102 @@
+"""
+Drying time between neighbouring wells.
+
+A drop of culture smears into a neighbouring drop that is dispensed
+before it has soaked in. The greedy walk guards against this with a
+distance rule: no point within DRYING_GAP_MM of the last 10 points placed.
+That stands in for time, so it forces detours around points that dried
+long ago, and lets a fast pipette come back too soon.
+
+A DryingModel works in time instead. Each dispense is timed from the
+travel before it and the time spent at the well, as in RunTimeEstimator.
+A point may be dispensed within radius_mm of an earlier one only once
+drying_time_s has passed since that one. Trips to the palette and tip
+rack are left out, so the times are a lower bound, and a path that keeps
+the rule here keeps it on the robot too.
+"""
+import math
+from collections import deque
+import numpy as np
+from .spatial_index import SpatialGridIndex
+
+DRYING_TIME_S = 5.0 #about the 10 wells the distance rule waits for, at the default well time
+WELL_TIME_S = 0.5 #RunTimeEstimator's well_overhead_s. The dispense itself is left out
+
+
+class DryingModel:
+    def __init__(self, drying_time_s=DRYING_TIME_S, radius_mm=2, gantry_speed=400, well_time_s=WELL_TIME_S):
+        """
+        drying_time_s: least time between dispensing two wells within radius_mm of each other
+        gantry_speed: XY travel speed in mm/s
+        well_time_s: time spent at each well
+        """
+        self.drying_time_s = drying_time_s
+        self.radius_mm = radius_mm
+        self.gantry_speed = gantry_speed
+        self.well_time_s = well_time_s
+
+    def step_time(self, distance_mm):
+        return distance_mm / self.gantry_speed + self.well_time_s
+
+    def dispense_times(self, points, order, units_per_mm):
+        # Time of each dispense along order, from the first
+        path = np.asarray(points)[order, :2] / units_per_mm
+        steps = np.zeros(len(path))
+        if len(path) > 1:
+            steps[1:] = self.step_time(np.hypot(*(path[1:] - path[:-1]).T))
+        return np.cumsum(steps)
+
+    def early_revisits(self, points, order, units_per_mm):
+        """
+        Number of points along order dispensed within radius_mm of an earlier
+        point before drying_time_s has passed since it.
+        """
+        path = np.asarray(points)[order, :2] / units_per_mm
+        times = self.dispense_times(points, order, units_per_mm)
+        early = np.zeros(len(path), dtype=bool)
+        #every step takes at least well_time_s, so only this many earlier points can still be wet
+        lags = int(math.ceil(self.drying_time_s / self.well_time_s)) if self.well_time_s > 0 else len(path)
+        for lag in range(1, min(lags, len(path) - 1) + 1):
+            distances = np.hypot(*(path[lag:] - path[:-lag]).T)
+            early[lag:] |= (times[lag:] - times[:-lag] < self.drying_time_s) & (np.round(distances, 5) < self.radius_mm)
+        return int(early.sum())
+
+    def walk(self, segment, units_per_mm):
+        """
+        Greedy walk over a list of points, like greedy_path_indexed, in which
+        each step goes to the closest point that is not still wet around.
+        Returns the positions of the points in the order they are visited.
+        """
+        if not segment:
+            return []
+        radius = self.radius_mm * units_per_mm
+        index = SpatialGridIndex(segment)
+        wet = deque() #(time, point) of the dispenses that may not have dried yet
+        now = 0.0
+
+        def dried_around(i):
+            point = segment[i]
+            ready = now + self.step_time(math.dist(segment[current], point) / units_per_mm)
+            return all(ready - dispensed >= self.drying_time_s
+                       or round(math.dist(point, wet_point), 5) >= radius
+                       for dispensed, wet_point in wet)
+
+        current = 0
+        index.remove(current)
+        wet.append((now, segment[current]))
+        ordered_list = [current]
+
+        #the last point is always within radius of itself, so nothing closer can be next
+        min_distance = radius if self.drying_time_s > self.well_time_s else 0
+        while len(index):
+            while wet and now - wet[0][0] >= self.drying_time_s:
+                wet.popleft()
+            #If no point has dried around, just use the closest point
+            closest = index.nearest(segment[current], min_distance, dried_around, fallback=True)
+            now += self.step_time(math.dist(segment[current], segment[closest]) / units_per_mm)
+            index.remove(closest)
+            wet.append((now, segment[closest]))
+            ordered_list.append(closest)
+            current = closest
+
+        return ordered_list
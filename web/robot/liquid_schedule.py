@@ -0,0 +1,142 @@
+"""
+Liquid-handling schedules for the procedure templates.
+
+distribute_to_agar in the templates works out every aspiration on the
+robot: it tops the tip up whenever it runs low and changes tips every 150
+wells, wherever the pipette happens to be. A schedule is planned here
+instead and replayed by replay_schedule in the templates.
+
+A schedule is a list of (wells, aspirate volume, new tip) for each
+aspiration of one color. Each aspiration covers the next run of wells on
+the print path. Runs are split where the trip back to the palette is
+shortest, so that each aspiration covers a spatially tight run of wells,
+and tips are only changed between aspirations.
+"""
+import math
+from collections import deque
+
+TIP_CHANGE_INTERVAL = 150 #distribute_to_agar asks for a new tip every 150 wells
+VOLUME_DECIMALS = 4 #aspirate volumes are rounded to 1/10000th of a uL
+
+
+def aspiration_capacity(max_volume, vol, disposal_vol):
+    # Most wells one aspiration can cover. The 1e-9 keeps float error from losing a well
+    return max(1, math.floor((max_volume - disposal_vol) / vol + 1e-9))
+
+
+def fixed_schedule(n_wells, max_volume, vol, disposal_vol):
+    """
+    The schedule distribute_to_agar follows for n_wells wells, aspiration for
+    aspiration, for estimating procedures that are not given a schedule.
+    """
+    aspirations = []
+    current_volume = 0
+    needs_new_tip = True
+    for cnt in range(n_wells):
+        if (cnt + 1) % TIP_CHANGE_INTERVAL == 0:
+            needs_new_tip = True
+
+        if current_volume < (vol + disposal_vol):
+            new_tip = needs_new_tip
+            if new_tip:
+                current_volume = 0 #the old tip is dropped with whatever it holds
+                needs_new_tip = False
+            remaining_vol = (n_wells - cnt) * vol
+            if remaining_vol + disposal_vol > max_volume:
+                asp_vol = math.floor((max_volume - disposal_vol) / vol) * vol + disposal_vol - current_volume
+            else:
+                asp_vol = remaining_vol + disposal_vol - current_volume
+            aspirations.append([0, round(asp_vol, VOLUME_DECIMALS), new_tip])
+            current_volume += asp_vol
+
+        aspirations[-1][0] += 1
+        current_volume -= vol
+
+    return [tuple(aspiration) for aspiration in aspirations]
+
+
+class LiquidScheduler:
+    def __init__(self, max_volume, vol, disposal_vol, tip_wells=TIP_CHANGE_INTERVAL,
+                 gantry_speed=400, aspiration_overhead_s=2.5):
+        """
+        max_volume: pipette capacity in uL
+        vol, disposal_vol: volume dispensed into each well, and kept in the tip as a disposal volume, in uL
+        tip_wells: wells a tip dispenses into before it is changed at its next aspiration
+        gantry_speed, aspiration_overhead_s: weigh the trip to the palette against the
+            time each aspiration takes, so that runs are not split more often than needed
+        """
+        self.max_volume = max_volume
+        self.vol = vol
+        self.disposal_vol = disposal_vol
+        self.tip_wells = tip_wells
+        self.gantry_speed = gantry_speed
+        self.aspiration_overhead_s = aspiration_overhead_s
+
+    def runs(self, path, palette):
+        """
+        Splits a print path into runs of wells, one per aspiration.
+        path: (N,2) deck positions in mm of the wells in print order
+        palette: deck position in mm of the color's palette well
+
+        Returns the number of wells in each run. Each run fits in the tip, and
+        the runs are chosen to make the trips to the palette between them as
+        short as possible. The trips are found by dynamic programming over the
+        split points, with a sliding window minimum over the last capacity wells.
+        """
+        n = len(path)
+        if not n:
+            return []
+        capacity = aspiration_capacity(self.max_volume, self.vol, self.disposal_vol)
+        path = [tuple(well) for well in path]
+        palette = tuple(palette)
+        overhead_mm = self.aspiration_overhead_s * self.gantry_speed
+
+        def split_cost(i):
+            #extra travel for going to the palette between wells i - 1 and i instead of straight on
+            if i == 0:
+                return 0.0
+            return (math.dist(path[i - 1], palette) + math.dist(palette, path[i])
+                    - math.dist(path[i - 1], path[i]) + overhead_mm)
+
+        #cost[j] is the cheapest way to cover the first j wells with runs ending at well j - 1
+        cost = [0.0] * (n + 1)
+        run_start = [0] * (n + 1)
+        window = deque() #split points i, with cost[i] + split_cost(i) increasing
+        candidate = [0.0] * (n + 1)
+        for j in range(1, n + 1):
+            i = j - 1
+            candidate[i] = cost[i] + split_cost(i)
+            while window and candidate[window[-1]] >= candidate[i]:
+                window.pop()
+            window.append(i)
+            while window[0] < j - capacity:
+                window.popleft()
+            run_start[j] = window[0]
+            cost[j] = candidate[window[0]]
+
+        runs = []
+        j = n
+        while j:
+            runs.append(j - run_start[j])
+            j = run_start[j]
+        return runs[::-1]
+
+    def schedule(self, path, palette):
+        """
+        Aspirations for a print path, as a list of (wells, aspirate volume, new tip).
+        A tip is changed at the first aspiration after it has dispensed into
+        tip_wells wells. What is left in a tip is dropped with it, so the
+        first aspiration of each tip also takes up the disposal volume.
+        """
+        aspirations = []
+        tip_wells = None
+        for wells in self.runs(path, palette):
+            new_tip = tip_wells is None or tip_wells >= self.tip_wells
+            if new_tip:
+                tip_wells = 0
+                asp_vol = wells * self.vol + self.disposal_vol
+            else:
+                asp_vol = wells * self.vol #the disposal volume is still in the tip
+            aspirations.append((wells, round(asp_vol, VOLUME_DECIMALS), new_tip))
+            tip_wells += wells
+        return aspirations
@@ -0,0 +1,54 @@
+"""
+Database cache of optimized print orders.
+
+Path optimization is the slow part of making a procedure, and its result
+only depends on the color block's coordinates, the canvas, the artpiece's
+grid size and the optimizer settings. Reprints and regenerated jobs look
+their orders up here instead of optimizing again.
+"""
+import hashlib
+import json
+from datetime import datetime
+import numpy as np
+from sqlalchemy.exc import IntegrityError
+from web.database.models import PrintPathCacheModel
+
+# Bump this whenever a change to the optimizer changes the paths it returns,
+# so that orders cached by the old version are no longer used
+OPTIMIZER_VERSION = 3
+
+
+def path_cache_key(coordinates, canvas, grid_size, optimizer_settings):
+    canvas_properties = {name: prop.value for name, prop in canvas.properties.items()}
+    #hash the pixels as an array, so that large blocks are not turned into lists to key them
+    pixels = np.ascontiguousarray(np.asarray(coordinates, dtype='<i8').reshape(-1, 2))
+    pixels_digest = hashlib.sha256(pixels.tobytes()).hexdigest()
+    key_source = json.dumps([OPTIMIZER_VERSION, pixels_digest, canvas.name, canvas_properties,
+                             grid_size, optimizer_settings], sort_keys=True)
+    return hashlib.sha256(key_source.encode()).hexdigest()
+
+
+class PathCache:
+    def __init__(self, session):
+        self.session = session
+
+    def get(self, keys):
+        # Returns {key: (order, travel_before_mm, travel_after_mm)} for the keys that are cached
+        if not keys:
+            return dict()
+        entries = (self.session.query(PrintPathCacheModel)
+                   .filter(PrintPathCacheModel.cache_key.in_(set(keys)))
+                   .all())
+        return {entry.cache_key: (np.array(entry.order, dtype=int), entry.travel_before_mm, entry.travel_after_mm)
+                for entry in entries}
+
+    def put(self, key, artpiece_id, order, travel_before_mm, travel_after_mm):
+        entry = PrintPathCacheModel(cache_key=key, artpiece_id=artpiece_id, order=np.asarray(order).tolist(),
+                                    travel_before_mm=travel_before_mm, travel_after_mm=travel_after_mm,
+                                    created_at=datetime.now())
+        try:
+            #another request may have cached the same block since get() was called
+            with self.session.begin_nested():
+                self.session.add(entry)
+        except IntegrityError:
+            pass
@@ -0,0 +1,226 @@
+"""
+Local-search refinement of pipette paths.
+
+The greedy walk in ProcedureLineInjector leaves long jumps behind, mostly
+where it runs out of points in one segment and starts on the next. The
+2-opt and Or-opt moves here shorten the path after the fact. Each move is
+checked against the same drying rule as the greedy walk. A point should not
+be placed within required_gap of any of the 10 points placed before it. A
+move is only kept if it creates no more of these close pairs than it
+removes.
+
+Refinement is bounded by the number of moves it evaluates rather than by
+time, so that it gives the same path on any machine. A full sweep tries
+about 160 moves per point, so the cap stops well short of that on large
+color blocks.
+"""
+import math
+import numpy as np
+from .spatial_index import SpatialGridIndex
+
+DRYING_WINDOW = 10 #number of previously placed points a new point is checked against
+NEIGHBOURS = 8 #candidate neighbours considered for each point
+MAX_CHAIN = 3 #longest run of points moved by Or-opt
+MOVES_PER_POINT = 16 #moves evaluated per point of a color block
+MAX_MOVES = 2000 #most moves evaluated for any one color block, well under a second
+
+
+def path_length(points, order=None):
+    points = np.asarray(points)
+    if order is not None:
+        points = points[order]
+    if len(points) < 2:
+        return 0.0
+    return float(np.sqrt(((points[1:, :2] - points[:-1, :2])**2).sum(axis=1)).sum())
+
+
+class _Path:
+    # A print order that is edited in place, with each point's position kept in sync
+
+    def __init__(self, points, order, required_gap):
+        self.xy = np.asarray(points)[:, :2].tolist()
+        self.order = np.array(order, dtype=int)
+        self.pos = np.empty(len(self.order), dtype=int)
+        self.pos[self.order] = np.arange(len(self.order))
+        self.required_gap = required_gap
+        self._index = SpatialGridIndex(self.xy)
+        self._neighbours = dict()
+
+    def __len__(self):
+        return len(self.order)
+
+    def dist(self, a, b):
+        return math.dist(self.xy[a], self.xy[b])
+
+    def neighbours(self, a):
+        #nearest points to a, computed on first use so points the move budget never reaches cost nothing
+        if a not in self._neighbours:
+            self._neighbours[a] = [i for i in self._index.k_nearest(self.xy[a], NEIGHBOURS + 1) if i != a]
+        return self._neighbours[a]
+
+    def _near_pairs(self, at, cuts):
+        #Pairs of points placed within DRYING_WINDOW of each other across each cut
+        pairs = set()
+        for cut in cuts:
+            left = [at(p) for p in range(max(cut - DRYING_WINDOW + 1, 0), cut + 1)]
+            right = [at(p) for p in range(cut + 1, min(cut + DRYING_WINDOW + 1, len(self.order)))]
+            for l, a in enumerate(left):
+                for r, b in enumerate(right):
+                    if (len(left) - l) + r <= DRYING_WINDOW:
+                        pairs.add((min(a, b), max(a, b)))
+        return pairs
+
+    def _too_close(self, pairs):
+        return sum(1 for a, b in pairs if round(self.dist(a, b), 5) < self.required_gap)
+
+    def keeps_drying_gap(self, new_at, old_cuts, new_cuts):
+        old_pairs = self._near_pairs(lambda p: self.order[p], old_cuts)
+        new_pairs = self._near_pairs(new_at, new_cuts)
+        return self._too_close(new_pairs - old_pairs) <= self._too_close(old_pairs - new_pairs)
+
+    def try_two_opt(self, i, j):
+        #Reverse order[i+1..j] if that shortens the path and keeps the drying gap
+        order = self.order
+        n = len(order)
+        a, b, c = order[i], order[i + 1], order[j]
+        gain = self.dist(a, b) - self.dist(a, c)
+        if j + 1 < n:
+            d = order[j + 1]
+            gain += self.dist(c, d) - self.dist(b, d)
+        if gain <= 1e-12:
+            return False
+
+        def new_at(p):
+            return order[i + 1 + j - p] if i < p <= j else order[p]
+        cuts = [i, j] if j + 1 < n else [i]
+        if not self.keeps_drying_gap(new_at, cuts, cuts):
+            return False
+
+        order[i + 1:j + 1] = order[i + 1:j + 1][::-1].copy()
+        self.pos[order[i + 1:j + 1]] = np.arange(i + 1, j + 1)
+        return True
+
+    def try_or_opt(self, s, length, t, reverse):
+        """
+        Move the chain order[s..s+length-1] so that it follows order[t]
+        (or goes to the front if t is -1), if that shortens the path and
+        keeps the drying gap.
+        """
+        order = self.order
+        n = len(order)
+        e = s + length - 1
+        if s <= t <= e or t == s - 1:
+            return False
+        first, last = order[s], order[e]
+        if reverse:
+            first, last = last, first
+
+        gain = 0.0
+        if s > 0:
+            gain += self.dist(order[s - 1], order[s])
+        if e + 1 < n:
+            gain += self.dist(order[e], order[e + 1])
+        if s > 0 and e + 1 < n:
+            gain -= self.dist(order[s - 1], order[e + 1])
+        after = t + 1 if t + 1 != s else e + 1
+        if t >= 0:
+            gain -= self.dist(order[t], first)
+        if after < n:
+            gain -= self.dist(last, order[after])
+        if t >= 0 and after < n:
+            gain += self.dist(order[t], order[after])
+        if gain <= 1e-12:
+            return False
+
+        chain = order[s:e + 1][::-1] if reverse else order[s:e + 1]
+        if t < s:
+            new_order = np.concatenate((order[:t + 1], chain, order[t + 1:s], order[e + 1:]))
+            old_cuts, new_cuts = [t, s - 1, e], [t, t + length, e]
+            changed = slice(t + 1, e + 1)
+        else:
+            new_order = np.concatenate((order[:s], order[e + 1:t + 1], chain, order[t + 1:]))
+            old_cuts, new_cuts = [s - 1, e, t], [s - 1, t - length, t]
+            changed = slice(s, t + 1)
+        old_cuts = [cut for cut in old_cuts if 0 <= cut < n - 1]
+        new_cuts = [cut for cut in new_cuts if 0 <= cut < n - 1]
+        if not self.keeps_drying_gap(lambda p: new_order[p], old_cuts, new_cuts):
+            return False
+
+        self.order = new_order
+        self.pos[new_order[changed]] = np.arange(n)[changed]
+        return True
+
+
+def move_budget(n):
+    # The most moves evaluated while refining a block of n points
+    return min(MOVES_PER_POINT * n, MAX_MOVES)
+
+
+def refine_print_order(points, order, required_gap, passes, max_moves=None):
+    """
+    Shortens a print order with 2-opt and Or-opt moves until no move helps,
+    it has made passes sweeps over the path, or it has evaluated max_moves
+    moves, move_budget of the path's length by default. The result only
+    depends on its input, not on how long the moves take.
+
+    Returns the new order, and the travel distance before and after.
+    """
+    before = path_length(points, order)
+    path = _Path(points, order, required_gap)
+    n = len(path)
+    moves_left = move_budget(n) if max_moves is None else max_moves
+
+    def try_move(move, *args):
+        nonlocal moves_left
+        if moves_left <= 0:
+            return False
+        moves_left -= 1
+        return move(*args)
+
+    improved = n > 3
+    for _ in range(passes):
+        if not improved or moves_left <= 0:
+            break
+        improved = False
+
+        #2-opt: replace edge a-b with a-c, where c is one of a's neighbours
+        for i in range(n - 1):
+            if moves_left <= 0:
+                break
+            a = path.order[i]
+            ab = path.dist(a, path.order[i + 1])
+            for c in path.neighbours(a):
+                if path.dist(a, c) >= ab:
+                    break
+                j = path.pos[c]
+                if j > i + 1 and try_move(path.try_two_opt, i, j):
+                    improved = True
+                    break
+                if j < i and try_move(path.try_two_opt, j, i):
+                    improved = True
+                    break
+
+        #Or-opt: move short chains next to a neighbour of either end
+        for s in range(n):
+            if moves_left <= 0:
+                break
+            for length in range(1, MAX_CHAIN + 1):
+                if s + length > n:
+                    break
+                moved = False
+                for end in (path.order[s], path.order[s + length - 1]):
+                    for u in path.neighbours(end):
+                        t = path.pos[u]
+                        for target, reverse in ((t, False), (t, True), (t - 1, False), (t - 1, True)):
+                            if try_move(path.try_or_opt, s, length, target, reverse):
+                                moved = True
+                                break
+                        if moved:
+                            break
+                    if moved:
+                        break
+                if moved:
+                    improved = True
+                    break
+
+    return path.order, before, path_length(points, path.order)
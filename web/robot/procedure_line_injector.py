@@ -1,14 +1,181 @@
 import sys
 import math
+import base64
+import zlib
+import time
+import multiprocessing
+from threading import Lock
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .spatial_index import SpatialGridIndex
+from .path_refinement import path_length, refine_print_order
+from .curve_ordering import curve_order
+from .drying import DryingModel, DRYING_TIME_S
+from .path_cache import path_cache_key
+from .procedure_template import ProcedureTemplate
+
+#Process pools shared by every injector, one for each worker count. Their workers
+#are started from a fresh interpreter rather than forked, since forking copies
+#the locks held by the web process's background threads
+_pools = dict()
+_pool_lock = Lock()
+
+
+def _get_pool(max_workers):
+    with _pool_lock:
+        if max_workers not in _pools:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pools[max_workers] = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(method))
+        return _pools[max_workers]
 
 class ProcedureLineInjector:
 
+    # Nearest-neighbour engines available to optimize_print_order.
+    # 'linear' scans every remaining point on each step and is kept as a reference.
+    NN_ENGINES = ('grid', 'linear')
+
+    # Print order strategies, by the name used in option_args, and the method that finds the order.
+    # 'greedy' walks to the nearest point far enough away. 'hilbert' and 'serpentine' follow a
+    # fixed curve over the plate, which is much quicker on very large canvases but travels further.
+    # 'timed' walks like 'greedy', but keeps neighbours apart in time instead of by the distance rule
+    ORDERING_STRATEGIES = {'greedy': 'greedy_print_order',
+                           'hilbert': 'hilbert_print_order',
+                           'serpentine': 'serpentine_print_order',
+                           'timed': 'timed_print_order'}
+
+    # Assume 2mm required between subsequent points to give time to dry
+    DRYING_GAP_MM = 2
+
+    # OT-2 deck geometry in mm, measured from the front left corner of slot 1
+    SLOT_PITCH_MM = (132.5, 90.5)
+    SLOT_CENTER_MM = (63.88, 42.74)
+    # 'packed' writes pixels compactly for decode_pixels in the templates. 'literal' is easier to read when debugging
+    PIXEL_ENCODINGS = ('packed', 'literal')
+    PIXEL_SCALE = 8000 #packed x and y are rounded to 1/8000th of the canvas radius
+
+    TIPRACK_SLOT = '10'
+    PALETTE_SLOT = '11'
+    TRASH_SLOT = '12'
+
+    def __init__(self, nn_engine='grid', refine_passes=0, workers=0, path_cache=None, pixel_encoding='packed', progress=None,
+                 ordering='greedy', drying_time_s=DRYING_TIME_S, gantry_speed=400):
+        """
+        nn_engine: nearest-neighbour engine used by the greedy walk
+        refine_passes: most sweeps of 2-opt/Or-opt refinement per color block. 0 disables it
+        workers: size of the process pool that color blocks are optimized in. 0 or 1 runs them in this process
+        path_cache: optional PathCache that optimized print orders are looked up in and saved to
+        pixel_encoding: how pixels are written into the procedure, one of PIXEL_ENCODINGS
+        progress: optional callable, called with (artpiece, color) as each color block's print order is found
+        ordering: how print orders are found, one of ORDERING_STRATEGIES
+        drying_time_s, gantry_speed: the DryingModel that 'timed' orders keep to,
+            and that every order's early revisits are counted against
+        """
+        if nn_engine not in self.NN_ENGINES:
+            raise ValueError(f'Unknown nearest-neighbour engine: {nn_engine}')
+        if ordering not in self.ORDERING_STRATEGIES:
+            raise ValueError(f'Unknown ordering strategy: {ordering}')
+        if pixel_encoding not in self.PIXEL_ENCODINGS:
+            raise ValueError(f'Unknown pixel encoding: {pixel_encoding}')
+        self.pixel_encoding = pixel_encoding
+        self.nn_engine = nn_engine
+        self.ordering = ordering
+        self.drying_time_s = drying_time_s
+        self.gantry_speed = gantry_speed
+        self.drying_model = DryingModel(drying_time_s, self.DRYING_GAP_MM, gantry_speed)
+        self.refine_passes = refine_passes
+        self.workers = workers
+        self.path_cache = path_cache
+        self.progress = progress
+        self.travel_report = []
+        self.ordering_report = {'ordering': ordering, 'blocks': 0, 'cached': 0, 'seconds': 0.0, 'early_revisits': 0}
+        self.pixels_by_color = dict() #the pixels written by pixel_lines, in drawing order
+        self.canvas_locations = dict()
+        self.well_radius_by_artpiece = dict()
+
     # Lists slots that should typically be available
     def canvas_slot_generator(self):
         for slot in [1, 2, 3, 4, 5, 6, 7, 8, 9]:
             yield str(slot)
 
 
+    def slot_center(self, slot):
+        # Deck position of the centre of a slot. Slots are numbered left to right, front to back
+        column, row = (int(slot) - 1) % 3, (int(slot) - 1) // 3
+        return np.array([column * self.SLOT_PITCH_MM[0] + self.SLOT_CENTER_MM[0],
+                         row * self.SLOT_PITCH_MM[1] + self.SLOT_CENTER_MM[1]])
+
+    def deck_positions(self, pixel_array, slot, well_radius):
+        # Deck positions in mm of plate-relative pixels on the canvas in a slot
+        return pixel_array[:, :2] * well_radius + self.slot_center(slot)
+
+    def deck_paths(self):
+        """
+        The paths written by pixel_lines as deck positions in mm:
+        {color: [(slug, (N,2) array), ...]} in the order they are drawn
+        """
+        return {color: [(slug, self.deck_positions(pixel_array, self.canvas_locations[slug], self.well_radius_by_artpiece[slug]))
+                         for slug, pixel_array in pixels_by_artpiece.items()]
+                for color, pixels_by_artpiece in self.pixels_by_color.items()}
+
+    def plan_deck_order(self, paths, start):
+        """
+        Chooses the order in which to visit the plates for one color, and
+        whether to draw each plate's path forwards or backwards, so that the
+        total travel across the deck is as short as possible.
+
+        paths: {slug: (first, last)} deck positions in mm of each path's ends
+        start: deck position the pipette starts from
+
+        Returns a list of (slug, reverse) in visiting order, the travel
+        between plates for that plan, and the travel for the unplanned order
+        """
+        slugs = list(paths)
+        ends = [(np.asarray(paths[slug][0]), np.asarray(paths[slug][1])) for slug in slugs]
+        n = len(slugs)
+
+        def entry(i, reverse):
+            return ends[i][1] if reverse else ends[i][0]
+
+        def leave(i, reverse):
+            return ends[i][0] if reverse else ends[i][1]
+
+        def dist(a, b):
+            return float(np.hypot(*(a - b)))
+
+        if not n:
+            return [], 0.0, 0.0
+        unplanned = dist(start, entry(0, False))
+        unplanned += sum(dist(leave(i, False), entry(i + 1, False)) for i in range(n - 1))
+
+        #Held-Karp over (plates visited, last plate, last direction). There are at most 9 plates
+        best = {(1 << i, i, reverse): (dist(start, entry(i, reverse)), None)
+                for i in range(n) for reverse in (False, True)}
+        for visited in range(1, 1 << n):
+            for i in range(n):
+                for reverse in (False, True):
+                    if (visited, i, reverse) not in best:
+                        continue
+                    cost = best[(visited, i, reverse)][0]
+                    exit_point = leave(i, reverse)
+                    for j in range(n):
+                        if visited & (1 << j):
+                            continue
+                        for next_reverse in (False, True):
+                            key = (visited | (1 << j), j, next_reverse)
+                            new_cost = cost + dist(exit_point, entry(j, next_reverse))
+                            if key not in best or new_cost < best[key][0]:
+                                best[key] = (new_cost, (visited, i, reverse))
+
+        full = (1 << n) - 1
+        key = min(((full, i, reverse) for i in range(n) for reverse in (False, True)),
+                  key=lambda key: best[key][0])
+        planned = best[key][0]
+        plan = []
+        while key is not None:
+            plan.append((slugs[key[1]], key[2]))
+            key = best[key][1]
+        return plan[::-1], planned, unplanned
+
     def get_spacing(self, plate, grid_size):
         max_grid_postion = {'x':grid_size['x']-1, 'y':grid_size['y']-1}
         if plate.shape == 'round': #inscribe in circle
@@ -40,6 +207,18 @@ class ProcedureLineInjector:
 
         return x, y, z
 
+    def plate_location_map_batch(self, coordinates, plate, well_radius, wellspacing, x_max_mm, y_max_mm):
+        """
+        Vectorized plate_location_map. Takes a whole list of [y,x] grid
+        coordinates and returns an (N,3) array of plate-relative x, y, z
+        """
+        coordinates = np.asarray(coordinates).reshape(-1, 2)
+        locations = np.empty((len(coordinates), 3))
+        locations[:, 0] = (wellspacing * coordinates[:, 1] - x_max_mm) / well_radius
+        locations[:, 1] = (wellspacing * -coordinates[:, 0] + y_max_mm) / well_radius
+        locations[:, 2] = plate.z_touch_position_frac
+        return locations
+
     #Finds the closest point from the given point
     def min_dist_point(self, start, remaininglist, cache = None, required_gap = 0):
 
@@ -73,24 +252,24 @@ class ProcedureLineInjector:
     def euclidean_distance(self, start, end):
         return math.sqrt((start[0] - end[0])**2 +(start[1] - end[1])**2)
 
-    def create_segments(self, full_list):
-        #create a grid from a list of tuples and return a list of lists
+    def create_segments(self, points):
+        #create a grid from an array of points and return a list of index arrays, one per segment
 
         #There is no reason to make segments of very small lists
-        if len(full_list) < 60:
-            return [full_list]
+        if len(points) < 60:
+            return [np.arange(len(points))]
 
         segments = []
         num_segments = 20
 
         x_num_segments = int(math.sqrt(num_segments))
-        x_segment_length = int(len(full_list) / x_num_segments)
-        full_list.sort(key=lambda x: x[0])
-        x_segments = [full_list[i:i+x_segment_length] for i in range(0, len(full_list), x_segment_length)]
+        x_segment_length = int(len(points) / x_num_segments)
+        by_x = np.argsort(points[:, 0], kind='stable')
+        x_segments = [by_x[i:i+x_segment_length] for i in range(0, len(points), x_segment_length)]
 
         y_num_segments = int(math.ceil(num_segments / x_num_segments))
         for x_segment in x_segments:
-            x_segment.sort(key=lambda x: x[1])
+            x_segment = x_segment[np.argsort(points[x_segment, 1], kind='stable')]
             y_segment_length = int(math.ceil(len(x_segment) / y_num_segments))
             y_segments = [x_segment[i:i+y_segment_length] for i in range(0, len(x_segment), y_segment_length)]
             segments.extend(y_segments)
@@ -105,95 +284,373 @@ class ProcedureLineInjector:
         is optimized as much as possible, while not allowing points that are
         next to each other to be placed one after another. This is to ensure
         that the points have some time to dry.
+
+        The points may also be given as an (N,2) or (N,3) array, such as the
+        output of plate_location_map_batch, in which case an array is returned.
         """
+        if len(list) == 0:
+            return list
+        points = np.asarray(list, dtype=float).reshape(len(list), -1)
+        order = self.print_order(points, units_per_mm)
+        if isinstance(list, np.ndarray):
+            return list[order]
+        return [list[i] for i in order]
 
-        #Starts with first item in list.
-        
-        ordered_list = []
+    def print_order(self, points, units_per_mm):
+        #Returns the indices of an (N,2+) array of points in print order, found by the ordering strategy
+        return getattr(self, self.ORDERING_STRATEGIES[self.ordering])(points, units_per_mm)
 
-        segments = self.create_segments(list)
+    def greedy_print_order(self, points, units_per_mm):
+        #Greedy walk over each of the segments from create_segments in turn
+        ordered_indices = []
 
-        minimum_sequential_distance = 2 * units_per_mm #Assume 2mm required between subsequent points to give time to dry
+        segments = self.create_segments(points)
+
+        minimum_sequential_distance = self.DRYING_GAP_MM * units_per_mm
         
         for segment in segments:
-            current = segment[0]
-            ordered_list.append(current)
-            cache = []
-            segment.remove(current)
-
-            #Once added to the ordered list, it removes from previous list
-            while len(segment) != 0:
-                closest = self.min_dist_point(current, segment, cache, required_gap=minimum_sequential_distance)
-                cache.append(closest)
-                if len(cache) > 10:
-                    cache.pop(0)
-                segment.remove(closest)
-                ordered_list.append(closest)
-                current = closest
+            segment_points = points[segment, :2].tolist()
+            if self.nn_engine == 'grid':
+                segment_order = self.greedy_path_indexed(segment_points, minimum_sequential_distance)
+            else:
+                segment_order = self.greedy_path_linear(segment_points, minimum_sequential_distance)
+            ordered_indices.extend(segment[segment_order])
         
+        return np.array(ordered_indices, dtype=int)
+
+    def hilbert_print_order(self, points, units_per_mm):
+        return curve_order(points, self.DRYING_GAP_MM * units_per_mm, 'hilbert')
+
+    def serpentine_print_order(self, points, units_per_mm):
+        return curve_order(points, self.DRYING_GAP_MM * units_per_mm, 'serpentine')
+
+    def timed_print_order(self, points, units_per_mm):
+        #Drying-time walk over the whole block. Segments would forget which wells are still wet at each boundary
+        return np.array(self.drying_model.walk(points[:, :2].tolist(), units_per_mm), dtype=int)
+
+    def refine_print_order(self, points, order, units_per_mm):
+        """
+        Optional local-search pass over a greedy print order, limited to
+        refine_passes sweeps and the block's move budget. Returns the new order and the travel
+        distance in mm before and after refinement.
+        """
+        before = after = path_length(points, order)
+        if self.refine_passes:
+            order, before, after = refine_print_order(points, order,
+                                                      self.DRYING_GAP_MM * units_per_mm,
+                                                      self.refine_passes)
+        return order, before / units_per_mm, after / units_per_mm
+
+    def greedy_path_linear(self, segment, required_gap):
+        #Returns the positions of the segment points in the order they are visited.
+        #Points carry their position along, so that they can be told apart
+        segment = [(point[0], point[1], i) for i, point in enumerate(segment)]
+        if not segment:
+            return []
+        current = segment[0]
+        ordered_list = [current[2]]
+        cache = []
+        segment.remove(current)
+
+        #Once added to the ordered list, it removes from previous list
+        while len(segment) != 0:
+            closest = self.min_dist_point(current, segment, cache, required_gap=required_gap)
+            cache.append(closest)
+            if len(cache) > 10:
+                cache.pop(0)
+            segment.remove(closest)
+            ordered_list.append(closest[2])
+            current = closest
+
+        return ordered_list
+
+    def greedy_path_indexed(self, segment, required_gap):
+        """
+        Same walk as greedy_path_linear, but nearest points are looked up in a
+        spatial grid instead of scanning the whole segment, and visited points
+        are deleted from the grid instead of the list.
+        """
+        if not segment:
+            return []
+        index = SpatialGridIndex(segment)
+        cache = []
+        cache_box = None
+
+        def clear_of_cache(i):
+            point = segment[i]
+            #points well outside the box around the cache can't be too close to it
+            if (point[0] < cache_box[0] or point[0] > cache_box[1]
+                    or point[1] < cache_box[2] or point[1] > cache_box[3]):
+                return True
+            for cached_point in cache:
+                if round(self.euclidean_distance(cached_point, point),5) < required_gap:
+                    return False
+            return True
+
+        current = 0
+        index.remove(current)
+        ordered_list = [current]
+
+        while len(index):
+            if cache:
+                margin = required_gap + 1e-5
+                cache_box = (min(p[0] for p in cache) - margin, max(p[0] for p in cache) + margin,
+                             min(p[1] for p in cache) - margin, max(p[1] for p in cache) + margin)
+            #If no point that is far enough away is found, just use the closest point
+            closest = index.nearest(segment[current], required_gap,
+                                    clear_of_cache if cache else None, fallback=True)
+            cache.append(segment[closest])
+            if len(cache) > 10:
+                cache.pop(0)
+            index.remove(closest)
+            ordered_list.append(closest)
+            current = closest
+
         return ordered_list
 
-    def add_labware(self, template_string, labware):
-        # replace labware placeholders with the proper Opentrons labware name, as specified in the arguments
+    def labware_lines(self, labware):
+        # the proper Opentrons labware name for each labware placeholder, as specified in the arguments
         labware['tiprack'] = 'opentrons_96_tiprack_300ul' if 'p300' in labware['pipette'] else 'opentrons_96_tiprack_20ul'
         
-        procedure = template_string.replace('%%PALETTE GOES HERE%%', labware['palette'])
-        procedure = procedure.replace('%%CANVAS GOES HERE%%', labware['canvas'])
-        procedure = procedure.replace('%%PIPETTE GOES HERE%%', labware['pipette'])
-        procedure = procedure.replace('%%TIPRACK GOES HERE%%', labware['tiprack'])
-        return procedure
-
-    def add_canvas_locations(self, template_string, artpieces):
-        # write where canvas plates are to be placed into code
+        return {'%%PALETTE GOES HERE%%': labware['palette'],
+                '%%CANVAS GOES HERE%%': labware['canvas'],
+                '%%PIPETTE GOES HERE%%': labware['pipette'],
+                '%%TIPRACK GOES HERE%%': labware['tiprack']}
+
+    def canvas_location_lines(self, artpieces):
+        # where canvas plates are to be placed
         get_canvas_slot = self.canvas_slot_generator()
         canvas_locations = dict(zip([artpiece.slug for artpiece in artpieces], get_canvas_slot))
-        procedure = template_string.replace('%%CANVAS LOCATIONS GO HERE%%', str(canvas_locations))
-        return procedure, canvas_locations
+        return {'%%CANVAS LOCATIONS GO HERE%%': str(canvas_locations)}, canvas_locations
 
-    def add_pixel_locations(self, template_string, artpieces, canvas):
-        # write where to draw pixels on each plate into code. Listed by color to reduce contamination
-        pixels_by_color = dict()
+    def optimize_color_blocks(self, artpieces, canvas):
+        """
+        Maps every color block of the artpieces onto the canvas and finds its
+        print order, using the path cache when there is one. Returns a list of
+        (artpiece, color, plate_positions, well_radius, (order, travel_before, travel_after))
+        """
+        spacing_by_grid_size = dict() #artpieces usually share a canvas size
+        blocks = [] #(artpiece, color, plate_positions, well_radius, cache_key) for each color block
         for artpiece in artpieces:
             grid_size = artpiece.canvas_size
-            well_radius, wellspacing, x_max_mm, y_max_mm = self.get_spacing(canvas, grid_size)
+            grid_key = (grid_size['x'], grid_size['y'])
+            if grid_key not in spacing_by_grid_size:
+                spacing_by_grid_size[grid_key] = self.get_spacing(canvas, grid_size)
+            well_radius, wellspacing, x_max_mm, y_max_mm = spacing_by_grid_size[grid_key]
             for color_block in artpiece.color_blocks:
-                pixel_list = self.optimize_print_order(
-                    [self.plate_location_map(pixel, canvas, well_radius, wellspacing, x_max_mm, y_max_mm) for pixel in color_block.coordinates],
-                    units_per_mm = 1 / well_radius
-                )
-                if str(color_block.color_id) not in pixels_by_color.keys():
-                    pixels_by_color[str(color_block.color_id)] = dict()
-                pixels_by_color[str(color_block.color_id)][artpiece.slug] = pixel_list
-        procedure = template_string.replace('%%PIXELS GO HERE%%', str(pixels_by_color))
-        return procedure
-
-    def add_color_map(self, template_string, colors):
+                plate_positions = self.plate_location_map_batch(color_block.pixel_array, canvas, well_radius, wellspacing, x_max_mm, y_max_mm)
+                cache_key = self.block_cache_key(color_block.pixel_array, canvas, grid_size) if self.path_cache else None
+                blocks.append((artpiece, str(color_block.color_id), plate_positions, well_radius, cache_key))
+
+        results = [None] * len(blocks)
+        if self.path_cache:
+            cached = self.path_cache.get([cache_key for *_, cache_key in blocks])
+            results = [cached.get(cache_key) for *_, cache_key in blocks]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if self.progress:
+            for block, result in zip(blocks, results):
+                if result is not None:
+                    self.progress(block[0], block[1])
+
+        def block_done(number):
+            if self.progress:
+                self.progress(blocks[missing[number]][0], blocks[missing[number]][1])
+        start = time.perf_counter()
+        optimized = self.optimize_blocks([(blocks[i][2], 1 / blocks[i][3]) for i in missing], block_done)
+        self.ordering_report['seconds'] += time.perf_counter() - start
+        self.ordering_report['blocks'] += len(blocks)
+        self.ordering_report['cached'] += len(blocks) - len(missing)
+        for i, result in zip(missing, optimized):
+            results[i] = result
+            if self.path_cache:
+                self.path_cache.put(blocks[i][4], blocks[i][0].id, *result)
+        for block, (order, *_) in zip(blocks, results):
+            self.ordering_report['early_revisits'] += self.drying_model.early_revisits(block[2], order, 1 / block[3])
+
+        return [block[:4] + (result,) for block, result in zip(blocks, results)]
+
+    def pixel_lines(self, artpieces, canvas, canvas_locations=None):
+        """
+        Where to draw pixels on each plate. Listed by color to reduce contamination.
+        The paths are all optimized here, but their text is only made one
+        color block at a time as the procedure is written.
+        """
+        if canvas_locations is None:
+            canvas_locations = dict(zip([artpiece.slug for artpiece in artpieces], self.canvas_slot_generator()))
+        pixels_by_color = dict()
+        well_radius_by_artpiece = dict()
+        for artpiece, color, plate_positions, well_radius, (order, travel_before, travel_after) in self.optimize_color_blocks(artpieces, canvas):
+            well_radius_by_artpiece[artpiece.slug] = well_radius
+            self.travel_report.append({'artpiece': artpiece.slug, 'color': color,
+                                       'before_mm': travel_before, 'after_mm': travel_after})
+            if color not in pixels_by_color.keys():
+                pixels_by_color[color] = dict()
+            pixels_by_color[color][artpiece.slug] = plate_positions[order]
+
+        for color, pixels_by_artpiece in pixels_by_color.items():
+            pixels_by_color[color] = self.deck_ordered(color, pixels_by_artpiece, canvas_locations, well_radius_by_artpiece)
+        self.pixels_by_color = pixels_by_color
+        self.canvas_locations = canvas_locations
+        self.well_radius_by_artpiece = well_radius_by_artpiece
+        if self.pixel_encoding == 'packed':
+            pixels = self.pixels_packed_chunks(pixels_by_color)
+        else:
+            pixels = self.pixels_literal_chunks(pixels_by_color)
+        return {'%%PIXELS GO HERE%%': pixels}
+
+    def order_settings(self):
+        # The settings a print order depends on, as ProcedureLineInjector arguments
+        settings = {'nn_engine': self.nn_engine, 'refine_passes': self.refine_passes, 'ordering': self.ordering}
+        if self.ordering == 'timed':
+            settings.update(drying_time_s=self.drying_time_s, gantry_speed=self.gantry_speed)
+        return settings
+
+    def block_cache_key(self, coordinates, canvas, grid_size):
+        return path_cache_key(coordinates, canvas, grid_size, self.order_settings())
+
+    def optimize_blocks(self, blocks, block_done=None):
+        """
+        Finds the print order of each (plate_positions, units_per_mm) block.
+        The blocks are independent, so they are spread over a process pool
+        when workers is above 1. Results come back in the order of blocks
+        either way, and refinement is limited by sweeps rather than time, so
+        the procedure does not depend on the worker count or machine load.
+        block_done is called with the position of each block as its result comes back.
+        """
+        args = ([self.order_settings()] * len(blocks),
+                [plate_positions for plate_positions, _ in blocks], [units_per_mm for _, units_per_mm in blocks])
+        if self.workers > 1 and len(blocks) > 1:
+            return self.collect(_get_pool(self.workers).map(optimize_color_block, *args), block_done)
+        return self.collect(map(optimize_color_block, *args), block_done)
+
+    def collect(self, results, block_done):
+        collected = []
+        for number, result in enumerate(results):
+            collected.append(result)
+            if block_done:
+                block_done(number)
+        return collected
+
+    def deck_ordered(self, color, pixels_by_artpiece, canvas_locations, well_radius_by_artpiece):
+        """
+        Reorders one color's {slug: pixel_array} so that the template, which
+        draws the plates in dict order, follows the plan from plan_deck_order.
+        Paths drawn backwards are reversed here, which keeps the drying gap.
+        """
+        paths = dict()
+        for slug, pixel_array in pixels_by_artpiece.items():
+            if not len(pixel_array):
+                continue
+            ends = self.deck_positions(pixel_array[[0, -1]], canvas_locations[slug], well_radius_by_artpiece[slug])
+            paths[slug] = (ends[0], ends[1])
+
+        plan, planned, unplanned = self.plan_deck_order(paths, self.slot_center(self.PALETTE_SLOT))
+        self.travel_report.append({'artpiece': None, 'color': color,
+                                   'before_mm': unplanned, 'after_mm': planned})
+
+        ordered = dict()
+        for slug, reverse in plan:
+            ordered[slug] = pixels_by_artpiece[slug][::-1] if reverse else pixels_by_artpiece[slug]
+        for slug in pixels_by_artpiece: #empty paths have nothing to plan
+            if slug not in ordered:
+                ordered[slug] = pixels_by_artpiece[slug]
+        return ordered
+
+    def pixels_literal(self, pixels_by_color):
+        return ''.join(self.pixels_literal_chunks(pixels_by_color))
+
+    def pixels_literal_chunks(self, pixels_by_color):
+        # Python literal of {color: {slug: [(x, y, z), ...]}}, made from the pixel arrays one plate at a time
+        yield '{'
+        for color_number, (color, pixels_by_artpiece) in enumerate(pixels_by_color.items()):
+            yield f"{', ' if color_number else ''}{color!r}: {{"
+            for artpiece_number, (slug, pixel_array) in enumerate(pixels_by_artpiece.items()):
+                pixels = ', '.join(f'({x!r}, {y!r}, {z!r})' for x, y, z in pixel_array.tolist())
+                yield f"{', ' if artpiece_number else ''}{slug!r}: [{pixels}]"
+            yield '}'
+        yield '}'
+
+    def pixels_packed(self, pixels_by_color):
+        return ''.join(self.pixels_packed_chunks(pixels_by_color))
+
+    def pixels_packed_chunks(self, pixels_by_color):
+        """
+        Compact alternative to pixels_literal, read by decode_pixels in the templates.
+        x and y are rounded to 1/PIXEL_SCALE and stored as int16 steps from the
+        previous pixel, which zlib compresses well along a print path. z is the
+        same for every pixel on a plate, so it is written once per plate.
+        """
+        int16_max = np.iinfo(np.int16).max
+        yield f"{{'encoding': 'int16-steps-zlib-base64', 'scale': {self.PIXEL_SCALE!r}, 'pixels': {{"
+        for color_number, (color, pixels_by_artpiece) in enumerate(pixels_by_color.items()):
+            yield f"{', ' if color_number else ''}{color!r}: {{"
+            for artpiece_number, (slug, pixel_array) in enumerate(pixels_by_artpiece.items()):
+                xy = np.rint(pixel_array[:, :2] * self.PIXEL_SCALE).astype(np.int64)
+                steps = np.diff(xy, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+                if len(steps) and np.abs(steps).max() > int16_max:
+                    raise ValueError(f'Pixels of {slug} are too far apart to pack as int16')
+                packed = base64.b64encode(zlib.compress(steps.astype('<i2').tobytes(), 9)).decode('ascii')
+                z = float(pixel_array[0, 2]) if len(pixel_array) else 0.0
+                yield f"{', ' if artpiece_number else ''}{slug!r}: {(z, packed)!r}"
+            yield '}'
+        yield '}}'
+
+    def color_paths(self):
+        # The deck path of each color written by pixel_lines, across all its plates
+        return {color: np.concatenate([path for _, path in plate_paths]) if plate_paths else np.empty((0, 2))
+                for color, plate_paths in self.deck_paths().items()}
+
+    def schedule_lines(self, schedules, vol, disposal_vol):
+        """
+        The liquid-handling schedule replayed by replay_schedule in the templates:
+        {'vol', 'disposal_vol', 'aspirations': {color: [(wells, aspirate volume, new tip), ...]}}.
+        None makes the templates fall back to distribute_to_agar.
+        """
+        if schedules is None:
+            return {'%%SCHEDULE GOES HERE%%': 'None'}
+        schedule = {'vol': vol, 'disposal_vol': disposal_vol, 'aspirations': schedules}
+        return {'%%SCHEDULE GOES HERE%%': repr(schedule)}
+
+    def color_map_lines(self, colors):
         color_map = {str(color.id): color.name for color in colors}
-        procedure = template_string.replace('%%COLORS GO HERE%%', str(color_map))
-        return procedure
-    
-    def add_all_lines(self, template_string, LABWARE, artpieces, canvas, colors):
-        procedure = self.add_labware(template_string, LABWARE)
-        procedure, canvas_locations = self.add_canvas_locations(procedure, artpieces)
-        procedure = self.add_pixel_locations(procedure, artpieces, canvas)
-        procedure = self.add_color_map(procedure, colors)
+        return {'%%COLORS GO HERE%%': str(color_map)}
 
-        return procedure, canvas_locations
+    def all_lines(self, LABWARE, artpieces, canvas, colors):
+        """
+        Values for every placeholder in the templates, for ProcedureTemplate.
+        Returns the values and the slot each artpiece's canvas goes in.
+        """
+        lines = self.labware_lines(LABWARE)
+        canvas_location_lines, canvas_locations = self.canvas_location_lines(artpieces)
+        lines.update(canvas_location_lines)
+        lines.update(self.pixel_lines(artpieces, canvas, canvas_locations))
+        lines.update(self.color_map_lines(colors))
+
+        return lines, canvas_locations
+
+    def add_all_lines(self, template_string, LABWARE, artpieces, canvas, colors):
+        lines, canvas_locations = self.all_lines(LABWARE, artpieces, canvas, colors)
+        return ProcedureTemplate(template_string).fill(lines), canvas_locations
     
+def optimize_color_block(order_settings, plate_positions, units_per_mm):
+    # Print order of one color block, with travel before and after refinement.
+    # Kept at module level so that worker processes can import it
+    injector = ProcedureLineInjector(**order_settings)
+    order = injector.print_order(plate_positions, units_per_mm)
+    return injector.refine_print_order(plate_positions, order, units_per_mm)
+
 class ProcedureLineInjector8To1Pipette (ProcedureLineInjector):
     
     # 8 to 1 pipettes only support drawing on the 5th slot.
     def canvas_slot_generator(self):
         yield '5'
 
-    def add_all_lines(self, template_string, LABWARE, artpieces, canvas, colors):
-        procedure, canvas_locations = super().add_all_lines(template_string=template_string, LABWARE=LABWARE, artpieces=artpieces, canvas=canvas, colors=colors)
-        procedure = self.add_protocol_name(procedure, artpieces)
-        return procedure, canvas_locations
+    def all_lines(self, LABWARE, artpieces, canvas, colors):
+        lines, canvas_locations = super().all_lines(LABWARE=LABWARE, artpieces=artpieces, canvas=canvas, colors=colors)
+        lines.update(self.protocol_name_lines(artpieces))
+        return lines, canvas_locations
 
-    def add_protocol_name(self, template_string, artpieces):
+    def protocol_name_lines(self, artpieces):
         name = artpieces[0].slug
     
-        procedure = template_string.replace('%%PROTOCOL NAME GOES HERE %%', name)
-        return procedure
-    
+        return {'%%PROTOCOL NAME GOES HERE %%': name}
@@ -0,0 +1,57 @@
+"""
+Progress of a procedure while it is being generated.
+
+Print requests are worked on in the background, and the printer page polls
+the job for how far along it is. A ProcedureProgress is handed to
+make_procedure, which names the stage it is at, and to the
+ProcedureLineInjector, which calls it as the print order of each color
+block is found. Each change is passed to report as a plain dict that can
+be stored in JobModel.progress:
+
+    {'stage': 'optimizing', 'artpieces': {'12': {'1': 'done', '3': 'pending'}}}
+
+Color blocks are found quickly once their paths are cached, so reports are
+throttled to one every interval_s seconds, except when the stage changes.
+"""
+import time
+
+STAGES = ('queued', 'selecting', 'optimizing', 'writing', 'done')
+
+
+class ProcedureProgress:
+    def __init__(self, report=None, interval_s=1.0):
+        """
+        report: callable given the progress dict each time it changes
+        interval_s: least time between reports within a stage
+        """
+        self.report = report
+        self.interval_s = interval_s
+        self.stage = 'queued'
+        self.artpieces = dict() #{artpiece id: {color id: 'done' or 'pending'}}
+        self.last_report = None
+
+    def start(self, stage, artpieces=()):
+        # Moves on to stage. Every color block of artpieces is pending until it is optimized
+        if stage not in STAGES:
+            raise ValueError(f'Unknown stage: {stage}')
+        self.stage = stage
+        for artpiece in artpieces:
+            self.artpieces[str(artpiece.id)] = {str(color_block.color_id): 'pending' for color_block in artpiece.color_blocks}
+        self.flush()
+
+    def __call__(self, artpiece, color):
+        # The print order of artpiece's color block in color is found
+        self.artpieces.setdefault(str(artpiece.id), dict())[str(color)] = 'done'
+        self.flush(force=False)
+
+    def as_dict(self):
+        return {'stage': self.stage,
+                'artpieces': {artpiece_id: dict(colors) for artpiece_id, colors in self.artpieces.items()}}
+
+    def flush(self, force=True):
+        now = time.monotonic()
+        if not force and self.last_report is not None and now - self.last_report < self.interval_s:
+            return
+        self.last_report = now
+        if self.report:
+            self.report(self.as_dict())
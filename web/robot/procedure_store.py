@@ -0,0 +1,191 @@
+"""
+Content-addressed storage for generated procedures.
+
+Procedures are named after the SHA-256 of their text, so regenerating an
+identical procedure stores nothing new, and a name always stands for the
+same content. That makes the name usable as an ETag without reading the
+file. Where the files live is up to the backend: a local directory, or an
+S3 bucket through file_manager, which can point at a local stand-in such
+as localstack through AWS_SERVER.
+"""
+import os
+import io
+import re
+import hashlib
+import tempfile
+from datetime import datetime, timedelta, timezone
+from web.database.models import JobModel
+
+PROCEDURE_PREFIX = 'ARTISTIC_PROCEDURE_'
+HASH_LENGTH = 24 #hex digits of the SHA-256 kept in the name. file_name columns hold 50 characters
+CONTENT_ADDRESSED = re.compile(PROCEDURE_PREFIX + r'([0-9a-f]{%d})\.\w+$' % HASH_LENGTH)
+CHUNK_SIZE = 64 * 1024 #bytes read at a time when a procedure is served
+
+
+class LocalProcedureBackend:
+    def __init__(self, directory):
+        self.directory = directory
+        self.location = directory
+        self.staging_directory = directory #so that a staged procedure is moved into place, not copied
+
+    def path(self, name):
+        return os.path.join(self.directory, os.path.basename(name))
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def put(self, name, staged_path):
+        #the procedure was written to a temporary name, so a reader never sees half of one
+        os.replace(staged_path, self.path(name))
+
+    def get(self, name):
+        try:
+            with open(self.path(name), 'rb') as procedure_file:
+                return procedure_file.read()
+        except FileNotFoundError:
+            return None
+
+    def chunks(self, name, chunk_size=CHUNK_SIZE):
+        # The procedure as an iterator of bytes, or None if it is not stored
+        try:
+            procedure_file = open(self.path(name), 'rb')
+        except FileNotFoundError:
+            return None
+        def read():
+            with procedure_file:
+                yield from iter(lambda: procedure_file.read(chunk_size), b'')
+        return read()
+
+    def delete(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def modified(self):
+        # {name: last modified datetime in UTC} of every stored procedure
+        return {name: datetime.fromtimestamp(os.path.getmtime(self.path(name)), timezone.utc)
+                for name in os.listdir(self.directory) if name.startswith(PROCEDURE_PREFIX)}
+
+
+class S3ProcedureBackend:
+    def __init__(self, file_manager, prefix='procedures/'):
+        self.file_manager = file_manager
+        self.prefix = prefix
+        self.location = f's3://{file_manager.bucket}/{prefix}'.rstrip('/')
+        self.staging_directory = None #the system's temporary directory
+
+    def exists(self, name):
+        return self.file_manager.file_exists(self.prefix + name)
+
+    def put(self, name, staged_path):
+        with open(staged_path, 'rb') as procedure_file:
+            if not self.file_manager.store_file(procedure_file, self.prefix + name):
+                raise IOError(f'Could not store procedure {name}')
+
+    def get(self, name):
+        procedure_file = self.file_manager.get_file(io.BytesIO(), self.prefix + name)
+        return procedure_file.getvalue() if procedure_file else None
+
+    def chunks(self, name, chunk_size=CHUNK_SIZE):
+        return self.file_manager.stream_file(self.prefix + name, chunk_size)
+
+    def delete(self, name):
+        self.file_manager.del_file(self.prefix + name)
+
+    def modified(self):
+        return {key[len(self.prefix):]: last_modified
+                for key, last_modified in self.file_manager.list_files(self.prefix + PROCEDURE_PREFIX).items()}
+
+
+class ProcedureStore:
+    def __init__(self, backend):
+        self.backend = backend
+
+    @property
+    def location(self):
+        return self.backend.location
+
+    def save(self, pieces, file_extension):
+        """
+        Stores a procedure given as an iterable of strings, such as
+        ProcedureTemplate.stream, and returns its file name. A procedure that
+        is already stored is not written again. The pieces are hashed as they
+        are written to a temporary file, so the procedure is never held in memory.
+        """
+        digest = hashlib.sha256()
+        staged = tempfile.NamedTemporaryFile(prefix=f'.{PROCEDURE_PREFIX}', suffix='.tmp',
+                                             dir=self.backend.staging_directory, delete=False)
+        try:
+            with staged:
+                for piece in pieces:
+                    data = piece.encode('utf-8')
+                    digest.update(data)
+                    staged.write(data)
+            name = f'{PROCEDURE_PREFIX}{digest.hexdigest()[:HASH_LENGTH]}.{file_extension}'
+            if not self.backend.exists(name):
+                self.backend.put(name, staged.name)
+        finally:
+            if os.path.exists(staged.name): #put moves local procedures into place
+                os.remove(staged.name)
+        return name
+
+    def load(self, name):
+        # The procedure as bytes, or None if it is not stored
+        return self.backend.get(name)
+
+    def chunks(self, name):
+        # The procedure as an iterator of bytes, read as it is consumed, or None if it is not stored
+        return self.backend.chunks(name)
+
+    def etag(self, name, content=None):
+        """
+        Entity tag of a procedure. Content-addressed names carry their own.
+        Older, timestamped procedures are hashed from their content, given
+        as bytes or as an iterable of bytes.
+        """
+        match = CONTENT_ADDRESSED.match(os.path.basename(name))
+        if match:
+            return match.group(1)
+        if content is None:
+            return None
+        digest = hashlib.sha256()
+        for chunk in ([content] if isinstance(content, bytes) else content):
+            digest.update(chunk)
+        return digest.hexdigest()[:HASH_LENGTH]
+
+    def prune(self, keep, older_than):
+        """
+        Retention policy. Deletes every stored procedure last written before
+        older_than, a UTC datetime, whose name is not in keep. Newer files are
+        left alone, as their jobs may not be committed yet. Returns the names deleted.
+        """
+        keep = set(keep)
+        deleted = [name for name, modified in self.backend.modified().items()
+                   if modified < older_than and name not in keep]
+        for name in deleted:
+            self.backend.delete(name)
+        return deleted
+
+
+def prune_procedures(session, store, retention_days):
+    """
+    Deletes the procedures that no job from the last retention_days days
+    uses. Jobs are kept, so older print requests can still be looked up.
+    """
+    retention = timedelta(days=retention_days)
+    recent = session.query(JobModel.file_name).filter(JobModel.request_date >= datetime.now() - retention).all()
+    #request dates are local times, file times are UTC
+    return store.prune((file_name for file_name, in recent), datetime.now(timezone.utc) - retention)
+
+
+def procedure_store_from_config(config, APP_DIR=None):
+    """
+    The store named by PROCEDURE_STORE: 'local' keeps procedures in
+    web/robot/procedures, 's3' keeps them in PROCEDURE_BUCKET.
+    """
+    if config.get('PROCEDURE_STORE', 'local') == 's3':
+        from web.api.file_manager import file_manager
+        return ProcedureStore(S3ProcedureBackend(file_manager(bucket=config['PROCEDURE_BUCKET'])))
+    APP_DIR = APP_DIR or os.path.abspath(os.path.dirname(__file__))
+    return ProcedureStore(LocalProcedureBackend(os.path.join(APP_DIR, 'procedures')))
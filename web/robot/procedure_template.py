@@ -0,0 +1,62 @@
+"""
+Procedure templates, split once at their %%...%% placeholders.
+
+Filling a template used to take one str.replace per placeholder, and each
+replace copied the whole procedure, pixels included. A ProcedureTemplate
+writes the template text and the placeholder values straight to a file or
+a response in one pass. A value can be a string, or an iterable of strings
+that is consumed while writing, such as the pixels of one color block at a
+time.
+"""
+import os
+import re
+from threading import Lock
+
+PLACEHOLDER = re.compile(r'%%[^%\n]+%%')
+
+_cache = dict()
+_cache_lock = Lock()
+
+
+class ProcedureTemplate:
+    def __init__(self, text):
+        #alternating template text and placeholder names, starting and ending with text
+        self.parts = PLACEHOLDER.split(text)
+        self.placeholders = PLACEHOLDER.findall(text)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Parsed template for a file. Templates are only read again when the
+        file has changed since it was last parsed.
+        """
+        modified = os.stat(path).st_mtime_ns
+        with _cache_lock:
+            cached = _cache.get(path)
+            if cached is None or cached[0] != modified:
+                with open(path) as template_file:
+                    cached = (modified, cls(template_file.read()))
+                _cache[path] = cached
+        return cached[1]
+
+    def stream(self, values):
+        """
+        Yields the filled-in procedure in pieces. values maps placeholders to
+        strings or iterables of strings. Placeholders without a value are
+        left as they are.
+        """
+        for text, placeholder in zip(self.parts, self.placeholders):
+            yield text
+            value = values.get(placeholder, placeholder)
+            if isinstance(value, str):
+                yield value
+            else:
+                yield from value
+        yield self.parts[-1]
+
+    def render(self, output_file, values):
+        for piece in self.stream(values):
+            output_file.write(piece)
+
+    def fill(self, values):
+        return ''.join(self.stream(values))
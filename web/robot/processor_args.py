@@ -18,5 +18,40 @@ parser.add_argument('--canvas', '-c'
                     ,default='ccl_artbot_canvas'
                     ,help='Optional argument to specify the canvas type. Use Opentrons standard names, or the name you saved it with if using custom labware.'
                     )
+parser.add_argument('--refine-passes'
+                    ,type=int
+                    ,default=0
+                    ,help='Optional number of sweeps spent shortening the pipette path of each color after the greedy pass. 0 disables it.'
+                    )
+parser.add_argument('--ordering'
+                    ,choices=['greedy', 'timed', 'hilbert', 'serpentine']
+                    ,default='greedy'
+                    ,help='Optional print order strategy. timed keeps neighbouring wells apart by drying time instead of distance. hilbert and serpentine follow a fixed curve, which is much quicker for very large art but travels further.'
+                    )
+parser.add_argument('--drying-time-s'
+                    ,type=float
+                    ,default=5
+                    ,help='Optional least time in seconds between dispensing neighbouring wells, for --ordering timed.'
+                    )
+parser.add_argument('--gantry-speed'
+                    ,type=float
+                    ,default=400
+                    ,help='Optional XY gantry speed of the robot in mm/s, used to estimate the run time.'
+                    )
+parser.add_argument('--pixel-encoding'
+                    ,choices=['packed', 'literal']
+                    ,default='packed'
+                    ,help='Optional argument to write pixels as a readable Python literal instead of the compact packed form, for debugging.'
+                    )
+parser.add_argument('--batch'
+                    ,choices=['oldest', 'best']
+                    ,default='oldest'
+                    ,help='Optional argument to print the queued art that shares the most colors instead of the oldest art. Overdue art is always printed.'
+                    )
+parser.add_argument('--max-wait-days'
+                    ,type=float
+                    ,default=14
+                    ,help='Optional number of days after which queued art is always printed in --batch best mode.'
+                    )
 
 args = vars(parser.parse_args())
\ No newline at end of file
@@ -0,0 +1,119 @@
+"""
+Estimates how long the robot will take to run a generated procedure.
+
+The estimate replays the liquid-handling schedule of each color well by
+well, or the schedule distribute_to_agar in the templates follows when
+there is none. It counts aspirations with their touch_tip, dispenses, tip
+changes, and gantry travel between the palette, tip rack, trash and canvas
+wells. Timings are Opentrons defaults
+and rough measurements, so treat the result as a guide for operators.
+"""
+import math
+from .liquid_schedule import fixed_schedule
+
+# vol and disposal_vol passed to distribute_to_agar by each template
+TEMPLATE_VOLUMES = {'py': (0.4, 2), 'ipynb': (0.1, 4)}
+
+# max volume (uL) and default aspirate and dispense flow rates (uL/s) by pipette model
+PIPETTES = {
+    'p10': (10, 5, 10),
+    'p20': (20, 7.56, 7.56),
+    'p300': (300, 92.86, 92.86),
+    'p1000': (1000, 274.7, 274.7),
+}
+
+
+def pipette_model(pipette):
+    #'p300_single_gen2' -> 'p300'
+    return pipette.split('_')[0]
+
+
+def format_duration(seconds):
+    minutes = int(round(seconds / 60))
+    if minutes < 60:
+        return f'{minutes} min'
+    return f'{minutes // 60} h {minutes % 60:02d} min'
+
+
+class RunTimeEstimator:
+    def __init__(self, pipette, vol, disposal_vol, gantry_speed=400,
+                 well_overhead_s=0.5, touch_tip_s=2.5, pick_up_tip_s=4.0, drop_tip_s=3.0):
+        """
+        pipette: Opentrons pipette name, e.g. 'p300_single'
+        vol, disposal_vol: volumes given to distribute_to_agar, in uL
+        gantry_speed: XY travel speed in mm/s
+        well_overhead_s: time for the arc over and down to each well and the plunger to settle
+        """
+        if pipette_model(pipette) not in PIPETTES:
+            raise ValueError(f'No timing data for pipette: {pipette}')
+        self.max_volume, self.aspirate_rate, self.dispense_rate = PIPETTES[pipette_model(pipette)]
+        self.vol = vol
+        self.disposal_vol = disposal_vol
+        self.gantry_speed = gantry_speed
+        self.well_overhead_s = well_overhead_s
+        self.touch_tip_s = touch_tip_s
+        self.pick_up_tip_s = pick_up_tip_s
+        self.drop_tip_s = drop_tip_s
+
+    def travel(self, start, end):
+        if start is None: #first move starts from wherever the gantry is homed
+            return 0.0
+        return math.dist(start, end) / self.gantry_speed
+
+    def estimate(self, paths_by_color, palette, tiprack, trash, schedules=None):
+        """
+        paths_by_color: {color: [(plate, deck positions of its wells in mm), ...]}
+                        in the order the template draws them
+        palette, tiprack, trash: deck positions in mm
+        schedules: optional {color: [(wells, aspirate volume, new tip), ...]} from a LiquidScheduler
+
+        Returns {'total_s', 'by_color': {color: s}, 'by_plate': {plate: s}}.
+        Tip and palette trips are counted against the plate of the well that follows them.
+        """
+        vol, disposal_vol = self.vol, self.disposal_vol
+        by_color, by_plate = dict(), dict()
+        position = None
+        has_tip = False
+        for color, plate_paths in paths_by_color.items():
+            wells = [(plate, tuple(well)) for plate, path in plate_paths for well in path.tolist()]
+            by_color[color] = 0.0
+            if not wells:
+                continue
+
+            if schedules and color in schedules:
+                aspirations = schedules[color]
+            else:
+                aspirations = fixed_schedule(len(wells), self.max_volume, vol, disposal_vol)
+            aspiration_starts = dict()
+            first_well = 0
+            for wells_covered, asp_vol, new_tip in aspirations:
+                aspiration_starts[first_well] = (asp_vol, new_tip)
+                first_well += wells_covered
+
+            for cnt, (plate, well) in enumerate(wells):
+                seconds = 0.0
+                if cnt in aspiration_starts:
+                    asp_vol, new_tip = aspiration_starts[cnt]
+                    if new_tip:
+                        if has_tip:
+                            seconds += self.travel(position, trash) + self.drop_tip_s
+                            position = trash
+                        seconds += self.travel(position, tiprack) + self.pick_up_tip_s
+                        position = tiprack
+                        has_tip = True
+                    seconds += self.travel(position, palette) + asp_vol / self.aspirate_rate + self.touch_tip_s
+                    position = palette
+
+                seconds += self.travel(position, well) + self.well_overhead_s + vol / self.dispense_rate
+                position = well
+
+                by_color[color] += seconds
+                by_plate[plate] = by_plate.get(plate, 0.0) + seconds
+
+            seconds = self.travel(position, trash) + self.drop_tip_s
+            position = trash
+            has_tip = False
+            by_color[color] += seconds
+            by_plate[plate] += seconds
+
+        return {'total_s': sum(by_color.values()), 'by_color': by_color, 'by_plate': by_plate}
@@ -0,0 +1,206 @@
+import heapq
+import math
+from collections import defaultdict
+
+class SpatialGridIndex:
+    """
+    Uniform grid hash over a list of 2D points that supports nearest-neighbour
+    queries and deletion. Points are referred to by their position in the list
+    they were built from, so callers can keep track of the original objects.
+
+    The cell size is picked from the point density, so each occupied cell holds
+    roughly one point. When most points have been removed the grid is rebuilt,
+    so queries stay cheap until the very end of a path.
+    """
+
+    REBUILD_FRACTION = 4 #rebuild once only 1/4 of the indexed points remain
+    MIN_REBUILD_SIZE = 64
+
+    def __init__(self, points):
+        self.points = points
+        self._remaining = set(range(len(points)))
+        self._build(self._remaining)
+
+    def __len__(self):
+        return len(self._remaining)
+
+    def _build(self, indices):
+        self._built_size = len(indices)
+        self._offset_plans = dict()
+        self._cells = defaultdict(list)
+        if not indices:
+            return
+
+        xs = [self.points[i][0] for i in indices]
+        ys = [self.points[i][1] for i in indices]
+        self._x0, self._y0 = min(xs), min(ys)
+        width, height = max(xs) - self._x0, max(ys) - self._y0
+
+        area = width * height
+        if area > 0:
+            cell_size = math.sqrt(area / len(indices))
+        else: #all points on a line
+            cell_size = max(width, height) / len(indices)
+        self._cell_size = cell_size if cell_size > 0 else 1.0 #all points coincide
+
+        self._x_cells = int(width / self._cell_size) + 1
+        self._y_cells = int(height / self._cell_size) + 1
+
+        for i in indices:
+            self._cells[self._cell_of(self.points[i])].append(i)
+
+    def _cell_of(self, point):
+        x = int((point[0] - self._x0) / self._cell_size)
+        y = int((point[1] - self._y0) / self._cell_size)
+        #clamp so that query points outside the indexed area still map to a cell
+        return (min(max(x, 0), self._x_cells - 1), min(max(y, 0), self._y_cells - 1))
+
+    def _contains(self, point):
+        return (0 <= point[0] - self._x0 < self._x_cells * self._cell_size
+                and 0 <= point[1] - self._y0 < self._y_cells * self._cell_size)
+
+    def _ring(self, cx, cy, ring):
+        #Cells at chebyshev distance 'ring' from (cx, cy), clipped to the grid
+        if ring == 0:
+            yield (cx, cy)
+            return
+        x_lo, x_hi = max(cx - ring, 0), min(cx + ring, self._x_cells - 1)
+        y_lo, y_hi = max(cy - ring + 1, 0), min(cy + ring - 1, self._y_cells - 1)
+        for y in (cy - ring, cy + ring):
+            if 0 <= y < self._y_cells:
+                for x in range(x_lo, x_hi + 1):
+                    yield (x, y)
+        for x in (cx - ring, cx + ring):
+            if 0 <= x < self._x_cells:
+                for y in range(y_lo, y_hi + 1):
+                    yield (x, y)
+
+    def _offsets(self, window, min_distance):
+        #Offsets around the query cell, dropping cells that lie entirely inside min_distance
+        key = (window, min_distance)
+        if key not in self._offset_plans:
+            self._offset_plans[key] = [(lower, dx, dy) for lower, upper, dx, dy in _sorted_offsets(window)
+                                       if upper * self._cell_size >= min_distance - 1e-5]
+        return self._offset_plans[key]
+
+    def remove(self, index):
+        self._remaining.discard(index)
+        if (len(self._remaining) >= self.MIN_REBUILD_SIZE
+                and len(self._remaining) * self.REBUILD_FRACTION < self._built_size):
+            self._build(self._remaining)
+        else:
+            cell = self._cells.get(self._cell_of(self.points[index]))
+            if cell is not None and index in cell:
+                cell.remove(index)
+
+    def nearest(self, point, min_distance=0, accept=None, fallback=False):
+        """
+        Returns the index of the closest remaining point that is at least
+        min_distance away (compared at 5 decimal places) and passes the
+        optional accept(index) filter. Ties are broken by the lowest index,
+        which matches a linear scan over the points in their original order.
+        If no remaining point qualifies, returns the closest remaining point
+        when fallback is set, and None otherwise.
+        """
+        if not self._remaining:
+            return None
+
+        cx, cy = self._cell_of(point)
+        max_ring = max(cx, self._x_cells - 1 - cx, cy, self._y_cells - 1 - cy)
+        cell_size = self._cell_size
+        cells = self._cells
+        points = self.points
+        px, py = point[0], point[1]
+        #upper bounds only hold when the query point sits inside the grid
+        skip_inner = min_distance > 0 and self._contains(point)
+
+        candidates = [] #heap of (distance, index) that are far enough away
+
+        def scan(cell):
+            for i in cells.get(cell, ()):
+                dist = math.sqrt((px - points[i][0])**2 + (py - points[i][1])**2)
+                if dist < min_distance + 1e-5 and round(dist, 5) < min_distance:
+                    continue
+                heapq.heappush(candidates, (dist, i))
+
+        def settle(bound):
+            #nothing left to scan is closer than bound, so candidates below it are final
+            while candidates and candidates[0][0] < bound:
+                dist, i = heapq.heappop(candidates)
+                if accept is None or accept(i):
+                    return i
+            return None
+
+        #Cells around the query are visited nearest first, which skips those lying
+        #entirely inside min_distance. Farther cells are visited ring by ring.
+        window = min(int(min_distance / cell_size) + 2, max_ring)
+        for lower, dx, dy in self._offsets(window, min_distance if skip_inner else 0):
+            bound = min(lower, window) * cell_size
+            if candidates and candidates[0][0] < bound:
+                found = settle(bound)
+                if found is not None:
+                    return found
+            x, y = cx + dx, cy + dy
+            if 0 <= x < self._x_cells and 0 <= y < self._y_cells:
+                scan((x, y))
+
+        for ring in range(window + 1, max_ring + 1):
+            #every point in this ring is at least (ring - 1) cells away
+            found = settle((ring - 1) * cell_size)
+            if found is not None:
+                return found
+            for cell in self._ring(cx, cy, ring):
+                scan(cell)
+
+        found = settle(math.inf)
+        if found is not None:
+            return found
+        if fallback and (min_distance > 0 or accept is not None):
+            return self.nearest(point)
+        return None
+
+    def k_nearest(self, point, k):
+        """
+        Returns the indices of the k closest remaining points, nearest first.
+        The query point itself is included if it is one of the indexed points.
+        """
+        if not self._remaining:
+            return []
+
+        cx, cy = self._cell_of(point)
+        max_ring = max(cx, self._x_cells - 1 - cx, cy, self._y_cells - 1 - cy)
+        candidates = []
+        found = []
+        for ring in range(max_ring + 2):
+            #every point not yet scanned is at least (ring - 1) cells away
+            bound = (ring - 1) * self._cell_size if ring <= max_ring else math.inf
+            while candidates and candidates[0][0] < bound and len(found) < k:
+                found.append(heapq.heappop(candidates)[1])
+            if len(found) >= k or ring > max_ring:
+                break
+            for cell in self._ring(cx, cy, ring):
+                for i in self._cells.get(cell, ()):
+                    candidate = self.points[i]
+                    dist = math.sqrt((point[0] - candidate[0])**2 + (point[1] - candidate[1])**2)
+                    heapq.heappush(candidates, (dist, i))
+
+        return found
+
+_OFFSETS = dict()
+
+def _sorted_offsets(radius):
+    """
+    Cell offsets up to 'radius' rings away, with the smallest and largest
+    possible distance (in cells) between a point in the centre cell and a
+    point in the offset cell. Sorted by the smallest distance.
+    """
+    if radius not in _OFFSETS:
+        offsets = []
+        for dx in range(-radius, radius + 1):
+            for dy in range(-radius, radius + 1):
+                lower = math.hypot(max(abs(dx) - 1, 0), max(abs(dy) - 1, 0))
+                upper = math.hypot(abs(dx) + 1, abs(dy) + 1)
+                offsets.append((lower, upper, dx, dy))
+        offsets.sort()
+        _OFFSETS[radius] = offsets
+    return _OFFSETS[radius]
@@ -12,7 +12,28 @@ class Config(object):
     APP_DIR = os.path.abspath(os.path.dirname(__file__))
     PROJECT_ROOT = os.path.abspath(os.path.join(APP_DIR, os.pardir))
     MONTLY_SUBMISSION_LIMIT = int(os.environ.get('WEB_MONTHLY_SUBMISSION_LIMIT', 27))
+    PATH_REFINEMENT_PASSES = int(os.environ.get('PATH_REFINEMENT_PASSES', 1)) #most sweeps spent shortening each color's path. 0 disables
+    PATH_ORDERING = os.environ.get('PATH_ORDERING', 'greedy') #print order strategy when a request names none: 'greedy', 'timed', 'hilbert' or 'serpentine'
+    PROCEDURE_WORKERS = int(os.environ.get('PROCEDURE_WORKERS', 4)) #processes used to optimize paths. 0 or 1 runs them in the request
+    ROBOT_GANTRY_SPEED = float(os.environ.get('ROBOT_GANTRY_SPEED', 400)) #mm/s, used to estimate run times
+    DRYING_TIME_S = float(os.environ.get('DRYING_TIME_S', 5)) #least time between dispensing neighbouring wells in 'timed' print orders
+    BATCH_MAX_WAIT_DAYS = float(os.environ.get('BATCH_MAX_WAIT_DAYS', 14)) #queued art older than this is always in a 'best' batch
+    PROCEDURE_STORE = os.environ.get('PROCEDURE_STORE', 'local') #'local' keeps procedures in web/robot/procedures, 's3' in PROCEDURE_BUCKET
+    PROCEDURE_BUCKET = os.environ.get('PROCEDURE_BUCKET', os.environ.get('IMAGE_BUCKET', None))
+    PROCEDURE_RETENTION_DAYS = int(os.environ.get('PROCEDURE_RETENTION_DAYS', 90)) #procedures no job has used for this long are deleted. 0 keeps them all
+    PATH_PRECOMPUTE_WORKERS = int(os.environ.get('PATH_PRECOMPUTE_WORKERS', 1)) #threads precomputing paths for confirmed art. 0 disables
+    PROCEDURE_JOB_WORKERS = int(os.environ.get('PROCEDURE_JOB_WORKERS', 1)) #threads generating requested procedures in the background
+    IMAGE_UPLOAD_WORKERS = int(os.environ.get('IMAGE_UPLOAD_WORKERS', 2)) #threads uploading submitted art images. 0 uploads them in the request
+    IMAGE_UPLOAD_QUEUE_SIZE = int(os.environ.get('IMAGE_UPLOAD_QUEUE_SIZE', 32)) #uploads waiting for a thread, past which they run in the request
+    IMAGE_UPLOAD_RETRIES = int(os.environ.get('IMAGE_UPLOAD_RETRIES', 3))
+    IMAGE_UPLOAD_RETRY_S = float(os.environ.get('IMAGE_UPLOAD_RETRY_S', 1)) #wait before the first retry, doubled for each one after
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    PROCEDURE_ENGINE_OPTIONS = { #connection pool of the engine make_procedure uses outside the web app, as in the CLI
+        'pool_size': int(os.environ.get('PROCEDURE_DB_POOL_SIZE', 2)),
+        'max_overflow': int(os.environ.get('PROCEDURE_DB_MAX_OVERFLOW', 2)),
+        'pool_recycle': int(os.environ.get('PROCEDURE_DB_POOL_RECYCLE', 1800)), #seconds
+        'pool_pre_ping': True,
+    }
     CACHE_TYPE = 'SimpleCache'
 
     """CORS settings. Origins handled below."""
@@ -17,6 +17,7 @@ app.subject = function() {
 app.model = function() {
 	let that = {};
 	const subject = this.subject();
+	const JOB_POLL_INTERVAL_MS = 1000;
 
 	function Jobs() {
 		let that = {};
@@ -299,7 +300,7 @@ app.model = function() {
 
 	that.jobs = {
 		get: function() {
-			let request_url = 'print_jobs?unprinted_only=false&confirmed_only=true'
+			let request_url = 'print_jobs?unprinted_only=false&confirmed_only=true&image_size=thumbnail'
 			if(location.selected["location"] && location.selected["location"]!='ALL'){
 				request_url = request_url + '&location=' + location.selected["location"];
 			}
@@ -371,11 +372,7 @@ app.model = function() {
 				}
 			})
 			.done(function(data, textStatus, jqXHR) {
-				subject.notifyObservers({
-					type: 'PRINT_REQ_SUBMIT'
-					, error: false
-					, payload: data
-				});
+				that.jobs.poll(data.job_id);
 			})
 			.fail(function(jqXHR, textStatus, errorThrown) {
 				if(jqXHR.status==401){
@@ -394,6 +391,49 @@ app.model = function() {
 				}
 			});
 		}
+		, poll: function(job_id) {
+			//procedures are generated in the background. Check on the job until it is done
+			$.ajax({
+				url: 'jobs/' + job_id
+				, type: 'GET'
+				, dataType: 'json'
+			})
+			.done(function(data, textStatus, jqXHR) {
+				if(data.status == 'Generating'){
+					setTimeout(function() { that.jobs.poll(job_id); }, JOB_POLL_INTERVAL_MS);
+					return;
+				}
+				if(data.status == 'Ready'){
+					subject.notifyObservers({
+						type: 'PRINT_REQ_SUBMIT'
+						, error: false
+						, payload: {'msg': data.msg, 'procedure_uri': data.procedure_uri}
+					});
+				} else {
+					subject.notifyObservers({
+						type: 'PRINT_REQ_SUBMIT'
+						, error: true
+						, payload: [{'code': 'procedure_failed', 'title': data.msg.join('\n')}]
+					});
+				}
+			})
+			.fail(function(jqXHR, textStatus, errorThrown) {
+				if(jqXHR.status==401){
+					subject.notifyObservers({
+						type: 'LOGIN_REQUIRED'
+						, error: true
+						, payload: jqXHR.responseJSON.errors
+					});
+				}
+				if(jqXHR.status==404){
+					subject.notifyObservers({
+						type: 'PRINT_REQ_SUBMIT'
+						, error: true
+						, payload: jqXHR.responseJSON.errors
+					});
+				}
+			});
+		}
 
 	};
 
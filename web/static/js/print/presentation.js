@@ -13,7 +13,8 @@ app.presentation = function(view, model) {
 
 	const codeToMessage = {
 		'joblist_empty': 'Select a job to manage',
-		'pipette_invalid': 'Multi-channel pipettes can only handle one artpiece per job. Pick one at a time.'
+		'pipette_invalid': 'Multi-channel pipettes can only handle one artpiece per job. Pick one at a time.',
+		'procedure_failed': 'The procedure could not be generated. There may be no new art to print.'
 	};
 
 	const emptyJobListMessage = '[Click A Row To Select]';